@@ -751,6 +751,7 @@ def create_pull_request(
     )
 
     Session().commit()
+    PullRequestModel().schedule_diff_cache_generation(pull_request)
     data = {
         'msg': 'Created new pull request `{}`'.format(title),
         'pull_request_id': pull_request.pull_request_id,
@@ -881,11 +882,14 @@ def update_pull_request(
                 'only state {} is allowed.'.format(
                     pull_request.pull_request_state, PullRequest.STATE_CREATED))
 
+        update_response = None
         with pull_request.set_state(PullRequest.STATE_UPDATING):
             if PullRequestModel().has_valid_update_type(pull_request):
                 update_response = PullRequestModel().update_commits(pull_request)
                 commit_changes = update_response.changes or commit_changes
             Session().commit()
+        if update_response and update_response.executed:
+            PullRequestModel().schedule_diff_cache_generation(pull_request)
 
     reviewers_changes = {"added": [], "removed": []}
     if reviewers:
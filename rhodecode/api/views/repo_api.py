@@ -389,6 +389,10 @@ def get_repo_changesets(request, apiuser, repoid, start_rev, limit,
         log.exception('Fetching of commits failed')
         raise JSONRPCError('Error occurred during commit fetching')
 
+    if limit != -1:
+        # only the ids of the requested commits are fetched
+        commits = commits[:limit]
+
     ret = []
     for cnt, commit in enumerate(commits):
         if cnt >= limit != -1:
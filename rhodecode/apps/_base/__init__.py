@@ -287,6 +287,8 @@ class RepoAppView(BaseAppView):
 
 
 class PathFilter(object):
+    raw_patch_disabled_msg = \
+        '# Repository has user-specific filters, raw patch generation is disabled.'
 
     # Expects and instance of BasePathPermissionChecker or None
     def __init__(self, permission_checker):
@@ -300,6 +302,9 @@ class PathFilter(object):
     def filter_patchset(self, patchset):
         if not self.permission_checker or not patchset:
             return patchset, False
+        if isinstance(patchset, diffs.PatchStream):
+            # hidden changes are known once the stream was rendered
+            return patchset.filter(self.permission_checker.has_access), None
         had_filtered = False
         filtered_patchset = []
         for patch in patchset:
@@ -319,6 +324,8 @@ class PathFilter(object):
         filtered_patchset, has_hidden_changes = self.filter_patchset(patchset)
         result = diffset.render_patchset(
             filtered_patchset, source_ref=source_ref, target_ref=target_ref)
+        if isinstance(filtered_patchset, diffs.PatchStream):
+            has_hidden_changes = filtered_patchset.has_filtered
         result.has_hidden_changes = has_hidden_changes
         return result
 
@@ -328,7 +335,19 @@ class PathFilter(object):
         elif self.permission_checker.has_full_access:
             return diff_processor.as_raw()
         else:
-            return '# Repository has user-specific filters, raw patch generation is disabled.'
+            return self.raw_patch_disabled_msg
+
+    def get_raw_patch_streamed(self, get_diff_streamed, *args, **kwargs):
+        """
+        Returns chunks of the raw patch created by `get_diff_streamed`, it is
+        only called if the raw patch is allowed by the path permissions.
+        """
+        if self.permission_checker is None:
+            return get_diff_streamed(*args, **kwargs)
+        elif self.permission_checker.has_full_access:
+            return get_diff_streamed(*args, **kwargs)
+        else:
+            return iter([self.raw_patch_disabled_msg])
 
     @property
     def is_enabled(self):
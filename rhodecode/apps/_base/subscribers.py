@@ -37,7 +37,7 @@ def trigger_user_permission_flush(event):
     for user_id in affected_user_ids:
         cache_namespace_uid = 'cache_user_auth.{}'.format(user_id)
         del_keys = rc_cache.clear_cache_namespace('cache_perms', cache_namespace_uid)
-        log.debug('Deleted %s cache keys for user_id: %s', del_keys, user_id)
+        log.debug('Cleared cache keys for user_id: %s, deleted: %s', user_id, del_keys)
 
 
 def includeme(config):
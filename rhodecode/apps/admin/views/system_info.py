@@ -146,6 +146,10 @@ class AdminSystemInfoSettingsView(BaseAppView):
             (_('Search location'), val('search')['location'], state('search')),
             ('', '', ''),  # spacer
 
+            # Caches of this worker
+            (_('Cache stats'), val('cache_stats')['text'], state('cache_stats')),
+            ('', '', ''),  # spacer
+
             # VCS specific
             (_('VCS Backends'), val('vcs_backends'), state('vcs_backends')),
             (_('VCS Server'), val('vcs_server')['text'], state('vcs_server')),
@@ -1260,7 +1260,10 @@ class UsersView(UserAppView):
         cache_namespace_uid = 'cache_user_auth.{}'.format(self.db_user.user_id)
         del_keys = rc_cache.clear_cache_namespace('cache_perms', cache_namespace_uid)
 
-        h.flash(_("Deleted {} cache keys").format(del_keys), category='success')
+        if del_keys is None:
+            h.flash(_("Invalidated cache keys"), category='success')
+        else:
+            h.flash(_("Deleted {} cache keys").format(del_keys), category='success')
 
         return HTTPFound(h.route_path(
             'edit_user_caches', user_id=c.user.user_id))
@@ -31,6 +31,12 @@ def admin_routes(config):
     config.add_route(
         name='ops_redirect_test',
         pattern='/redirect')
+    config.add_route(
+        name='ops_vcs_call_stats',
+        pattern='/vcs-call-stats')
+    config.add_route(
+        name='ops_cache_stats',
+        pattern='/cache-stats')
 
 
 def includeme(config):
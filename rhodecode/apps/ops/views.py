@@ -18,6 +18,7 @@
 # RhodeCode Enterprise Edition, including its added features, Support services,
 # and proprietary license terms, please see https://rhodecode.com/licenses/
 
+import os
 import time
 import logging
 
@@ -26,6 +27,10 @@ from pyramid.httpexceptions import HTTPFound
 
 from rhodecode.apps._base import BaseAppView
 from rhodecode.lib import helpers as h
+from rhodecode.lib.auth import LoginRequired, HasPermissionAllDecorator
+from rhodecode.lib.rc_cache.stats import cache_stats_registry, get_memory_usage
+from rhodecode.lib.vcs.call_stats import call_stats_registry, LATENCY_BUCKETS
+from rhodecode.lib.vcs.compression import compression_stats
 
 log = logging.getLogger(__name__)
 
@@ -87,3 +92,38 @@ class OpsView(BaseAppView):
         """
         redirect_to = self.request.GET.get('to') or h.route_path('home')
         raise HTTPFound(redirect_to)
+
+    @LoginRequired()
+    @HasPermissionAllDecorator('hg.admin')
+    @view_config(
+        route_name='ops_vcs_call_stats', request_method='GET',
+        renderer='json_ext')
+    def ops_vcs_call_stats(self):
+        """
+        Latency histograms of the VCSServer calls made by this worker process,
+        per backend and method, slowest in total first.
+        """
+        return {
+            'pid': os.getpid(),
+            'latency_buckets': LATENCY_BUCKETS,
+            'methods': call_stats_registry.get_stats(),
+            'compression': compression_stats.get_data(),
+        }
+
+    @LoginRequired()
+    @HasPermissionAllDecorator('hg.admin')
+    @view_config(
+        route_name='ops_cache_stats', request_method='GET',
+        renderer='json_ext')
+    def ops_cache_stats(self):
+        """
+        Hits, misses, compute time and value sizes of the cached functions of
+        this worker process, per region and namespace, and the memory used by
+        its memory regions.
+        """
+        return {
+            'pid': os.getpid(),
+            'regions': cache_stats_registry.get_region_stats(),
+            'functions': cache_stats_registry.get_stats(),
+            'memory_regions': get_memory_usage(),
+        }
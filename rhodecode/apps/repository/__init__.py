@@ -46,6 +46,10 @@ def includeme(config):
         name='repo_commit',
         pattern='/{repo_name:.*?[^/]}/changeset/{commit_id}', repo_route=True)
 
+    config.add_route(
+        name='repo_commit_file_diff',
+        pattern='/{repo_name:.*?[^/]}/changeset/{commit_id}/file-diff', repo_route=True)
+
     config.add_route(
         name='repo_commit_children',
         pattern='/{repo_name:.*?[^/]}/changeset_children/{commit_id}', repo_route=True)
@@ -255,6 +259,11 @@ def includeme(config):
         pattern='/{repo_name:.*?[^/]}/pull-request/{pull_request_id:\d+}',
         repo_route=True)
 
+    config.add_route(
+        name='pullrequest_file_diff',
+        pattern='/{repo_name:.*?[^/]}/pull-request/{pull_request_id:\d+}/file-diff',
+        repo_route=True)
+
     config.add_route(
         name='pullrequest_show_all',
         pattern='/{repo_name:.*?[^/]}/pull-request',
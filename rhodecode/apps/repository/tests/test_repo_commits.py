@@ -34,6 +34,7 @@ def route_path(name, params=None, **kwargs):
         'repo_commit_patch': '/{repo_name}/changeset-patch/{commit_id}',
         'repo_commit_download': '/{repo_name}/changeset-download/{commit_id}',
         'repo_commit_data': '/{repo_name}/changeset-data/{commit_id}',
+        'repo_commit_file_diff': '/{repo_name}/changeset/{commit_id}/file-diff',
         'repo_compare': '/{repo_name}/compare/{source_ref_type}@{source_ref}...{target_ref_type}@{target_ref}',
     }[name].format(**kwargs)
 
@@ -53,6 +54,13 @@ class TestRepoCommitView(object):
         response.mustcontain(commit_id)
         response.mustcontain('No newline at end of file')
 
+    def test_file_diff_of_not_cached_file(self, backend):
+        commit_id = self.commit_id[backend.alias]
+        self.app.get(route_path(
+            'repo_commit_file_diff', repo_name=backend.repo_name,
+            commit_id=commit_id, params={'f_path': 'not-existing-file'}),
+            status=404)
+
     def test_show_raw(self, backend):
         commit_id = self.commit_id[backend.alias]
         response = self.app.get(route_path(
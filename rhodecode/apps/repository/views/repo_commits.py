@@ -35,8 +35,8 @@ from rhodecode.lib.auth import (
 
 from rhodecode.lib.compat import OrderedDict
 from rhodecode.lib.diffs import (
-    cache_diff, load_cached_diff, diff_cache_exist, get_diff_context,
-    get_diff_whitespace_flag)
+    cache_diff, load_cached_diff, load_cached_diff_file, diff_cache_exist,
+    get_diff_context, get_diff_whitespace_flag)
 from rhodecode.lib.exceptions import StatusChangeOnClosedPullRequestError
 import rhodecode.lib.helpers as h
 from rhodecode.lib.utils2 import safe_unicode, str2bool
@@ -73,6 +73,12 @@ class RepoCommitsView(RepoAppView):
         log.debug('Diff caching enabled: %s', caching_enabled)
         return caching_enabled
 
+    def _get_diff_query(self):
+        return dict(
+            (key, self.request.GET[key])
+            for key in ['fulldiff', 'fullcontext', 'ignorews']
+            if key in self.request.GET)
+
     def _commit(self, commit_id_range, method):
         _ = self.request.translate
         c = self.load_default_context()
@@ -126,6 +132,7 @@ class RepoCommitsView(RepoAppView):
         c.commit_statuses = ChangesetStatus.STATUSES
         c.inline_comments = []
         c.files = []
+        c.lazy_load_url = None
 
         c.statuses = []
         c.comments = []
@@ -174,6 +181,13 @@ class RepoCommitsView(RepoAppView):
 
                 caching_enabled = self._is_diff_cache_enabled(self.db_repo)
                 force_recache = str2bool(self.request.GET.get('force_recache'))
+                if caching_enabled:
+                    # diffs of files over the lazy load limit are loaded
+                    # from the cache by the page
+                    c.lazy_load_url = h.route_path(
+                        'repo_commit_file_diff', repo_name=self.db_repo_name,
+                        commit_id=commit.raw_id,
+                        _query=self._get_diff_query())
 
                 cached_diff = None
                 if caching_enabled:
@@ -183,7 +197,7 @@ class RepoCommitsView(RepoAppView):
                 if not force_recache and has_proper_diff_cache:
                     diffset = cached_diff['diff']
                 else:
-                    vcs_diff = self.rhodecode_vcs_repo.get_diff(
+                    vcs_diff = self.rhodecode_vcs_repo.get_diff_lazy(
                         commit1, commit2,
                         ignore_whitespace=hide_whitespace_changes,
                         context=diff_context)
@@ -192,7 +206,7 @@ class RepoCommitsView(RepoAppView):
                         vcs_diff, format='newdiff', diff_limit=diff_limit,
                         file_limit=file_limit, show_full_diff=c.fulldiff)
 
-                    _parsed = diff_processor.prepare()
+                    _parsed = diff_processor.iter_patches()
 
                     diffset = codeblocks.DiffSet(
                         repo_name=self.db_repo_name,
@@ -208,6 +222,10 @@ class RepoCommitsView(RepoAppView):
 
                 c.limited_diff = diffset.limited_diff
                 c.changes[commit.raw_id] = diffset
+            elif method in ['raw', 'download']:
+                # raw diffs are streamed, only the diff of the last commit
+                # is used for the response
+                diff = (commit1, commit2)
             else:
                 # TODO(marcink): no cache usage here...
                 _diff = self.rhodecode_vcs_repo.get_diff(
@@ -228,8 +246,14 @@ class RepoCommitsView(RepoAppView):
             c.parent_tmpl = ''.join(
                 '# Parent  %s\n' % x.raw_id for x in c.commit.parents)
 
+        if method in ['raw', 'download']:
+            commit1, commit2 = diff
+            diff = self.path_filter.get_raw_patch_streamed(
+                self.rhodecode_vcs_repo.get_diff_streamed, commit1, commit2,
+                ignore_whitespace=hide_whitespace_changes, context=diff_context)
+
         if method == 'download':
-            response = Response(diff)
+            response = Response(app_iter=diff)
             response.content_type = 'text/plain'
             response.content_disposition = (
                 'attachment; filename=%s.diff' % commit_id_range[:12])
@@ -243,7 +267,7 @@ class RepoCommitsView(RepoAppView):
             response.content_type = 'text/plain'
             return response
         elif method == 'raw':
-            response = Response(diff)
+            response = Response(app_iter=diff)
             response.content_type = 'text/plain'
             return response
         elif method == 'show':
@@ -272,6 +296,48 @@ class RepoCommitsView(RepoAppView):
         commit_id = self.request.matchdict['commit_id']
         return self._commit(commit_id, method='show')
 
+    @LoginRequired()
+    @HasRepoPermissionAnyDecorator(
+        'repository.read', 'repository.write', 'repository.admin')
+    @view_config(
+        route_name='repo_commit_file_diff', request_method='GET',
+        renderer='rhodecode:templates/codeblocks/filediff.mako')
+    def repo_commit_file_diff(self):
+        """
+        Renders the diff of a single file of a commit, loaded from the diff
+        cache written when the commit page was shown.
+        """
+        c = self.load_default_context()
+        commit_id = self.request.matchdict['commit_id']
+        f_path = self._get_f_path(self.request.GET)
+
+        # the same options as the ones of the commit page
+        fulldiff = self.request.GET.get('fulldiff')
+        diff_context = get_diff_context(self.request)
+        hide_whitespace_changes = get_diff_whitespace_flag(self.request)
+
+        try:
+            commit = self.rhodecode_vcs_repo.get_commit(commit_id=commit_id)
+        except CommitDoesNotExistError:
+            raise HTTPNotFound()
+
+        filediff = None
+        if f_path and self._is_diff_cache_enabled(self.db_repo):
+            cache_path = self.rhodecode_vcs_repo.get_create_shadow_cache_pr_path(
+                self.db_repo)
+            cache_file_path = diff_cache_exist(
+                cache_path, 'diff', commit.raw_id,
+                hide_whitespace_changes, diff_context, fulldiff)
+            filediff = load_cached_diff_file(cache_file_path, f_path)
+        if filediff is None:
+            raise HTTPNotFound()
+
+        c.filediff = filediff
+        c.use_comments = True
+        c.inline_comments = CommentsModel().get_inline_comments(
+            self.db_repo.repo_id, revision=commit.raw_id)
+        return self._get_template_context(c)
+
     @LoginRequired()
     @HasRepoPermissionAnyDecorator(
         'repository.read', 'repository.write', 'repository.admin')
@@ -288,7 +288,7 @@ class RepoCompareView(RepoAppView):
                 h.route_path('repo_compare_select',
                              repo_name=self.db_repo_name))
 
-        txt_diff = source_repo.scm_instance().get_diff(
+        txt_diff = source_repo.scm_instance().get_diff_lazy(
             commit1=source_commit, commit2=target_commit,
             path=target_path, path1=source_path,
             ignore_whitespace=hide_whitespace_changes, context=diff_context)
@@ -296,7 +296,7 @@ class RepoCompareView(RepoAppView):
         diff_processor = diffs.DiffProcessor(
             txt_diff, format='newdiff', diff_limit=diff_limit,
             file_limit=file_limit, show_full_diff=c.fulldiff)
-        _parsed = diff_processor.prepare()
+        _parsed = diff_processor.iter_patches()
 
         diffset = codeblocks.DiffSet(
             repo_name=source_repo.repo_name,
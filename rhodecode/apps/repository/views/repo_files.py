@@ -776,10 +776,7 @@ class RepoFilesView(RepoAppView):
         if disposition == 'attachment':
             disposition = self._get_attachement_headers(f_path)
 
-        def stream_node():
-            yield file_node.raw_bytes
-
-        response = Response(app_iter=stream_node())
+        response = Response(app_iter=file_node.stream_bytes())
         response.content_disposition = disposition
         response.content_type = mimetype
 
@@ -814,13 +811,12 @@ class RepoFilesView(RepoAppView):
                 file_node = lf_node
 
         disposition = self._get_attachement_headers(f_path)
+        # mimetype detection might need the content, check it before streaming
+        mimetype = file_node.mimetype
 
-        def stream_node():
-            yield file_node.raw_bytes
-
-        response = Response(app_iter=stream_node())
+        response = Response(app_iter=file_node.stream_bytes())
         response.content_disposition = disposition
-        response.content_type = file_node.mimetype
+        response.content_type = mimetype
 
         charset = self._get_default_encoding(c)
         if charset:
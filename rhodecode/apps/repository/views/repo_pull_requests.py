@@ -33,15 +33,16 @@ from rhodecode.apps._base import RepoAppView, DataGridAppView
 
 from rhodecode.lib import helpers as h, diffs, codeblocks, channelstream
 from rhodecode.lib.base import vcs_operation_context
-from rhodecode.lib.diffs import load_cached_diff, cache_diff, diff_cache_exist
+from rhodecode.lib.diffs import (
+    load_cached_diff, load_cached_diff_file, cache_diff, diff_cache_exist)
 from rhodecode.lib.ext_json import json
 from rhodecode.lib.auth import (
     LoginRequired, HasRepoPermissionAny, HasRepoPermissionAnyDecorator,
     NotAnonymous, CSRFRequired)
-from rhodecode.lib.utils2 import str2bool, safe_str, safe_unicode
+from rhodecode.lib.utils2 import str2bool, safe_unicode
 from rhodecode.lib.vcs.backends.base import EmptyCommit, UpdateFailureReason
 from rhodecode.lib.vcs.exceptions import (CommitDoesNotExistError,
-    RepositoryRequirementError, EmptyRepositoryError)
+    EmptyRepositoryError)
 from rhodecode.model.changeset_status import ChangesetStatusModel
 from rhodecode.model.comment import CommentsModel
 from rhodecode.model.db import (func, or_, PullRequest, PullRequestVersion,
@@ -208,36 +209,47 @@ class RepoPullRequestsView(RepoAppView, DataGridAppView):
         log.debug('Diff caching enabled: %s', caching_enabled)
         return caching_enabled
 
+    def _get_display_inline_comments(self, inline_comments, at_version_num):
+        # if we use version, then do not show later comments
+        # than current version
+        display_inline_comments = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        for co in inline_comments:
+            if at_version_num:
+                # pick comments that are at least UPTO given version, so we
+                # don't render comments for higher version
+                should_render = co.pull_request_version_id and \
+                                co.pull_request_version_id <= at_version_num
+            else:
+                # showing all, for 'latest'
+                should_render = True
+
+            if should_render:
+                display_inline_comments[co.f_path][co.line_no].append(co)
+        return display_inline_comments
+
+    def _get_diff_query(self):
+        return dict(
+            (key, self.request.GET[key])
+            for key in ['version', 'from_version', 'fulldiff', 'fullcontext',
+                        'ignorews']
+            if key in self.request.GET)
+
     def _get_diffset(self, source_repo_name, source_repo,
                      source_ref_id, target_ref_id,
                      target_commit, source_commit, diff_limit, file_limit,
                      fulldiff, hide_whitespace_changes, diff_context):
 
-        vcs_diff = PullRequestModel().get_diff(
-            source_repo, source_ref_id, target_ref_id,
-            hide_whitespace_changes, diff_context)
-
-        diff_processor = diffs.DiffProcessor(
-            vcs_diff, format='newdiff', diff_limit=diff_limit,
-            file_limit=file_limit, show_full_diff=fulldiff)
-
-        _parsed = diff_processor.prepare()
-
-        diffset = codeblocks.DiffSet(
-            repo_name=self.db_repo_name,
-            source_repo_name=source_repo_name,
-            source_node_getter=codeblocks.diffset_node_getter(target_commit),
-            target_node_getter=codeblocks.diffset_node_getter(source_commit),
-        )
-        diffset = self.path_filter.render_patchset_filtered(
-            diffset, _parsed, target_commit.raw_id, source_commit.raw_id)
-
-        return diffset
+        return PullRequestModel().get_diffset(
+            self.db_repo_name, source_repo_name, source_repo,
+            source_ref_id, target_ref_id, target_commit, source_commit,
+            diff_limit, file_limit, fulldiff, hide_whitespace_changes,
+            diff_context, path_filter=self.path_filter)
 
     def _get_range_diffset(self, source_scm, source_repo,
                            commit1, commit2, diff_limit, file_limit,
                            fulldiff, hide_whitespace_changes, diff_context):
-        vcs_diff = source_scm.get_diff(
+        vcs_diff = source_scm.get_diff_lazy(
             commit1, commit2,
             ignore_whitespace=hide_whitespace_changes,
             context=diff_context)
@@ -246,7 +258,7 @@ class RepoPullRequestsView(RepoAppView, DataGridAppView):
             vcs_diff, format='newdiff', diff_limit=diff_limit,
             file_limit=file_limit, show_full_diff=fulldiff)
 
-        _parsed = diff_processor.prepare()
+        _parsed = diff_processor.iter_patches()
 
         diffset = codeblocks.DiffSet(
             repo_name=source_repo.repo_name,
@@ -432,22 +444,8 @@ class RepoPullRequestsView(RepoAppView, DataGridAppView):
 
         c.versions = versions + [latest_ver]
 
-        # if we use version, then do not show later comments
-        # than current version
-        display_inline_comments = collections.defaultdict(
-            lambda: collections.defaultdict(list))
-        for co in inline_comments:
-            if c.at_version_num:
-                # pick comments that are at least UPTO given version, so we
-                # don't render comments for higher version
-                should_render = co.pull_request_version_id and \
-                                co.pull_request_version_id <= c.at_version_num
-            else:
-                # showing all, for 'latest'
-                should_render = True
-
-            if should_render:
-                display_inline_comments[co.f_path][co.line_no].append(co)
+        display_inline_comments = self._get_display_inline_comments(
+            inline_comments, c.at_version_num)
 
         # load diff data into template context, if we use compare mode then
         # diff is calculated based on changes between versions of PR
@@ -493,20 +491,24 @@ class RepoPullRequestsView(RepoAppView, DataGridAppView):
         c.commits_source_repo = commits_source_repo
         c.ancestor = None  # set it to None, to hide it from PR view
 
-        # empty version means latest, so we keep this to prevent
-        # double caching
-        version_normalized = version or 'latest'
-        from_version_normalized = from_version or 'latest'
-
         cache_path = self.rhodecode_vcs_repo.get_create_shadow_cache_pr_path(target_repo)
-        cache_file_path = diff_cache_exist(
-            cache_path, 'pull_request', pull_request_id, version_normalized,
-            from_version_normalized, source_ref_id, target_ref_id,
+        cache_file_path = PullRequestModel().get_diff_cache_file_path(
+            self.rhodecode_vcs_repo, target_repo, pull_request_id, version,
+            from_version, source_ref_id, target_ref_id,
             hide_whitespace_changes, diff_context, c.fulldiff)
 
         caching_enabled = self._is_diff_cache_enabled(c.target_repo)
         force_recache = self.get_recache_flag()
 
+        c.lazy_load_url = None
+        if caching_enabled:
+            # diffs of files over the lazy load limit are loaded from the
+            # cache by the page
+            c.lazy_load_url = h.route_path(
+                'pullrequest_file_diff', repo_name=self.db_repo_name,
+                pull_request_id=pull_request_id,
+                _query=self._get_diff_query())
+
         cached_diff = None
         if caching_enabled:
             cached_diff = load_cached_diff(cache_file_path)
@@ -681,42 +683,86 @@ class RepoPullRequestsView(RepoAppView, DataGridAppView):
 
         return self._get_template_context(c)
 
+    @LoginRequired()
+    @HasRepoPermissionAnyDecorator(
+        'repository.read', 'repository.write', 'repository.admin')
+    @view_config(
+        route_name='pullrequest_file_diff', request_method='GET',
+        renderer='rhodecode:templates/codeblocks/filediff.mako')
+    def pull_request_file_diff(self):
+        """
+        Renders the diff of a single file of a pull request, loaded from the
+        diff cache written when the pull request page was shown.
+        """
+        c = self.load_default_context()
+        pull_request_id = self.request.matchdict['pull_request_id']
+        f_path = self._get_f_path(self.request.GET)
+
+        # the same options as the ones of the pull request page
+        version = self.request.GET.get('version')
+        from_version = self.request.GET.get('from_version') or version
+        fulldiff = str2bool(self.request.GET.get('fulldiff'))
+        diff_context = diffs.get_diff_context(self.request)
+        hide_whitespace_changes = diffs.get_diff_whitespace_flag(self.request)
+
+        (pull_request_latest,
+         pull_request_at_ver,
+         pull_request_display_obj,
+         at_version) = PullRequestModel().get_pr_version(
+            pull_request_id, version=version)
+        target_repo = pull_request_at_ver.target_repo
+        if self.db_repo_name != target_repo.repo_name:
+            raise HTTPNotFound()
+
+        (prev_pull_request_latest,
+         prev_pull_request_at_ver,
+         prev_pull_request_display_obj,
+         prev_at_version) = PullRequestModel().get_pr_version(
+            pull_request_id, version=from_version)
+
+        source_ref_id = pull_request_at_ver.source_ref_parts.commit_id
+        target_ref_id = pull_request_at_ver.target_ref_parts.commit_id
+        if at_version != prev_at_version:
+            # in compare switch the diff base to latest commit from prev version
+            target_ref_id = prev_pull_request_display_obj.revisions[0]
+
+        filediff = None
+        if f_path and self._is_diff_cache_enabled(target_repo):
+            cache_file_path = PullRequestModel().get_diff_cache_file_path(
+                self.rhodecode_vcs_repo, target_repo,
+                pull_request_latest.pull_request_id, version, from_version,
+                source_ref_id, target_ref_id,
+                hide_whitespace_changes, diff_context, fulldiff)
+            filediff = load_cached_diff_file(cache_file_path, f_path)
+        if filediff is None:
+            raise HTTPNotFound()
+
+        # used by the rendered comments
+        c.at_version_num = (at_version
+                            if at_version and at_version != 'latest'
+                            else None)
+        c.versions = pull_request_display_obj.versions() + [
+            PullRequest.get_pr_display_object(
+                pull_request_latest, pull_request_latest)]
+
+        q = CommentsModel()._all_inline_comments_of_pull_request(
+            pull_request_latest)
+        q = q.filter(ChangesetComment.f_path == f_path)
+        q = q.order_by(ChangesetComment.comment_id.asc())
+
+        c.filediff = filediff
+        c.use_comments = True
+        c.inline_comments = self._get_display_inline_comments(
+            q, c.at_version_num)
+        return self._get_template_context(c)
+
     def get_commits(
             self, commits_source_repo, pull_request_at_ver, source_commit,
             source_ref_id, source_scm, target_commit, target_ref_id, target_scm):
-        commit_cache = collections.OrderedDict()
-        missing_requirements = False
-        try:
-            pre_load = ["author", "branch", "date", "message", "parents"]
-            show_revs = pull_request_at_ver.revisions
-            for rev in show_revs:
-                comm = commits_source_repo.get_commit(
-                    commit_id=rev, pre_load=pre_load)
-                commit_cache[comm.raw_id] = comm
-
-            # Order here matters, we first need to get target, and then
-            # the source
-            target_commit = commits_source_repo.get_commit(
-                commit_id=safe_str(target_ref_id))
-
-            source_commit = commits_source_repo.get_commit(
-                commit_id=safe_str(source_ref_id))
-        except CommitDoesNotExistError:
-            log.warning(
-                'Failed to get commit from `{}` repo'.format(
-                    commits_source_repo), exc_info=True)
-        except RepositoryRequirementError:
-            log.warning(
-                'Failed to get all required data from repo', exc_info=True)
-            missing_requirements = True
-        ancestor_commit = None
-        try:
-            ancestor_id = source_scm.get_common_ancestor(
-                source_commit.raw_id, target_commit.raw_id, target_scm)
-            ancestor_commit = source_scm.get_commit(ancestor_id)
-        except Exception:
-            ancestor_commit = None
-        return ancestor_commit, commit_cache, missing_requirements, source_commit, target_commit
+        return PullRequestModel().get_diff_commits(
+            commits_source_repo, pull_request_at_ver, source_commit,
+            source_ref_id, source_scm, target_commit, target_ref_id,
+            target_scm)
 
     def assure_not_empty_repo(self):
         _ = self.request.translate
@@ -1013,6 +1059,7 @@ class RepoPullRequestsView(RepoAppView, DataGridAppView):
                 auth_user=self._rhodecode_user
             )
             Session().commit()
+            PullRequestModel().schedule_diff_cache_generation(pull_request)
 
             h.flash(_('Successfully opened new pull request'),
                     category='success')
@@ -1108,6 +1155,7 @@ class RepoPullRequestsView(RepoAppView, DataGridAppView):
             resp = PullRequestModel().update_commits(pull_request)
 
         if resp.executed:
+            PullRequestModel().schedule_diff_cache_generation(pull_request)
 
             if resp.target_changed and resp.source_changed:
                 changed = 'target and source repositories'
@@ -252,6 +252,7 @@ def includeme(config):
     config.include('pyramid_mako')
     config.include('pyramid_beaker')
     config.include('rhodecode.lib.rc_cache')
+    config.include('rhodecode.lib.highlight_pool')
 
     config.include('rhodecode.apps._base.navigation')
     config.include('rhodecode.apps._base.subscribers')
@@ -428,6 +429,11 @@ def sanitize_settings_and_apply_defaults(global_config, settings):
     _bool_setting(settings, 'is_test', 'false')
     _bool_setting(settings, 'gzip_responses', 'false')
 
+    # syntax highlighting of diffs in worker processes
+    _int_setting(settings, 'highlight_pool.processes', 0)
+    _int_setting(settings, 'highlight_pool.timeout', 10)
+    _int_setting(settings, 'highlight_pool.queue_timeout', 30)
+
     # Call split out functions that sanitize settings for each topic.
     _sanitize_appenlight_settings(settings)
     _sanitize_vcs_settings(settings)
@@ -564,12 +570,16 @@ def _sanitize_vcs_settings(settings):
     _string_setting(settings, 'vcs.server', '')
     _string_setting(settings, 'vcs.server.log_level', 'debug')
     _string_setting(settings, 'vcs.server.protocol', 'http')
+    _string_setting(settings, 'vcs.server.compression', '')
     _bool_setting(settings, 'startup.import_repos', 'false')
     _bool_setting(settings, 'vcs.hooks.direct_calls', 'false')
     _bool_setting(settings, 'vcs.server.enable', 'true')
+    _bool_setting(settings, 'vcs.server.batch_calls', 'false')
+    _bool_setting(settings, 'vcs.git.commit_index', 'true')
     _bool_setting(settings, 'vcs.start_server', 'false')
     _list_setting(settings, 'vcs.backends', 'hg, git, svn')
     _int_setting(settings, 'vcs.connection_timeout', 3600)
+    _int_setting(settings, 'vcs.server.compression_min_size', 4096)
 
     # Support legacy values of vcs.scm_app_implementation. Legacy
     # configurations may use 'rhodecode.lib.middleware.utils.scm_app_http', or
@@ -599,6 +609,20 @@ def _sanitize_cache_settings(settings):
         'exception_tracker.store_path',
         temp_store, lower=False, default_when_empty=True)
 
+    # log a summary of the cache lookups of every request
+    _bool_setting(settings, 'cache_stats.log_requests', 'false')
+
+    # cache invalidation generations, `file` and `redis` are opt-in as the
+    # file store is local to a node
+    _string_setting(
+        settings,
+        'cache_invalidation.backend',
+        'database')
+    _string_setting(
+        settings,
+        'cache_invalidation.path',
+        os.path.join(default_cache_dir, 'cache_generations'), lower=False)
+
     # cache_perms
     _string_setting(
         settings,
@@ -626,6 +650,10 @@ def _sanitize_cache_settings(settings):
         settings,
         'rc_cache.cache_repo.arguments.filename',
         os.path.join(default_cache_dir, 'rc_cache_2'), lower=False)
+    _bool_setting(
+        settings,
+        'rc_cache.cache_repo.stale_while_revalidate',
+        'false')
 
     # cache_license
     _string_setting(
@@ -655,6 +683,46 @@ def _sanitize_cache_settings(settings):
         'rc_cache.cache_repo_longterm.max_size',
         10000)
 
+    # cache_vcs_calls memory, 24H, results of immutable VCSServer calls
+    _string_setting(
+        settings,
+        'rc_cache.cache_vcs_calls.backend',
+        'dogpile.cache.rc.memory_lru', lower=False)
+    _int_setting(
+        settings,
+        'rc_cache.cache_vcs_calls.expiration_time',
+        86400)
+    if settings['rc_cache.cache_vcs_calls.backend'] == \
+            'dogpile.cache.rc.memory_lru':
+        _int_setting(
+            settings,
+            'rc_cache.cache_vcs_calls.arguments.max_bytes',
+            67108864)
+        _int_setting(
+            settings,
+            'rc_cache.cache_vcs_calls.arguments.max_entry_bytes',
+            524288)
+
+    # cache_highlight memory, 30 days, tokens of files by their content id
+    _string_setting(
+        settings,
+        'rc_cache.cache_highlight.backend',
+        'dogpile.cache.rc.memory_lru', lower=False)
+    _int_setting(
+        settings,
+        'rc_cache.cache_highlight.expiration_time',
+        2592000)
+    if settings['rc_cache.cache_highlight.backend'] == \
+            'dogpile.cache.rc.memory_lru':
+        _int_setting(
+            settings,
+            'rc_cache.cache_highlight.arguments.max_bytes',
+            134217728)
+        _int_setting(
+            settings,
+            'rc_cache.cache_highlight.arguments.max_entry_bytes',
+            16777216)
+
     # sql_cache_short
     _string_setting(
         settings,
@@ -29,7 +29,7 @@ def configure_vcs(config):
     """
     Patch VCS config with some RhodeCode specific stuff
     """
-    from rhodecode.lib.vcs import conf
+    from rhodecode.lib.vcs import conf, compression
     import rhodecode.lib.vcs.conf.settings
 
     conf.settings.BACKENDS = {
@@ -42,9 +42,16 @@ def configure_vcs(config):
     conf.settings.HOOKS_HOST = config['vcs.hooks.host']
     conf.settings.HOOKS_DIRECT_CALLS = config['vcs.hooks.direct_calls']
     conf.settings.GIT_REV_FILTER = shlex.split(config['git_rev_filter'])
+    conf.settings.GIT_COMMIT_INDEX = config['vcs.git.commit_index']
     conf.settings.DEFAULT_ENCODINGS = config['default_encoding']
     conf.settings.ALIASES[:] = config['vcs.backends']
     conf.settings.SVN_COMPATIBLE_VERSION = config['vcs.svn.compatible_version']
+    conf.settings.VCSSERVER_BATCH_CALLS = config['vcs.server.batch_calls']
+    # fail early on unknown codecs
+    compression.get_codec(config['vcs.server.compression'])
+    conf.settings.VCSSERVER_COMPRESSION = config['vcs.server.compression']
+    conf.settings.VCSSERVER_COMPRESSION_MIN_SIZE = \
+        config['vcs.server.compression_min_size']
 
 
 def initialize_database(config):
@@ -363,6 +363,8 @@ def attach_context_attributes(context, request, user_id=None):
         config.get('cut_off_limit_diff'))
     context.visual.cut_off_limit_file = safe_int(
         config.get('cut_off_limit_file'))
+    context.visual.lazy_load_diff_files_over = safe_int(
+        config.get('lazy_load_diff_files_over'), 0)
 
     # AppEnlight
     context.appenlight_enabled = str2bool(config.get('appenlight', 'false'))
@@ -319,6 +319,20 @@ def repo_maintenance(repoid):
         log.debug('Repo `%s` not found or without a clone_url', repoid)
 
 
+@async_task(ignore_result=True)
+def generate_pull_request_diff_cache(pull_request_id):
+    from rhodecode.model.pull_request import PullRequestModel
+    log = get_logger(generate_pull_request_diff_cache)
+    pull_request = PullRequestModel().get(pull_request_id)
+    if not pull_request:
+        log.debug('Pull request `%s` not found', pull_request_id)
+        return
+
+    cache_file_path = PullRequestModel().generate_diff_cache(pull_request)
+    log.debug('Generated diff cache of pull request `%s`: %s',
+              pull_request_id, cache_file_path)
+
+
 @async_task(ignore_result=True)
 def check_for_update():
     from rhodecode.model.update import UpdateModel
@@ -20,9 +20,11 @@
 
 import logging
 import difflib
+import collections
 from itertools import groupby
 
-from pygments import lex
+from dogpile.cache.api import NO_VALUE
+from pygments import lex, __version__ as pygments_version
 from pygments.formatters.html import _get_ttype_class as pygment_token_class
 from pygments.lexers.special import TextLexer, Token
 from pygments.lexers import get_lexer_by_name
@@ -34,7 +36,10 @@ from rhodecode.lib.utils2 import AttributeDict, StrictAttributeDict, safe_unicod
 from rhodecode.lib.vcs.nodes import FileNode
 from rhodecode.lib.vcs.exceptions import VCSError, NodeDoesNotExistError
 from rhodecode.lib.diff_match_patch import diff_match_patch
-from rhodecode.lib.diffs import LimitedDiffContainer, DEL_FILENODE, BIN_FILENODE
+from rhodecode.lib.highlight_pool import get_highlight_pool
+from rhodecode.lib.rc_cache import region_meta
+from rhodecode.lib.diffs import (
+    LimitedDiffContainer, PatchStream, DEL_FILENODE, BIN_FILENODE)
 
 
 plain_text_lexer = get_lexer_by_name(
@@ -43,17 +48,83 @@ plain_text_lexer = get_lexer_by_name(
 
 log = logging.getLogger(__name__)
 
+# part of the keys of the cached tokens, bump it if the tokenizing changes
+HIGHLIGHT_CACHE_VER = 'v1'
+
 
 def filenode_as_lines_tokens(filenode, lexer=None):
     org_lexer = lexer
     lexer = lexer or get_lexer_for_filenode(filenode)
     log.debug('Generating file node pygment tokens for %s, %s, org_lexer:%s',
               lexer, filenode, org_lexer)
-    content = filenode.content
+    return LinesTokensCache(filenode, lexer).compute()
+
+
+class LinesTokensCache(object):
+    """
+    Caches the tokens of a file, split into lines, in the `cache_highlight`
+    region. They are keyed by the id of the content of the file, the lexer
+    and the version of the highlighting, so the same file is lexed once no
+    matter in which commit, pull request version or view it's shown.
+    """
+    region_name = 'cache_highlight'
+
+    def __init__(self, filenode, lexer):
+        self.filenode = filenode
+        self.lexer = lexer
+        # not configured e.g. in scripts, plain text is cheaper to split
+        # than to cache
+        self.region = region_meta.dogpile_cache_regions.get(self.region_name)
+        self.enabled = (self.region is not None
+                        and not isinstance(lexer, TextLexer))
+
+    def _get_cached_function(self):
+        filenode, lexer = self.filenode, self.lexer
+
+        @self.region.conditional_cache_on_arguments(namespace='highlight')
+        def compute_lines_tokens(cache_ver, content_id, lexer_name):
+            return tokenize_lines(filenode.content, lexer)
+
+        args = ('{}:{}'.format(HIGHLIGHT_CACHE_VER, pygments_version),
+                self.filenode.content_id, self.lexer.__class__.__name__)
+        return compute_lines_tokens, args
+
+    def compute(self):
+        """
+        Returns the tokens, they are computed and cached if they are not
+        cached yet.
+        """
+        if not self.enabled:
+            return tokenize_lines(self.filenode.content, self.lexer)
+        compute_lines_tokens, args = self._get_cached_function()
+        return compute_lines_tokens(*args)
+
+    def get(self):
+        """
+        Returns the cached tokens, or None.
+        """
+        if not self.enabled:
+            return None
+        compute_lines_tokens, args = self._get_cached_function()
+        lines = compute_lines_tokens.get(*args)
+        if lines is NO_VALUE:
+            return None
+        return lines
+
+    def set(self, lines):
+        if not self.enabled:
+            return
+        compute_lines_tokens, args = self._get_cached_function()
+        compute_lines_tokens.set(lines, *args)
+
+
+def tokenize_lines(content, lexer):
+    """
+    Returns the tokens of `content` split into lines, it's also called by the
+    workers of the highlight pool.
+    """
     tokens = tokenize_string(content, lexer)
-    lines = split_token_stream(tokens, content)
-    rv = list(lines)
-    return rv
+    return list(split_token_stream(tokens, content))
 
 
 def tokenize_string(content, lexer):
@@ -389,6 +460,9 @@ class DiffSet(object):
                  source_nodes=None, target_nodes=None,
                  # files over this size will use fast highlighting
                  max_file_size_limit=150 * 1024,
+                 # tokenizes files in worker processes, defaults to the
+                 # configured one
+                 highlight_pool=None,
                  ):
 
         self.highlight_mode = highlight_mode
@@ -401,8 +475,16 @@ class DiffSet(object):
         self.target_repo_name = target_repo_name or repo_name
         self.source_repo_name = source_repo_name or repo_name
         self.max_file_size_limit = max_file_size_limit
+        self.highlight_pool = highlight_pool or get_highlight_pool()
+        self.highlight_tasks = {}
 
     def render_patchset(self, patchset, source_ref=None, target_ref=None):
+        """
+        Renders the parsed files of `patchset`, a list from
+        :meth:`DiffProcessor.prepare` or a :class:`PatchStream`. Streams are
+        parsed and rendered one file at a time, so the raw and parsed diff of
+        only a single file is kept in memory.
+        """
         diffset = AttributeDict(dict(
             lines_added=0,
             lines_deleted=0,
@@ -416,7 +498,7 @@ class DiffSet(object):
             source_ref=source_ref,
             target_ref=target_ref,
         ))
-        for patch in patchset:
+        for patch in self._iter_highlighted_patches(patchset):
             diffset.file_stats[patch['filename']] = patch['stats']
             filediff = self.render_patch(patch)
             filediff.diffset = StrictAttributeDict(dict(
@@ -432,8 +514,59 @@ class DiffSet(object):
                 diffset.lines_added += patch['stats']['added']
                 diffset.lines_deleted += patch['stats']['deleted']
 
+        if isinstance(patchset, PatchStream):
+            # limits are known once the whole stream was parsed, files are
+            # shown in the same order as the ones of a prepared diff
+            diffset.limited_diff = patchset.limited_diff
+            diffset.files.sort(key=patchset.sort_key)
+
         return diffset
 
+    def _iter_highlighted_patches(self, patchset):
+        """
+        Yields the patches of `patchset`, the files of the following ones are
+        already tokenized by the highlight pool meanwhile.
+        """
+        if not self.highlight_pool:
+            for patch in patchset:
+                yield patch
+            return
+
+        pending = collections.deque()
+        try:
+            for patch in patchset:
+                self._submit_highlighting(patch)
+                pending.append(patch)
+                if len(pending) > self.highlight_pool.processes:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            # files of patches which were not rendered
+            for task in self.highlight_tasks.values():
+                task.cancelled = True
+            self.highlight_tasks.clear()
+
+    def _submit_highlighting(self, patch):
+        if self._get_patch_hl_mode(patch) != self.HL_REAL:
+            return
+        self._load_patch_filenodes(patch)
+
+        for filenode in (self.source_nodes.get(patch['original_filename']),
+                         self.target_nodes.get(patch['filename'])):
+            if (not isinstance(filenode, FileNode)
+                    or filenode.size >= self.max_file_size_limit
+                    or filenode in self.highlighted_filenodes
+                    or filenode in self.highlight_tasks):
+                continue
+            lexer = self._get_lexer_for_filename(filenode.unicode_path)
+            lines = LinesTokensCache(filenode, lexer).get()
+            if lines is not None:
+                self.highlighted_filenodes[filenode] = lines
+                continue
+            self.highlight_tasks[filenode] = self.highlight_pool.submit(
+                tokenize_lines, filenode.content, lexer)
+
     _lexer_cache = {}
 
     def _get_lexer_for_filename(self, filename, filenode=None):
@@ -450,6 +583,26 @@ class DiffSet(object):
             self._lexer_cache[filename] = lexer
         return self._lexer_cache[filename]
 
+    def _get_patch_hl_mode(self, patch):
+        if patch['stats']['binary']:
+            return None
+        node_hl_mode = self.HL_NONE if patch['chunks'] == [] else None
+        return node_hl_mode or self.highlight_mode
+
+    def _load_patch_filenodes(self, patch):
+        source_filename = patch['original_filename']
+        target_filename = patch['filename']
+
+        if (source_filename and patch['operation'] in ('D', 'M')
+                and source_filename not in self.source_nodes):
+            self.source_nodes[source_filename] = (
+                self.source_node_getter(source_filename))
+
+        if (target_filename and patch['operation'] in ('A', 'M')
+                and target_filename not in self.target_nodes):
+            self.target_nodes[target_filename] = (
+                self.target_node_getter(target_filename))
+
     def render_patch(self, patch):
         log.debug('rendering diff for %r', patch['filename'])
 
@@ -459,24 +612,12 @@ class DiffSet(object):
         source_lexer = plain_text_lexer
         target_lexer = plain_text_lexer
 
-        if not patch['stats']['binary']:
-            node_hl_mode = self.HL_NONE if patch['chunks'] == [] else None
-            hl_mode = node_hl_mode or self.highlight_mode
-
-            if hl_mode == self.HL_REAL:
-                if (source_filename and patch['operation'] in ('D', 'M')
-                    and source_filename not in self.source_nodes):
-                        self.source_nodes[source_filename] = (
-                            self.source_node_getter(source_filename))
-
-                if (target_filename and patch['operation'] in ('A', 'M')
-                    and target_filename not in self.target_nodes):
-                        self.target_nodes[target_filename] = (
-                            self.target_node_getter(target_filename))
-
-            elif hl_mode == self.HL_FAST:
-                source_lexer = self._get_lexer_for_filename(source_filename)
-                target_lexer = self._get_lexer_for_filename(target_filename)
+        hl_mode = self._get_patch_hl_mode(patch)
+        if hl_mode == self.HL_REAL:
+            self._load_patch_filenodes(patch)
+        elif hl_mode == self.HL_FAST:
+            source_lexer = self._get_lexer_for_filename(source_filename)
+            target_lexer = self._get_lexer_for_filename(target_filename)
 
         source_file = self.source_nodes.get(source_filename, source_filename)
         target_file = self.target_nodes.get(target_filename, target_filename)
@@ -725,7 +866,7 @@ class DiffSet(object):
     def get_tokenized_filenode_line(self, filenode, line_number, lexer=None):
 
         if filenode not in self.highlighted_filenodes:
-            tokenized_lines = filenode_as_lines_tokens(filenode, lexer)
+            tokenized_lines = self._tokenize_filenode(filenode, lexer)
             self.highlighted_filenodes[filenode] = tokenized_lines
 
         try:
@@ -733,6 +874,23 @@ class DiffSet(object):
         except Exception:
             return [('', u'rhodecode diff rendering error')]
 
+    def _tokenize_filenode(self, filenode, lexer):
+        task = self.highlight_tasks.pop(filenode, None)
+        if task is None:
+            return filenode_as_lines_tokens(filenode, lexer)
+
+        if task.wait(self.highlight_pool.timeout,
+                     queue_timeout=self.highlight_pool.queue_timeout):
+            if task.error is None:
+                LinesTokensCache(filenode, lexer).set(task.result)
+                return task.result
+        elif not task.started:
+            # all workers are busy, tokenize it in the request instead
+            return filenode_as_lines_tokens(filenode, lexer)
+        log.warning('Highlighting of %s failed, showing it as plain text: %s',
+                    filenode, task.error or 'timed out')
+        return filenode_as_lines_tokens(filenode, plain_text_lexer)
+
     def action_to_op(self, action):
         return {
             'add': '+',
@@ -25,7 +25,9 @@ Set of diffing helpers, previously part of vcs
 
 import os
 import re
-import bz2
+import zlib
+import uuid
+import struct
 
 import collections
 import difflib
@@ -115,6 +117,56 @@ class LimitedDiffContainer(object):
             yield l
 
 
+class PatchStream(object):
+    """
+    Iterable over the parsed files of a diff, which are parsed one at a
+    time while it's iterated, see :meth:`DiffProcessor.iter_patches`. It can
+    be iterated only once.
+
+    Files not accepted by one of the `has_access(filename)` callbacks added
+    by :meth:`filter` are skipped and set :attr:`has_filtered`. Once the
+    iteration is done, :attr:`limited_diff` tells if the diff limits were
+    exceeded.
+    """
+
+    def __init__(self, diff_processor, inline_diff=True):
+        self._diff_processor = diff_processor
+        self._inline_diff = inline_diff
+        self._filters = []
+        self.has_filtered = False
+
+    def __iter__(self):
+        patches = self._diff_processor._new_iter_patches(
+            inline_diff=self._inline_diff)
+        for patch in patches:
+            filename = patch.get('filename')
+            if filename and not all(
+                    has_access(filename) for has_access in self._filters):
+                self.has_filtered = True
+                continue
+            yield patch
+
+    def filter(self, has_access):
+        self._filters.append(has_access)
+        return self
+
+    @property
+    def sort_key(self):
+        return self._diff_processor.patch_sort_key
+
+    @property
+    def limited_diff(self):
+        return self._diff_processor.limited_diff
+
+    @property
+    def diff_limit(self):
+        return self._diff_processor.diff_limit
+
+    @property
+    def cur_diff_size(self):
+        return self._diff_processor.cur_diff_size
+
+
 class Action(object):
     """
     Contains constants for the action value of the lines in a parsed diff.
@@ -169,6 +221,7 @@ class DiffProcessor(object):
         self.file_limit = file_limit
         self.show_full_diff = show_full_diff
         self.cur_diff_size = 0
+        self.limited_diff = False
         self.parsed = False
         self.parsed_diff = []
 
@@ -446,13 +499,24 @@ class DiffProcessor(object):
         if not self.show_full_diff and (self.cur_diff_size > self.diff_limit):
             raise DiffLimitExceeded('Diff Limit `%s` Exceeded', self.diff_limit)
 
+    @staticmethod
+    def patch_sort_key(patch):
+        return {OPS.ADD: 0, OPS.MOD: 1, OPS.DEL: 2}.get(patch['operation'])
+
     # FIXME: NEWDIFFS: dan: this replaces _parse_gitdiff
     def _new_parse_gitdiff(self, inline_diff=True):
-        _files = []
-
-        # this can be overriden later to a LimitedDiffContainer type
-        diff_container = lambda arg: arg
-
+        _files = list(self._new_iter_patches(inline_diff=inline_diff))
+        _files.sort(key=self.patch_sort_key)
+        if self.limited_diff:
+            return LimitedDiffContainer(
+                self.diff_limit, self.cur_diff_size, _files)
+        return _files
+
+    def _new_iter_patches(self, inline_diff=True):
+        """
+        Yields the parsed files of the diff in their order in the diff,
+        the diff is read and parsed one file at a time.
+        """
         for chunk in self._diff.chunks():
             head = chunk.header
             log.debug('parsing diff %r', head)
@@ -571,10 +635,7 @@ class DiffProcessor(object):
                         stats['ops'][MOD_FILENODE] = 'modified file'
 
                 except DiffLimitExceeded:
-                    diff_container = lambda _diff: \
-                        LimitedDiffContainer(
-                            self.diff_limit, self.cur_diff_size, _diff)
-
+                    self.limited_diff = True
                     limited_diff = True
                     chunks = []
 
@@ -601,7 +662,7 @@ class DiffProcessor(object):
                     if _op not in [MOD_FILENODE]])
 
             original_filename = safe_unicode(head['a_path'])
-            _files.append({
+            yield {
                 'original_filename': original_filename,
                 'filename': safe_unicode(head['b_path']),
                 'old_revision': head['a_blob_id'],
@@ -612,12 +673,7 @@ class DiffProcessor(object):
                 'stats': stats,
                 'exceeds_limit': exceeds_limit,
                 'is_limited_diff': limited_diff,
-            })
-
-        sorter = lambda info: {OPS.ADD: 0, OPS.MOD: 1,
-                               OPS.DEL: 2}.get(info['operation'])
-
-        return diff_container(sorted(_files, key=sorter))
+            }
 
     # FIXME: NEWDIFFS: dan: this gets replaced by _new_parse_lines
     def _parse_lines(self, diff_iter):
@@ -873,6 +929,17 @@ class DiffProcessor(object):
         self.parsed_diff = parsed
         return parsed
 
+    def iter_patches(self, inline_diff=True):
+        """
+        Like :meth:`prepare`, but returns a :class:`PatchStream` which
+        parses the files of the diff while it's iterated, in their order in
+        the diff. The diff limits are checked on the way, so big diffs are
+        never held in memory as a whole.
+        """
+        if self._parser != self._new_parse_gitdiff:
+            return self.prepare(inline_diff=inline_diff)
+        return PatchStream(self, inline_diff=inline_diff)
+
     def as_raw(self, diff_lines=None):
         """
         Returns raw diff as a byte string
@@ -1145,7 +1212,18 @@ class DiffLimitExceeded(Exception):
 
 # NOTE(marcink): if diffs.mako change, probably this
 # needs a bump to next version
-CURRENT_DIFF_VERSION = 'v4'
+CURRENT_DIFF_VERSION = 'v5'
+
+# Diff caches are stored as a header, an index of sections and the sections
+# themselves: the commits, the diffset without its files and one section per
+# file. Every section is pickled and compressed on its own, so a single file
+# can be loaded without reading and decompressing the rest of the diff.
+DIFF_CACHE_MAGIC = 'RCDIFF'
+# the fastest level, decompressing bz2 was often slower than rendering
+# small diffs again
+DIFF_CACHE_COMPRESSION_LEVEL = 1
+# magic, version, size of the index
+_diff_cache_header = struct.Struct('>6s8sI')
 
 
 def _cleanup_cache_file(cached_diff_file):
@@ -1156,59 +1234,213 @@ def _cleanup_cache_file(cached_diff_file):
         log.exception('Failed to cleanup path %s', cached_diff_file)
 
 
-def cache_diff(cached_diff_file, diff, commits):
+def _dump_cache_section(value):
+    try:
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except TypeError:
+        # classes answering every attribute, like AttributeDict, only
+        # work with the text protocol
+        data = pickle.dumps(value)
+    return zlib.compress(data, DIFF_CACHE_COMPRESSION_LEVEL)
+
+
+def _cacheable_comment_args(comment_args):
+    # comments are looked up by the path of the file node
+    if comment_args and isinstance(comment_args[0], FileNode):
+        comment_args = (comment_args[0].unicode_path,) + comment_args[1:]
+    return comment_args
+
+
+def _cacheable_hunk(hunk):
+    if not hunk.get('sideside'):
+        return hunk
+
+    hunk = hunk.__class__(hunk)
+    lines = []
+    for line in hunk.sideside:
+        line = line.__class__(line)
+        for side in ('original', 'modified'):
+            if line[side].get_comment_args:
+                line[side] = line[side].__class__(line[side])
+                line[side].get_comment_args = _cacheable_comment_args(
+                    line[side].get_comment_args)
+        lines.append(line)
+    hunk.sideside = hunk.lines = lines
+    hunk.unified = [
+        unified_line[:4] + (_cacheable_comment_args(unified_line[4]),)
+        for unified_line in hunk.unified]
+    return hunk
+
+
+def _cacheable_filediff(filediff):
+    """
+    Returns a copy of the rendered `filediff` without its file nodes. They
+    reference their commit, and through it all the loaded nodes of the
+    commit, which would otherwise be stored again in the section of every
+    file.
+    """
+    filediff = filediff.__class__(filediff)
+    filediff.source_filenode = None
+    filediff.target_filenode = None
+    filediff.hunks = [_cacheable_hunk(hunk) for hunk in filediff.hunks]
+    return filediff
 
-    struct = {
-        'version': CURRENT_DIFF_VERSION,
-        'diff': diff,
-        'commits': commits
-    }
 
+def _iter_cache_sections(diff, commits):
+    yield 'commits', commits
+    if diff is None:
+        yield 'diff', None
+        return
+
+    # a shallow copy of the rendered diffset without the files
+    files = diff.files
+    diff = diff.__class__(diff)
+    diff.files = []
+    yield 'diff', diff
+    for filediff in files:
+        yield 'file', _cacheable_filediff(filediff)
+
+
+def cache_diff(cached_diff_file, diff, commits):
+    """
+    Stores the rendered `diff` together with the `commits` it was created
+    for. The file is written next to its final location and renamed, so
+    readers never see a partially written cache.
+    """
+    tmp_file = '{}.{}.tmp'.format(cached_diff_file, uuid.uuid4().hex)
     try:
-        with bz2.BZ2File(cached_diff_file, 'wb') as f:
-            pickle.dump(struct, f)
+        sections = []
+        files = {}
+        data = []
+        offset = 0
+        for name, value in _iter_cache_sections(diff, commits):
+            section_data = _dump_cache_section(value)
+            if name == 'file':
+                files[value.patch['filename']] = len(sections)
+            sections.append((name, offset, len(section_data)))
+            data.append(section_data)
+            offset += len(section_data)
+
+        index = zlib.compress(
+            pickle.dumps({'sections': sections, 'files': files},
+                         pickle.HIGHEST_PROTOCOL),
+            DIFF_CACHE_COMPRESSION_LEVEL)
+        with open(tmp_file, 'wb') as f:
+            f.write(_diff_cache_header.pack(
+                DIFF_CACHE_MAGIC, CURRENT_DIFF_VERSION, len(index)))
+            f.write(index)
+            for section_data in data:
+                f.write(section_data)
+        os.rename(tmp_file, cached_diff_file)
         log.debug('Saved diff cache under %s', cached_diff_file)
     except Exception:
         log.warn('Failed to save cache', exc_info=True)
-        _cleanup_cache_file(cached_diff_file)
+        if os.path.exists(tmp_file):
+            _cleanup_cache_file(tmp_file)
 
 
-def load_cached_diff(cached_diff_file):
+class DiffCacheReader(object):
+    """
+    Reads the sections of a diff cache stored by :func:`cache_diff`.
+    """
 
-    default_struct = {
-        'version': CURRENT_DIFF_VERSION,
-        'diff': None,
-        'commits': None
-    }
+    def __init__(self, f):
+        self._f = f
+        self.sections = []
+        self.files = {}
+        self.valid = self._read_index()
+
+    def _read_index(self):
+        header = self._f.read(_diff_cache_header.size)
+        if len(header) != _diff_cache_header.size:
+            return False
+        magic, version, index_size = _diff_cache_header.unpack(header)
+        # caches of older versions were plain bz2 pickles
+        if magic != DIFF_CACHE_MAGIC \
+                or version.rstrip('\0') != CURRENT_DIFF_VERSION:
+            return False
+        index = pickle.loads(zlib.decompress(self._f.read(index_size)))
+        self.sections = index['sections']
+        self.files = index['files']
+        self._data_offset = _diff_cache_header.size + index_size
+        return True
+
+    def read_section(self, idx):
+        __, offset, size = self.sections[idx]
+        self._f.seek(self._data_offset + offset)
+        return pickle.loads(zlib.decompress(self._f.read(size)))
+
+    def get_commits(self):
+        return self.read_section(0)
+
+    def get_diff(self):
+        diff = self.read_section(1)
+        if diff is not None:
+            diff.files = [
+                self.read_section(idx)
+                for idx in xrange(2, len(self.sections))]
+        return diff
+
+    def get_file(self, filename):
+        idx = self.files.get(filename)
+        if idx is None:
+            return None
+        return self.read_section(idx)
 
-    has_cache = os.path.isfile(cached_diff_file)
-    if not has_cache:
-        return default_struct
 
-    data = None
+def _open_cached_diff(cached_diff_file, read):
+    """
+    Calls `read` with a :class:`DiffCacheReader` of the cache file, caches
+    of another version are removed. Returns `(found, result)`.
+    """
+    if not os.path.isfile(cached_diff_file):
+        return False, None
+
     try:
-        with bz2.BZ2File(cached_diff_file, 'rb') as f:
-            data = pickle.load(f)
-        log.debug('Loaded diff cache from %s', cached_diff_file)
+        with open(cached_diff_file, 'rb') as f:
+            reader = DiffCacheReader(f)
+            if reader.valid:
+                result = read(reader)
+                log.debug('Loaded diff cache from %s', cached_diff_file)
+                return True, result
     except Exception:
         log.warn('Failed to read diff cache file', exc_info=True)
+        return False, None
 
-    if not data:
-        data = default_struct
+    # purge cache
+    _cleanup_cache_file(cached_diff_file)
+    return False, None
 
-    if not isinstance(data, dict):
-        # old version of data ?
-        data = default_struct
 
-    # check version
-    if data.get('version') != CURRENT_DIFF_VERSION:
-        # purge cache
-        _cleanup_cache_file(cached_diff_file)
-        return default_struct
+def load_cached_diff(cached_diff_file):
+
+    default_struct = {
+        'version': CURRENT_DIFF_VERSION,
+        'diff': None,
+        'commits': None
+    }
 
+    found, data = _open_cached_diff(
+        cached_diff_file, lambda reader: {
+            'version': CURRENT_DIFF_VERSION,
+            'diff': reader.get_diff(),
+            'commits': reader.get_commits(),
+        })
+    if not found:
+        return default_struct
     return data
 
 
+def load_cached_diff_file(cached_diff_file, filename):
+    """
+    Returns the rendered diff of a single file stored in a diff cache, or
+    None if the cache or the file within it doesn't exist.
+    """
+    __, filediff = _open_cached_diff(
+        cached_diff_file, lambda reader: reader.get_file(filename))
+    return filediff
+
+
 def generate_diff_cache_key(*args):
     """
     Helper to generate a cache key using arguments
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Pool of worker processes the syntax highlighting of diffs is handed to.
+
+Tokenizing files with pygments is CPU bound, so a diff renders the next
+files while the pool tokenizes the following ones on other cores. Every
+call gets `timeout` seconds, the worker process of a call which takes
+longer is killed and replaced, so a single pathological file can't block
+the pool. Calls wait at most `queue_timeout` seconds for a free worker,
+callers then do the work themselves.
+
+The worker processes are fed by threads, which are greenlets with gevent
+workers. They wait for the results with `select`, which gevent makes
+cooperative, instead of using :class:`multiprocessing.Pool` whose result
+handling blocks the gevent hub.
+"""
+
+import errno
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import threading
+import time
+from Queue import Queue
+
+
+log = logging.getLogger(__name__)
+
+
+class HighlightPoolTimeout(Exception):
+    pass
+
+
+def _worker_main(calls_conn, results_conn, parent_conns):
+    # interrupts are handled by the parent, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # otherwise reading the calls wouldn't end once the parent is gone
+    for conn in parent_conns:
+        conn.close()
+    while True:
+        try:
+            func, args = calls_conn.recv()
+        except (EOFError, IOError):
+            break
+        try:
+            result = True, func(*args)
+        except Exception as e:
+            result = False, repr(e)
+        try:
+            results_conn.send(result)
+        except IOError:
+            break
+    # exit right away, the cleanup could run the inherited threads of the
+    # parent, which are greenlets with gevent
+    os._exit(0)
+
+
+class HighlightTask(object):
+    """
+    A call submitted to the pool, :meth:`wait` waits for its `result`.
+    `error` is set instead if it failed or timed out.
+    """
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self._started = threading.Event()
+        self._done = threading.Event()
+
+    def __repr__(self):
+        return '<HighlightTask: %s>' % getattr(self.func, '__name__', self.func)
+
+    @property
+    def started(self):
+        return self._started.is_set()
+
+    def set_started(self):
+        self._started.set()
+
+    def set_result(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        # the arguments can be whole files, don't keep them around
+        self.args = None
+        self._done.set()
+
+    def wait(self, timeout=None, queue_timeout=None):
+        """
+        Returns True if the task is done. It waits at most `queue_timeout`
+        for a worker to start the task, and `timeout` from then on, so time
+        spent queued behind other tasks doesn't count against the task.
+        Otherwise it is cancelled, a task which didn't start yet is then
+        skipped by the pool.
+        """
+        if not (self._started.wait(queue_timeout)
+                and self._done.wait(timeout)):
+            self.cancelled = True
+            return False
+        return True
+
+
+class HighlightWorker(object):
+    """
+    A single worker process, and the pipes it's fed through.
+    """
+
+    def __init__(self):
+        # one way pipes, duplex ones are socket pairs which gevent makes
+        # non-blocking
+        calls_reader, self.calls_conn = multiprocessing.Pipe(duplex=False)
+        self.results_conn, results_writer = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(calls_reader, results_writer,
+                  (self.calls_conn, self.results_conn)),
+            name='rhodecode-highlight-worker')
+        self.process.daemon = True
+        self.process.start()
+        calls_reader.close()
+        results_writer.close()
+
+    def __repr__(self):
+        return '<HighlightWorker: pid:%s>' % self.process.pid
+
+    def _wait_readable(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                readable, __, __ = select.select(
+                    [self.results_conn], [], [], remaining)
+                return bool(readable)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def call(self, func, args, timeout):
+        self.calls_conn.send((func, args))
+        if not self._wait_readable(timeout):
+            raise HighlightPoolTimeout(
+                'Call of {} took longer than {}s'.format(func, timeout))
+        return self.results_conn.recv()
+
+    def stop(self):
+        try:
+            self.process.terminate()
+            self.process.join(1)
+        finally:
+            self.calls_conn.close()
+            self.results_conn.close()
+
+
+class HighlightPool(object):
+    """
+    Bounded pool of `processes` worker processes. They are started on first
+    use, in each process which uses the pool, e.g. in each web server worker.
+    """
+
+    def __init__(self, processes, timeout, queue_timeout=30):
+        self.processes = processes
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._tasks = None
+
+    def __repr__(self):
+        return '<HighlightPool: processes:%s timeout:%ss queue_timeout:%ss>' % (
+            self.processes, self.timeout, self.queue_timeout)
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # feeding threads and workers of a parent process are not ours
+            self._tasks = Queue()
+            for idx in range(self.processes):
+                feeder = threading.Thread(
+                    target=self._feed_worker, args=(self._tasks,),
+                    name='rhodecode-highlight-feeder-%s' % idx)
+                feeder.daemon = True
+                feeder.start()
+            self._pid = os.getpid()
+
+    def _feed_worker(self, tasks):
+        pid = os.getpid()
+        worker = None
+        while True:
+            task = tasks.get()
+            if os.getpid() != pid:
+                # inherited by a worker process
+                return
+            if task.cancelled:
+                continue
+            task.set_started()
+            try:
+                if worker is None:
+                    worker = HighlightWorker()
+                success, result = worker.call(task.func, task.args, self.timeout)
+            except HighlightPoolTimeout as e:
+                log.warning('Stopping highlight worker %s: %s', worker, e)
+                worker.stop()
+                worker = None
+                task.set_result(error=str(e))
+            except Exception as e:
+                log.exception('Highlight worker %s failed', worker)
+                if worker is not None:
+                    worker.stop()
+                    worker = None
+                task.set_result(error=repr(e))
+            else:
+                if success:
+                    task.set_result(result=result)
+                else:
+                    task.set_result(error=result)
+
+    def submit(self, func, *args):
+        """
+        Submits the call of `func`, it has to be a module level function
+        and its arguments have to be picklable. With gevent it must not wait
+        for I/O, the worker processes inherit the greenlets of their parent.
+        """
+        self._start()
+        task = HighlightTask(func, args)
+        self._tasks.put(task)
+        return task
+
+
+_highlight_pool = None
+
+
+def configure_highlight_pool(settings):
+    global _highlight_pool
+    processes = int(settings.get('highlight_pool.processes', 0))
+    timeout = int(settings.get('highlight_pool.timeout', 10))
+    queue_timeout = int(settings.get('highlight_pool.queue_timeout', 30))
+    _highlight_pool = None
+    if processes > 0:
+        _highlight_pool = HighlightPool(processes, timeout, queue_timeout)
+    log.debug('Using highlight pool %s', _highlight_pool)
+
+
+def get_highlight_pool():
+    """
+    Returns the configured pool, or None if files are highlighted in the
+    calling process.
+    """
+    return _highlight_pool
+
+
+def includeme(config):
+    configure_highlight_pool(config.registry.settings)
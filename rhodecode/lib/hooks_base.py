@@ -32,6 +32,7 @@ from rhodecode import events
 from rhodecode.lib import helpers as h
 from rhodecode.lib import audit_logger
 from rhodecode.lib.utils2 import safe_str
+from rhodecode.lib.vcs.conf import settings as vcs_settings
 from rhodecode.lib.exceptions import (
     HTTPLockedRC, HTTPBranchProtected, UserCreationError)
 from rhodecode.model.db import Repository, User
@@ -297,6 +298,8 @@ def post_push(extras):
 
     hook_response = ''
     if not is_shadow_repo(extras):
+        if extras.scm == 'git':
+            _update_refs_caches(extras.repository)
         hook_response = post_push_extension(
             repo_store_path=Repository.base_path(),
             **extras)
@@ -307,6 +310,25 @@ def post_push(extras):
     return HookResponse(0, output) + hook_response
 
 
+def _update_refs_caches(repo_name):
+    """
+    Stores the pushed refs as the current refs snapshot and appends the
+    pushed commits to the persistent commit index, so that requests after
+    the push don't have to do it.
+    """
+    repo = Repository.get_by_repo_name(repo_name)
+    if not repo:
+        return
+    try:
+        scm_instance = repo.scm_instance(cache=False)
+        scm_instance._refs = scm_instance._get_refs()
+        if vcs_settings.GIT_COMMIT_INDEX:
+            # loading the commit ids brings the index up to date
+            scm_instance.commit_ids
+    except Exception:
+        log.exception('Failed to update refs caches of %s', repo_name)
+
+
 def _locked_by_explanation(repo_name, user_name, reason):
     message = (
         'Repository `%s` locked by user `%s`. Reason:`%s`'
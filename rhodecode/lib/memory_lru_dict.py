@@ -27,7 +27,10 @@ This software is Copyright (c) Zope Corporation (tm) and
 Contributors. All rights reserved.
 """
 
+import collections
 import logging
+import sys
+import threading
 
 from repoze.lru import LRUCache
 from beaker.container import MemoryNamespaceManager, AbstractDictionaryNSManager
@@ -35,6 +38,8 @@ from rhodecode.lib.utils2 import safe_str
 
 log = logging.getLogger(__name__)
 
+_marker = object()
+
 
 class LRUDict(LRUCache):
     """
@@ -74,6 +79,137 @@ class LRUDictDebug(LRUDict):
         return self.get(key)
 
 
+def approximate_size(value, _depth=0):
+    """
+    Returns the approximate memory used by `value` in bytes. Containers and
+    object attributes are followed a few levels deep, objects referenced
+    multiple times are counted each time.
+    """
+    size = sys.getsizeof(value, 0)
+    if _depth >= 4:
+        return size
+    _depth += 1
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            size += approximate_size(key, _depth)
+            size += approximate_size(item, _depth)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += approximate_size(item, _depth)
+    elif hasattr(value, '__dict__'):
+        size += approximate_size(vars(value), _depth)
+    return size
+
+
+class SizedLRUDict(object):
+    """
+    LRU dict bounded by the approximate size of its values instead of their
+    count. The least recently used values are evicted once their total size
+    exceeds `max_bytes`, values bigger than `max_entry_bytes` are not stored
+    at all.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes=None, get_size=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.get_size = get_size or approximate_size
+        self.current_bytes = 0
+        self.evictions = 0
+        self.rejections = 0
+        # key -> (value, size), ordered from the least recently used one
+        self.data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                entry = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = entry
+            return entry[0]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._remove(key, default)
+
+    def _remove(self, key, default=None):
+        try:
+            value, size = self.data.pop(key)
+        except KeyError:
+            return default
+        self.current_bytes -= size
+        return value
+
+    def __setitem__(self, key, value):
+        size = self.get_size(value)
+        with self._lock:
+            self._remove(key)
+            if self.max_entry_bytes and size > self.max_entry_bytes:
+                self.rejections += 1
+                return
+            self.data[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self.data:
+                __, (__, evicted_size) = self.data.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def __getitem__(self, key):
+        value = self.get(key, _marker)
+        if value is _marker:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self.data:
+                raise KeyError(key)
+            self._remove(key)
+
+    def __len__(self):
+        return len(self.data)
+
+    def keys(self):
+        return self.data.keys()
+
+    def clear(self):
+        with self._lock:
+            self.data.clear()
+            self.current_bytes = 0
+
+    def get_stats(self):
+        return {
+            'entries': len(self.data),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'max_entry_bytes': self.max_entry_bytes,
+            'evictions': self.evictions,
+            'rejections': self.rejections,
+        }
+
+
+class SizedLRUDictDebug(SizedLRUDict):
+    """
+    Wrapper to provide some debug options
+    """
+    def _report_keys(self):
+        usage = '%s/%s bytes' % (self.current_bytes, self.max_bytes)
+        # trick for pformat print it more nicely
+        fmt = '\n'
+        for cnt, (elem, (__, size)) in enumerate(self.data.items()):
+            fmt += '%s - %s (%s bytes)\n' % (cnt+1, safe_str(elem), size)
+        log.debug('current LRU keys (%s, %s evicted, %s rejected):%s',
+                  usage, self.evictions, self.rejections, fmt)
+
+    def get(self, key, default=None):
+        self._report_keys()
+        return super(SizedLRUDictDebug, self).get(key, default)
+
+
 class MemoryLRUNamespaceManagerBase(MemoryNamespaceManager):
     default_max_items = 10000
 
@@ -24,11 +24,16 @@ import logging
 
 
 from rhodecode.lib.base import get_ip_addr, get_access_path, get_user_agent
-from rhodecode.lib.utils2 import safe_str
+from rhodecode.lib.rc_cache import stats as cache_stats
+from rhodecode.lib.utils2 import safe_str, str2bool
+from rhodecode.lib.vcs import call_stats
 
 
 log = logging.getLogger(__name__)
 
+# number of the slowest VCSServer methods shown in the request summary
+VCS_CALLS_SUMMARY_LIMIT = 5
+
 
 class RequestWrapperTween(object):
     def __init__(self, handler, registry):
@@ -36,20 +41,39 @@ class RequestWrapperTween(object):
         self.registry = registry
 
         # one-time configuration code goes here
+        self.log_cache_stats = str2bool(
+            registry.settings.get('cache_stats.log_requests'))
 
     def __call__(self, request):
         start = time.time()
+        call_stats.start_request()
+        if self.log_cache_stats:
+            cache_stats.start_request()
         try:
             response = self.handler(request)
         finally:
             end = time.time()
             total = end - start
+            vcs_calls = call_stats.end_request()
+            cache_lookups = cache_stats.end_request()
             log.info(
                 'IP: %s %s Request to %s time: %.3fs [%s]',
                 get_ip_addr(request.environ), request.environ.get('REQUEST_METHOD'),
                 safe_str(get_access_path(request.environ)), total,
                 get_user_agent(request. environ)
             )
+            if vcs_calls and vcs_calls.count:
+                log.info(
+                    'Request to %s made %s VCSServer calls, time: %.3fs, '
+                    'slowest methods: %s',
+                    safe_str(get_access_path(request.environ)),
+                    vcs_calls.count, vcs_calls.total_time,
+                    vcs_calls.summary(VCS_CALLS_SUMMARY_LIMIT))
+            if cache_lookups and cache_lookups.count:
+                log.info(
+                    'Request to %s made %s cache lookups: %s',
+                    safe_str(get_access_path(request.environ)),
+                    cache_lookups.count, cache_lookups.summary())
 
         return response
 
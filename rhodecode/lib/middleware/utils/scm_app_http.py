@@ -32,24 +32,28 @@ import requests
 import webob.request
 
 import rhodecode
+from rhodecode.lib.vcs import connection
+from rhodecode.lib.vcs.server_pool import get_pool
 
 
 log = logging.getLogger(__name__)
 
 
 def create_git_wsgi_app(repo_path, repo_name, config):
-    url = _vcs_streaming_url() + 'git/'
+    url = _vcs_streaming_url(repo_path) + 'git/'
     return VcsHttpProxy(url, repo_path, repo_name, config)
 
 
 def create_hg_wsgi_app(repo_path, repo_name, config):
-    url = _vcs_streaming_url() + 'hg/'
+    url = _vcs_streaming_url(repo_path) + 'hg/'
     return VcsHttpProxy(url, repo_path, repo_name, config)
 
 
-def _vcs_streaming_url():
+def _vcs_streaming_url(repo_path=None):
+    # use the same VCSServer which handles the other calls of this repository
+    pool = connection.ServerPool or get_pool(rhodecode.CONFIG['vcs.server'])
     template = 'http://{}/stream/'
-    return template.format(rhodecode.CONFIG['vcs.server'])
+    return template.format(pool.get_node(repo_path))
 
 
 # TODO: johbo: Avoid the global.
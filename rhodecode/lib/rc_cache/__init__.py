@@ -21,6 +21,8 @@
 import logging
 from dogpile.cache import register_backend
 
+from rhodecode.lib.utils2 import str2bool
+
 register_backend(
     "dogpile.cache.rc.memory_lru", "rhodecode.lib.rc_cache.backends",
     "LRUMemoryBackend")
@@ -29,10 +31,18 @@ register_backend(
     "dogpile.cache.rc.file_namespace", "rhodecode.lib.rc_cache.backends",
     "FileNamespaceBackend")
 
+register_backend(
+    "dogpile.cache.rc.sqlite", "rhodecode.lib.rc_cache.backends",
+    "SQLiteBackend")
+
 register_backend(
     "dogpile.cache.rc.redis", "rhodecode.lib.rc_cache.backends",
     "RedisPickleBackend")
 
+register_backend(
+    "dogpile.cache.rc.redis_layered", "rhodecode.lib.rc_cache.backends",
+    "LayeredRedisBackend")
+
 
 log = logging.getLogger(__name__)
 
@@ -40,7 +50,9 @@ from . import region_meta
 from .utils import (
     get_default_cache_settings, key_generator, get_or_create_region,
     clear_cache_namespace, make_region, InvalidationContext,
-    FreshRegionCache, ActiveRegionCache)
+    FreshRegionCache, ActiveRegionCache, RefsSnapshot,
+    background_creation_runner)
+from .generations import configure_generation_store, get_generation_store
 
 
 def configure_dogpile_cache(settings):
@@ -59,9 +71,14 @@ def configure_dogpile_cache(settings):
 
     # register them into namespace
     for region_name in avail_regions:
+        async_creation_runner = None
+        if str2bool(rc_cache_data.get(
+                '{}.stale_while_revalidate'.format(region_name))):
+            async_creation_runner = background_creation_runner
         new_region = make_region(
             name=region_name,
-            function_key_generator=key_generator
+            function_key_generator=key_generator,
+            async_creation_runner=async_creation_runner
         )
 
         new_region.configure_from_config(settings, 'rc_cache.{}.'.format(region_name))
@@ -70,6 +87,8 @@ def configure_dogpile_cache(settings):
                   region_name, new_region.__dict__)
         region_meta.dogpile_cache_regions[region_name] = new_region
 
+    configure_generation_store(settings)
+
 
 def includeme(config):
     configure_dogpile_cache(config.registry.settings)
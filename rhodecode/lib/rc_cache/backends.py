@@ -17,19 +17,31 @@
 # This program is dual-licensed. If you wish to learn more about the
 # RhodeCode Enterprise Edition, including its added features, Support services,
 # and proprietary license terms, please see https://rhodecode.com/licenses/
+import os
 import time
+import contextlib
+import json
+import uuid
+import zlib
 import errno
 import logging
+import sqlite3
+import threading
 
 import gevent
 
+from dogpile.cache import api
 from dogpile.cache.backends import memory as memory_backend
 from dogpile.cache.backends import file as file_backend
 from dogpile.cache.backends import redis as redis_backend
-from dogpile.cache.backends.file import NO_VALUE, compat, FileLock
+from dogpile.cache.backends.file import NO_VALUE, FileLock
 from dogpile.cache.util import memoized_property
 
-from rhodecode.lib.memory_lru_dict import LRUDict, LRUDictDebug
+from rhodecode.lib.memory_lru_dict import (
+    LRUDict, LRUDictDebug, SizedLRUDict, SizedLRUDictDebug)
+from rhodecode.lib.rc_cache import serializers
+from rhodecode.lib.rc_cache import stats as cache_stats
+from rhodecode.lib.utils2 import safe_str
 
 
 _default_max_size = 1024
@@ -38,18 +50,40 @@ log = logging.getLogger(__name__)
 
 
 class LRUMemoryBackend(memory_backend.MemoryBackend):
+    """
+    Memory backend keeping the `max_size` most recently used values. With
+    `max_bytes` it keeps as many of them as fit into that many bytes
+    instead, values bigger than `max_entry_bytes` are not kept.
+    """
     pickle_values = False
 
     def __init__(self, arguments):
         max_size = arguments.pop('max_size', _default_max_size)
-
-        LRUDictClass = LRUDict
-        if arguments.pop('log_key_count', None):
-            LRUDictClass = LRUDictDebug
-
-        arguments['cache_dict'] = LRUDictClass(max_size)
+        max_bytes = int(arguments.pop('max_bytes', 0))
+        max_entry_bytes = int(arguments.pop('max_entry_bytes', 0))
+        log_key_count = arguments.pop('log_key_count', None)
+
+        if max_bytes:
+            SizedLRUDictClass = SizedLRUDict
+            if log_key_count:
+                SizedLRUDictClass = SizedLRUDictDebug
+            arguments['cache_dict'] = SizedLRUDictClass(
+                max_bytes, max_entry_bytes=max_entry_bytes)
+        else:
+            LRUDictClass = LRUDict
+            if log_key_count:
+                LRUDictClass = LRUDictDebug
+            arguments['cache_dict'] = LRUDictClass(max_size)
         super(LRUMemoryBackend, self).__init__(arguments)
 
+    def get_usage(self):
+        """
+        Returns the number of kept values, and their size if it's tracked.
+        """
+        if isinstance(self._cache, SizedLRUDict):
+            return self._cache.get_stats()
+        return {'entries': len(self._cache.keys()), 'max_size': self._cache.size}
+
     def delete(self, key):
         try:
             del self._cache[key]
@@ -63,18 +97,31 @@ class LRUMemoryBackend(memory_backend.MemoryBackend):
 
 
 class Serializer(object):
+    """
+    Serializes the values with the `serializer` and `compression` arguments
+    of the region, see :mod:`rhodecode.lib.rc_cache.serializers`.
+    """
+    serializer = serializers.CacheSerializer()
+    serializer_arguments = {}
+
+    def _setup_serializer(self, arguments):
+        self.serializer, self.serializer_arguments = \
+            serializers.make_serializer(arguments)
+
     def _dumps(self, value, safe=False):
         try:
-            return compat.pickle.dumps(value)
+            data = self.serializer.dumps(value)
         except Exception:
             if safe:
                 return NO_VALUE
             else:
                 raise
+        cache_stats.set_stored_size(len(data))
+        return data
 
     def _loads(self, value, safe=True):
         try:
-            return compat.pickle.loads(value)
+            return self.serializer.loads(value)
         except Exception:
             if safe:
                 return NO_VALUE
@@ -95,6 +142,7 @@ class CustomLockFactory(FileLock):
             """
             Gevent compatible flock
             """
+            wait = not operation & fcntl.LOCK_NB
             # set non-blocking, this will cause an exception if we cannot acquire a lock
             operation |= fcntl.LOCK_NB
             start_lock_time = time.time()
@@ -106,7 +154,7 @@ class CustomLockFactory(FileLock):
                     break
                 except (OSError, IOError) as e:
                     # raise on other errors than Resource temporarily unavailable
-                    if e.errno != errno.EAGAIN:
+                    if e.errno != errno.EAGAIN or not wait:
                         raise
                     elif (time.time() - start_lock_time) > timeout:
                         # waited to much time on a lock, better fail than loop for ever
@@ -126,6 +174,7 @@ class FileNamespaceBackend(Serializer, file_backend.DBMBackend):
 
     def __init__(self, arguments):
         arguments['lock_factory'] = CustomLockFactory
+        self._setup_serializer(arguments)
         super(FileNamespaceBackend, self).__init__(arguments)
 
     def list_keys(self, prefix=''):
@@ -168,11 +217,316 @@ class FileNamespaceBackend(Serializer, file_backend.DBMBackend):
                 dbm[key] = self._dumps(value)
 
 
+class SQLiteBackend(Serializer, api.CacheBackend):
+    """
+    File backend storing the values in a SQLite database in WAL mode.
+    Readers don't lock each other or the writers, so all workers and
+    greenlets can read concurrently, unlike the DBM files which are locked
+    for every access. A `.sqlite` suffix is added to `filename`.
+
+    Values expire after `sqlite_expiration_time` seconds, if set. Once the
+    stored values exceed `max_size_bytes`, the least recently used ones are
+    evicted. The access time of a value is updated at most every
+    `lru_update_interval` seconds, so reads rarely need a write.
+
+    Values are created under one of `lock_count` file locks picked by their
+    key, so a value is only computed by a single worker at a time.
+
+    SQLite waits for the lock of another writer blocking, which would block
+    all greenlets of a gevent worker. It only waits `lock_wait` seconds,
+    statements which are still busy are retried cooperatively for up to
+    `busy_timeout` seconds.
+
+    All threads and greenlets of a process share a single connection, one
+    at a time.
+    """
+    # the quota is checked after this many writes
+    cull_frequency = 100
+    lock_wait = 0.01
+    retry_wait = 0.03
+
+    def __init__(self, arguments):
+        self._setup_serializer(arguments)
+        filename = arguments['filename']
+        if not filename.endswith('.sqlite'):
+            filename += '.sqlite'
+        self.filename = os.path.abspath(os.path.normpath(filename))
+        self.expiration_time = int(arguments.get('sqlite_expiration_time', 0))
+        self.max_size_bytes = int(arguments.get('max_size_bytes', 0))
+        self.lru_update_interval = int(arguments.get('lru_update_interval', 300))
+        self.busy_timeout = int(arguments.get('busy_timeout', 30))
+        self.lock_count = int(arguments.get('lock_count', 16))
+        self._mutexes = [
+            CustomLockFactory('{}.lock.{}'.format(self.filename, idx))
+            for idx in range(self.lock_count)]
+
+        self._conn = None
+        self._conn_lock = None
+        self._conn_pid = None
+        self._writes = 0
+
+        dir_name = os.path.dirname(self.filename)
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        self._execute(self._create_table)
+
+    def _create_table(self, conn):
+        # a single transaction, so the total size can't miss the writes of
+        # other processes
+        conn.isolation_level = None
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._create_schema(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.isolation_level = ''
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+            'size INTEGER NOT NULL, accessed REAL NOT NULL, '
+            'expires REAL)')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+
+        # the total size of the values is kept up to date by triggers, in
+        # the transactions which change them
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache_meta ('
+            'name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        size_row = conn.execute(
+            "SELECT value FROM cache_meta WHERE name = 'size'").fetchone()
+        if size_row is None:
+            conn.execute(
+                "INSERT INTO cache_meta (name, value) "
+                "SELECT 'size', COALESCE(SUM(size), 0) FROM cache")
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS cache_size_insert '
+            'AFTER INSERT ON cache BEGIN '
+            "UPDATE cache_meta SET value = value + NEW.size WHERE name = 'size'; "
+            'END')
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS cache_size_delete '
+            'AFTER DELETE ON cache BEGIN '
+            "UPDATE cache_meta SET value = value - OLD.size WHERE name = 'size'; "
+            'END')
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS cache_size_update '
+            'AFTER UPDATE OF size ON cache BEGIN '
+            "UPDATE cache_meta SET value = value - OLD.size + NEW.size "
+            "WHERE name = 'size'; "
+            'END')
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.filename, timeout=self.lock_wait, check_same_thread=False)
+        conn.text_factory = str
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # rows replaced by `INSERT OR REPLACE` only fire the delete trigger
+        # with recursive triggers
+        conn.execute('PRAGMA recursive_triggers=ON')
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        if self._conn_pid != os.getpid():
+            # the connection and lock of the parent of a forked worker
+            self._conn = None
+            self._conn_lock = threading.Lock()
+            self._conn_pid = os.getpid()
+        with self._conn_lock:
+            if self._conn is None:
+                self._conn = self._connect()
+            yield self._conn
+
+    def _execute(self, func, *args):
+        """
+        Calls `func` with the connection and `args`, again while the
+        database is locked by another writer. `func` has to run its writes
+        in a transaction, so a failed call leaves nothing behind.
+        """
+        start_time = time.time()
+        while True:
+            try:
+                with self._connection() as conn:
+                    return func(conn, *args)
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                elif (time.time() - start_time) > self.busy_timeout:
+                    log.error('Failed to acquire lock on `%s` after waiting %ss',
+                              self.filename, self.busy_timeout)
+                    raise
+                log.debug('Database `%s` is locked, retry in %ss',
+                          self.filename, self.retry_wait)
+                gevent.sleep(self.retry_wait)
+
+    @property
+    def clear_by_generation(self):
+        # keys of all namespaces share one table, see `clear_cache_namespace`,
+        # values of older generations are only removed by expiring or by
+        # being evicted
+        return bool(self.expiration_time or self.max_size_bytes)
+
+    def _expires(self, now):
+        if self.expiration_time:
+            return now + self.expiration_time
+        return None
+
+    def list_keys(self, prefix=''):
+        def select_keys(conn):
+            rows = conn.execute(
+                'SELECT key FROM cache WHERE substr(key, 1, ?) = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (len(prefix), prefix, time.time()))
+            return [row[0] for row in rows]
+        return self._execute(select_keys)
+
+    def get_total_size(self):
+        """
+        Returns the total size of the stored values.
+        """
+        def select_size(conn):
+            return conn.execute(
+                "SELECT value FROM cache_meta WHERE name = 'size'").fetchone()[0]
+        return self._execute(select_size)
+
+    def get_store(self):
+        return self.filename
+
+    def get_mutex(self, key):
+        if not self.lock_count:
+            return None
+        idx = zlib.crc32(safe_str(key)) % self.lock_count
+        return self._mutexes[idx]
+
+    def get(self, key):
+        return self.get_multi([key])[0]
+
+    def _select_values(self, conn, keys, now):
+        rows = []
+        # sqlite limits the number of query parameters
+        for start in xrange(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows.extend(conn.execute(
+                'SELECT key, value, accessed, expires FROM cache '
+                'WHERE key IN ({})'.format(', '.join('?' * len(chunk))), chunk))
+        return rows
+
+    def get_multi(self, keys):
+        if not keys:
+            return []
+        now = time.time()
+        found = {}
+        touched = []
+        for key, value, accessed, expires in self._execute(
+                self._select_values, keys, now):
+            if expires is not None and expires <= now:
+                continue
+            found[key] = str(value)
+            if now - accessed > self.lru_update_interval:
+                touched.append((now, key))
+        if touched:
+            try:
+                with self._connection() as conn, conn:
+                    conn.executemany(
+                        'UPDATE cache SET accessed = ? WHERE key = ?', touched)
+            except sqlite3.OperationalError:
+                # only used for the eviction order, skip it if we are busy
+                log.debug('Failed to update access time of %s', self.filename)
+
+        return [self._loads(found[key]) if key in found else NO_VALUE
+                for key in keys]
+
+    def set(self, key, value):
+        self.set_multi({key: value})
+
+    def _insert_rows(self, conn, rows):
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO cache '
+                '(key, value, size, accessed, expires) VALUES (?, ?, ?, ?, ?)',
+                rows)
+
+    def set_multi(self, mapping):
+        now = time.time()
+        expires = self._expires(now)
+        rows = []
+        for key, value in mapping.items():
+            data = self._dumps(value)
+            rows.append((key, sqlite3.Binary(data), len(data), now, expires))
+
+        self._execute(self._insert_rows, rows)
+
+        self._writes += len(rows)
+        if self._writes >= self.cull_frequency:
+            self._writes = 0
+            self.cull()
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def _delete_keys(self, conn, rows):
+        with conn:
+            conn.executemany('DELETE FROM cache WHERE key = ?', rows)
+
+    def delete_multi(self, keys):
+        self._execute(self._delete_keys, [(key,) for key in keys])
+
+    def cull(self):
+        """
+        Removes expired values and evicts the least recently used ones
+        while the stored values exceed `max_size_bytes`.
+        """
+        self._execute(self._cull)
+
+    def _cull(self, conn):
+        with conn:
+            conn.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            if not self.max_size_bytes:
+                return
+            total_size = conn.execute(
+                "SELECT value FROM cache_meta WHERE name = 'size'").fetchone()[0]
+            if total_size <= self.max_size_bytes:
+                return
+
+            evict_size = total_size - self.max_size_bytes
+            evicted_keys = []
+            rows = conn.execute(
+                'SELECT key, size FROM cache ORDER BY accessed')
+            for key, size in rows:
+                evicted_keys.append((key,))
+                evict_size -= size
+                if evict_size <= 0:
+                    break
+            conn.executemany('DELETE FROM cache WHERE key = ?', evicted_keys)
+        log.debug('Evicted %s values from %s', len(evicted_keys), self.filename)
+
+
 class RedisPickleBackend(Serializer, redis_backend.RedisBackend):
+
+    def __init__(self, arguments):
+        self._setup_serializer(arguments)
+        super(RedisPickleBackend, self).__init__(arguments)
+
+    @property
+    def clear_by_generation(self):
+        # keys of all namespaces share one keyspace, see
+        # `clear_cache_namespace`, values of older generations are only
+        # removed once they expire
+        return bool(self.redis_expiration_time)
+
     def list_keys(self, prefix=''):
-        if prefix:
-            prefix = prefix + '*'
-        return self.client.keys(prefix)
+        # SCAN doesn't block the server like KEYS does on big keyspaces
+        return list(self.client.scan_iter(match=prefix + '*', count=1000))
 
     def get_store(self):
         return self.client.connection_pool
@@ -183,6 +537,12 @@ class RedisPickleBackend(Serializer, redis_backend.RedisBackend):
             return NO_VALUE
         return self._loads(value)
 
+    def get_multi(self, keys):
+        if not keys:
+            return []
+        return [self._loads(value) if value is not None else NO_VALUE
+                for value in self.client.mget(keys)]
+
     def set(self, key, value):
         if self.redis_expiration_time:
             self.client.setex(key, self.redis_expiration_time,
@@ -212,3 +572,148 @@ class RedisPickleBackend(Serializer, redis_backend.RedisBackend):
             return self.client.lock(lock_key, self.lock_timeout, self.lock_sleep)
         else:
             return None
+
+
+class LayeredRedisBackend(RedisPickleBackend):
+    """
+    Redis backend with an in-process LRU in front of it. Hits are served
+    from the LRU without a round trip to Redis or unpickling, misses fall
+    through to Redis.
+
+    Writes and deletes are published on a Redis channel, every process
+    listens to it and drops the changed keys from its LRU. Entries are kept
+    in the LRU for at most `l1_expiration_time` seconds, which bounds the
+    staleness in case a message was lost.
+    """
+    channel_prefix = 'rc_cache_l1_invalidate:'
+
+    def __init__(self, arguments):
+        self.l1_max_size = int(arguments.pop('l1_max_size', _default_max_size))
+        self.l1_expiration_time = int(arguments.pop('l1_expiration_time', 60))
+        super(LayeredRedisBackend, self).__init__(arguments)
+
+        # the channel is per redis database, regions using the same one
+        # share it and just ignore the keys they don't have
+        self.channel = '{}{}'.format(self.channel_prefix, self.db)
+        self._sender_id = uuid.uuid4().hex
+        self._l1 = LRUDict(self.l1_max_size)
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def _ensure_listener(self):
+        # the listener is started lazily, once per forked worker
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._l1.clear()
+            self._sender_id = uuid.uuid4().hex
+            listener = threading.Thread(
+                target=self._listen, name='rc_cache_l1_listener')
+            listener.daemon = True
+            listener.start()
+            self._listener_pid = os.getpid()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # messages might have been lost while we weren't subscribed
+                self._l1.clear()
+                for message in pubsub.listen():
+                    self._on_message(message)
+            except Exception:
+                log.exception('L1 cache invalidation listener of %s failed, '
+                              'reconnecting', self.channel)
+                self._l1.clear()
+                time.sleep(5)
+
+    def _on_message(self, message):
+        if message.get('type') != 'message':
+            return
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if data.get('sender') == self._sender_id:
+            return
+        for key in data.get('keys', []):
+            self._l1_delete(key)
+
+    def _publish(self, keys):
+        message = json.dumps({'sender': self._sender_id, 'keys': list(keys)})
+        try:
+            self.client.publish(self.channel, message)
+        except Exception:
+            log.exception('Failed to publish L1 cache invalidation of %s',
+                          self.channel)
+
+    def _l1_get(self, key):
+        entry = self._l1.get(key)
+        if entry is None:
+            return NO_VALUE
+        stored_at, value = entry
+        if time.time() - stored_at > self.l1_expiration_time:
+            self._l1_delete(key)
+            return NO_VALUE
+        return value
+
+    def _l1_set(self, key, value):
+        self._l1[key] = (time.time(), value)
+
+    def _l1_delete(self, key):
+        try:
+            del self._l1[key]
+        except KeyError:
+            pass
+
+    def get(self, key):
+        self._ensure_listener()
+        value = self._l1_get(key)
+        if value is NO_VALUE:
+            value = super(LayeredRedisBackend, self).get(key)
+            if value is not NO_VALUE:
+                self._l1_set(key, value)
+        return value
+
+    def get_multi(self, keys):
+        self._ensure_listener()
+        values = [self._l1_get(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is NO_VALUE]
+        if missing:
+            fetched = dict(zip(
+                missing, super(LayeredRedisBackend, self).get_multi(missing)))
+            for key, value in fetched.items():
+                if value is not NO_VALUE:
+                    self._l1_set(key, value)
+            values = [fetched.get(key, value) for key, value in zip(keys, values)]
+        return values
+
+    def set(self, key, value):
+        self._ensure_listener()
+        super(LayeredRedisBackend, self).set(key, value)
+        self._l1_set(key, value)
+        self._publish([key])
+
+    def set_multi(self, mapping):
+        self._ensure_listener()
+        super(LayeredRedisBackend, self).set_multi(mapping)
+        for key, value in mapping.items():
+            self._l1_set(key, value)
+        self._publish(mapping.keys())
+
+    def delete(self, key):
+        self._ensure_listener()
+        super(LayeredRedisBackend, self).delete(key)
+        self._l1_delete(key)
+        self._publish([key])
+
+    def delete_multi(self, keys):
+        self._ensure_listener()
+        keys = list(keys)
+        super(LayeredRedisBackend, self).delete_multi(keys)
+        for key in keys:
+            self._l1_delete(key)
+        self._publish(keys)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Generation counters of the cache invalidation namespaces.
+
+Every invalidation namespace, e.g. `repo_cache:1`, has a counter which is
+bumped to invalidate all caches registered in it. An
+:class:`~rhodecode.lib.rc_cache.utils.InvalidationContext` remembers the
+generation it computed its value for, and refreshes it once the counter
+moved on. Checking a cache is a single read of the counter, instead of a
+query and a commit of the `cache_invalidation` table.
+
+Cache namespaces of the redis and sqlite regions use counters too if they are
+kept in Redis. They are part of their keys, so clearing a namespace doesn't
+need to look up its keys, see
+:func:`~rhodecode.lib.rc_cache.utils.clear_cache_namespace`. Every process
+keeps them for `NAMESPACE_GENERATIONS_TTL` seconds, so cached lookups don't
+need a round trip to Redis.
+
+The counters are used once `cache_invalidation.backend` is set to `file` or
+`redis`, otherwise the invalidation state stays in the database. Files inside
+of the `cache_dir` work for all workers of a single node only, clusters have
+to keep the counters in Redis.
+"""
+
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+
+from rhodecode.lib.memory_lru_dict import LRUDict
+from rhodecode.lib.utils2 import safe_str
+
+from . import region_meta
+
+
+log = logging.getLogger(__name__)
+
+# generations seen by the invalidation contexts of this process
+SEEN_GENERATIONS_MAX_SIZE = 10000
+
+# generations of cache namespaces are read again after this many seconds,
+# clearing a namespace takes that long to reach the other processes
+NAMESPACE_GENERATIONS_TTL = 2
+NAMESPACE_GENERATIONS_MAX_SIZE = 10000
+
+
+class MemoryGenerationStore(object):
+    """
+    Counters of a single process, used by tests.
+    """
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations = {}
+
+    def __repr__(self):
+        return '<MemoryGenerationStore>'
+
+    def get(self, namespace):
+        return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            generation = self._generations.get(namespace, 0) + 1
+            self._generations[namespace] = generation
+        return generation
+
+
+class FileGenerationStore(object):
+    """
+    Counters stored in one small file per namespace inside of `path`, shared
+    by all processes which use the same directory.
+    """
+    shared = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return '<FileGenerationStore: %s>' % self.path
+
+    def _get_path(self, namespace):
+        name = hashlib.sha1(safe_str(namespace)).hexdigest()
+        return os.path.join(self.path, name)
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return int(f.read() or 0)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return 0
+
+    def get(self, namespace):
+        return self._read(self._get_path(namespace))
+
+    def bump(self, namespace):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        path = self._get_path(namespace)
+        with open(path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                generation = self._read(path) + 1
+                # readers don't lock, so the file is replaced atomically
+                tmp_path = '%s.%s' % (path, uuid.uuid4().hex)
+                with open(tmp_path, 'wb') as f:
+                    f.write(str(generation))
+                os.rename(tmp_path, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return generation
+
+
+class RedisGenerationStore(object):
+    """
+    Counters stored in Redis, shared by all nodes of a cluster.
+    """
+    shared = True
+    key_prefix = 'rc_cache_generation:'
+
+    def __init__(self, url):
+        import redis
+        self.url = url
+        self.client = redis.StrictRedis.from_url(url)
+
+    def __repr__(self):
+        return '<RedisGenerationStore: %s>' % self.url
+
+    def get(self, namespace):
+        return int(self.client.get(self.key_prefix + safe_str(namespace)) or 0)
+
+    def bump(self, namespace):
+        return self.client.incr(self.key_prefix + safe_str(namespace))
+
+
+def make_generation_store(backend, path=None, redis_url=None):
+    """
+    Returns the generation store for the `cache_invalidation.backend`
+    setting, or None for `database` which keeps the invalidation state in
+    the `cache_invalidation` table.
+    """
+    if backend == 'database':
+        return None
+    if backend == 'file':
+        return FileGenerationStore(path or os.path.join(
+            region_meta.dogpile_config_defaults['cache_dir'],
+            'cache_generations'))
+    if backend == 'redis':
+        return RedisGenerationStore(redis_url)
+    if backend == 'memory':
+        return MemoryGenerationStore()
+    raise ValueError(
+        'Unknown cache invalidation backend `{}`'.format(backend))
+
+
+def configure_generation_store(settings):
+    region_meta.generation_store = make_generation_store(
+        settings.get('cache_invalidation.backend', 'database'),
+        path=settings.get('cache_invalidation.path'),
+        redis_url=settings.get('cache_invalidation.redis_url'))
+    log.debug('Using cache invalidation store %s',
+              region_meta.generation_store)
+
+
+def get_generation_store():
+    """
+    Returns the configured generation store, or None if the invalidation
+    state is kept in the database.
+    """
+    if region_meta.generation_store is region_meta.NOT_CONFIGURED:
+        # not configured by the application, e.g. in scripts
+        region_meta.generation_store = make_generation_store('database')
+    return region_meta.generation_store
+
+
+def _get_namespace_key(region_name, namespace):
+    return 'cache_namespace:{}:{}'.format(region_name, namespace)
+
+
+def get_namespace_generation(region_name, namespace):
+    """
+    Returns the generation of a cache namespace of a region, it's part of
+    the keys of the namespace so bumping it clears all of them at once.
+    """
+    store = get_generation_store()
+    if store is None:
+        return 0
+    namespace_key = _get_namespace_key(region_name, namespace)
+    generation = namespace_generations.get(namespace_key)
+    if generation is None:
+        generation = store.get(namespace_key)
+        namespace_generations.set(namespace_key, generation)
+    return generation
+
+
+def bump_namespace_generation(region_name, namespace):
+    store = get_generation_store()
+    if store is None:
+        return None
+    namespace_key = _get_namespace_key(region_name, namespace)
+    generation = store.bump(namespace_key)
+    namespace_generations.set(namespace_key, generation)
+    return generation
+
+
+class NamespaceGenerations(object):
+    """
+    Generations of the cache namespaces read by this process, each one is
+    kept for `ttl` seconds.
+    """
+
+    def __init__(self, ttl=NAMESPACE_GENERATIONS_TTL,
+                 max_size=NAMESPACE_GENERATIONS_MAX_SIZE):
+        self.ttl = ttl
+        self._generations = LRUDict(max_size)
+
+    def get(self, namespace_key):
+        entry = self._generations.get(namespace_key)
+        if entry is None:
+            return None
+        read_time, generation = entry
+        if time.time() - read_time > self.ttl:
+            return None
+        return generation
+
+    def set(self, namespace_key, generation):
+        self._generations[namespace_key] = (time.time(), generation)
+
+    def clear(self):
+        self._generations.clear()
+
+
+namespace_generations = NamespaceGenerations()
+
+
+class SeenGenerations(object):
+    """
+    Generations of the invalidation namespaces the caches of this process
+    were computed for, by the cache key of their invalidation context.
+    """
+
+    def __init__(self, max_size=SEEN_GENERATIONS_MAX_SIZE):
+        self._generations = LRUDict(max_size)
+
+    def is_current(self, cache_key, generation):
+        return self._generations.get(cache_key) == generation
+
+    def set(self, cache_key, generation):
+        self._generations[cache_key] = generation
+
+    def clear(self):
+        self._generations.clear()
+
+
+seen_generations = SeenGenerations()
@@ -26,3 +26,7 @@ dogpile_config_defaults = {
 
 # GLOBAL TO STORE ALL REGISTERED REGIONS
 dogpile_cache_regions = {}
+
+NOT_CONFIGURED = object()
+# store of the cache invalidation generations, see `generations.py`
+generation_store = NOT_CONFIGURED
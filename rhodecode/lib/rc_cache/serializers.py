@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Serializers of the values stored by the file and redis cache backends.
+
+Every stored value starts with a header byte, the lower bits select the
+format and the upper bits the compression. Values without a known header
+were written by older versions as plain pickles and are still loaded.
+
+- `pickle` uses the binary pickle protocol and handles any value.
+- `msgpack` is smaller and faster for plain data structures. Values it
+  can't represent exactly, like sets, tuples or dict subclasses, are
+  pickled instead.
+
+Values of at least `compression_min_size` bytes are compressed with the
+selected compression, if it makes them smaller.
+"""
+
+import zlib
+
+import msgpack
+from dogpile.cache.api import CachedValue
+from dogpile.cache.util import compat
+
+
+FORMAT_PICKLE = 0x01
+FORMAT_MSGPACK = 0x02
+# dogpile values are (payload, metadata) tuples, they are packed as a list
+FORMAT_MSGPACK_CACHED_VALUE = 0x03
+FORMAT_MASK = 0x0f
+COMPRESSION_MASK = 0xf0
+
+FORMATS = {
+    'pickle': FORMAT_PICKLE,
+    'msgpack': FORMAT_MSGPACK,
+}
+
+
+class Compressor(object):
+
+    def __init__(self, name, flag, compress, decompress):
+        self.name = name
+        # the upper bits of the header byte
+        self.flag = flag
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return '<Compressor:%s>' % self.name
+
+
+_compressors = {}
+
+
+def register_compressor(name, flag, compress, decompress):
+    """
+    Registers a compression which can then be selected by its `name` in the
+    `compression` argument of a region.
+    """
+    _compressors[name] = Compressor(name, flag, compress, decompress)
+
+
+def get_compressor(name):
+    if not name or name == 'none':
+        return None
+    try:
+        return _compressors[name]
+    except KeyError:
+        raise ValueError('Unknown cache compression `{}`, available: {}'
+                         .format(name, ', '.join(sorted(_compressors))))
+
+
+def _get_compressor_by_flag(flag):
+    for compressor in _compressors.values():
+        if compressor.flag == flag:
+            return compressor
+    return None
+
+
+# level 1 is the fastest one, the values are compressed on every write
+register_compressor(
+    'zlib', 0x10, lambda data: zlib.compress(data, 1), zlib.decompress)
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    register_compressor(
+        'lz4', 0x20, lz4.frame.compress, lz4.frame.decompress)
+
+
+def _pickle_dumps(value):
+    try:
+        return compat.pickle.dumps(value, compat.pickle.HIGHEST_PROTOCOL)
+    except TypeError:
+        # classes answering every attribute, like AttributeDict, only
+        # work with the text protocol
+        return compat.pickle.dumps(value)
+
+
+def _msgpack_dumps(value):
+    # strict types make msgpack fail on tuples and subclasses, which
+    # would not be loaded back as the same type
+    return msgpack.packb(value, use_bin_type=True, strict_types=True)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+class CacheSerializer(object):
+
+    def __init__(self, format='pickle', compression=None,
+                 compression_min_size=1024):
+        try:
+            self.format = FORMATS[format]
+        except KeyError:
+            raise ValueError('Unknown cache serializer `{}`, available: {}'
+                             .format(format, ', '.join(sorted(FORMATS))))
+        self.compressor = get_compressor(compression)
+        self.compression_min_size = compression_min_size
+
+    def __repr__(self):
+        return '<CacheSerializer:%s compression:%s>' % (
+            self.format, self.compressor)
+
+    def _serialize(self, value):
+        if self.format == FORMAT_MSGPACK:
+            try:
+                if isinstance(value, CachedValue):
+                    return FORMAT_MSGPACK_CACHED_VALUE, _msgpack_dumps(
+                        [value.payload, value.metadata])
+                return FORMAT_MSGPACK, _msgpack_dumps(value)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return FORMAT_PICKLE, _pickle_dumps(value)
+
+    def dumps(self, value):
+        value_format, data = self._serialize(value)
+        compressor = self.compressor
+        if compressor and len(data) >= self.compression_min_size:
+            compressed = compressor.compress(data)
+            # incompressible data is stored as it is
+            if len(compressed) < len(data):
+                return chr(value_format | compressor.flag) + compressed
+        return chr(value_format) + data
+
+    def loads(self, data):
+        header = ord(data[0]) if data else 0
+        value_format = header & FORMAT_MASK
+        compression_flag = header & COMPRESSION_MASK
+        compressor = None
+        if compression_flag:
+            compressor = _get_compressor_by_flag(compression_flag)
+        if value_format not in (
+                FORMAT_PICKLE, FORMAT_MSGPACK, FORMAT_MSGPACK_CACHED_VALUE) \
+                or (compression_flag and compressor is None):
+            # stored without a header by older versions
+            return compat.pickle.loads(data)
+
+        data = data[1:]
+        if compressor:
+            data = compressor.decompress(data)
+        if value_format == FORMAT_MSGPACK:
+            return _msgpack_loads(data)
+        if value_format == FORMAT_MSGPACK_CACHED_VALUE:
+            payload, metadata = _msgpack_loads(data)
+            return CachedValue(payload, metadata)
+        return compat.pickle.loads(data)
+
+
+def make_serializer(arguments):
+    """
+    Pops the serializer arguments of a region and returns its serializer
+    together with the popped arguments.
+    """
+    serializer_arguments = {}
+    for name in ('serializer', 'compression', 'compression_min_size'):
+        if name in arguments:
+            serializer_arguments[name] = arguments.pop(name)
+
+    serializer = CacheSerializer(
+        format=serializer_arguments.get('serializer', 'pickle'),
+        compression=serializer_arguments.get('compression'),
+        compression_min_size=int(
+            serializer_arguments.get('compression_min_size', 1024)))
+    return serializer, serializer_arguments
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2015-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Statistics of the cached functions of the cache regions.
+
+Every lookup of a function decorated with
+:meth:`~rhodecode.lib.rc_cache.utils.RhodeCodeCacheRegion.conditional_cache_on_arguments`
+is recorded into the per process :data:`cache_stats_registry`, by region,
+namespace and function. Namespaces are per object, e.g. `cache_repo.42`,
+so their trailing id is replaced by `*` to keep the number of entries
+bounded. While a request is being handled, lookups are additionally
+collected into a :class:`RequestCacheStats` returned by
+:func:`start_request`.
+"""
+
+import collections
+import re
+import threading
+
+
+# with gevent workers threading.local is patched to be greenlet local
+_local = threading.local()
+
+_namespace_id_pat = re.compile(r'([._:])\d+$')
+
+
+def get_region_name(region):
+    # namespaced file regions are named `<region>:<namespace>`
+    return (region.name or 'default').split(':', 1)[0]
+
+
+def get_namespace_name(namespace):
+    if not namespace:
+        return 'default'
+    return _namespace_id_pat.sub(r'\1*', namespace)
+
+
+def set_stored_size(size):
+    """
+    Remembers the size of the serialized value the current thread stored
+    last, the backends which serialize their values call it.
+    """
+    _local.stored_size = size
+
+
+def pop_stored_size():
+    """
+    Returns the size of the value the current thread stored last, or None
+    if nothing was stored since the last call, e.g. by memory regions which
+    keep the objects as they are.
+    """
+    size = getattr(_local, 'stored_size', None)
+    _local.stored_size = None
+    return size
+
+
+class CacheFunctionStats(object):
+    """
+    Aggregated statistics of a single cached function.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.compute_time = 0.0
+        self.max_compute_time = 0.0
+        self.value_bytes = 0
+        self.max_value_bytes = 0
+
+    def add(self, hit, compute_time, value_size):
+        if hit:
+            self.hits += 1
+            return
+        self.misses += 1
+        self.compute_time += compute_time
+        self.max_compute_time = max(self.max_compute_time, compute_time)
+        if value_size is not None:
+            self.value_bytes += value_size
+            self.max_value_bytes = max(self.max_value_bytes, value_size)
+
+    def get_data(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            'compute_time': self.compute_time,
+            'avg_compute_time': (
+                self.compute_time / self.misses if self.misses else 0.0),
+            'max_compute_time': self.max_compute_time,
+            'avg_value_bytes': (
+                self.value_bytes / self.misses if self.misses else 0),
+            'max_value_bytes': self.max_value_bytes,
+        }
+
+
+class CacheStatsRegistry(object):
+    """
+    Thread safe collection of :class:`CacheFunctionStats` per region,
+    namespace and function.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, region, namespace, function, hit, compute_time, value_size):
+        key = (region, namespace, function)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = CacheFunctionStats()
+            stats.add(hit, compute_time, value_size)
+
+    def get_stats(self):
+        """
+        Returns the statistics of all cached functions, the ones which spent
+        the most time computing values first.
+        """
+        with self._lock:
+            stats = []
+            for (region, namespace, function), entry in self._stats.items():
+                data = entry.get_data()
+                data.update({
+                    'region': region,
+                    'namespace': namespace,
+                    'function': function,
+                })
+                stats.append(data)
+        return sorted(stats, key=lambda d: d['compute_time'], reverse=True)
+
+    def get_region_stats(self):
+        """
+        Returns the hits, misses and compute time summed up per region.
+        """
+        regions = collections.OrderedDict()
+        for data in sorted(self.get_stats(), key=lambda d: d['region']):
+            region = regions.setdefault(
+                data['region'], {'hits': 0, 'misses': 0, 'compute_time': 0.0})
+            region['hits'] += data['hits']
+            region['misses'] += data['misses']
+            region['compute_time'] += data['compute_time']
+        for region in regions.values():
+            lookups = region['hits'] + region['misses']
+            region['hit_ratio'] = (
+                float(region['hits']) / lookups if lookups else 0.0)
+        return regions
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+cache_stats_registry = CacheStatsRegistry()
+
+
+class RequestCacheStats(object):
+    """
+    Cache lookups made while handling a single request.
+    """
+
+    def __init__(self):
+        self.regions = collections.OrderedDict()
+
+    def add(self, region, hit, compute_time):
+        entry = self.regions.setdefault(region, [0, 0, 0.0])
+        if hit:
+            entry[0] += 1
+        else:
+            entry[1] += 1
+            entry[2] += compute_time
+
+    @property
+    def count(self):
+        return sum(hits + misses for hits, misses, __ in self.regions.values())
+
+    def summary(self):
+        return ', '.join(
+            '{} hits:{} misses:{} compute:{:.3f}s'.format(
+                region, hits, misses, compute_time)
+            for region, (hits, misses, compute_time) in self.regions.items())
+
+
+def get_memory_usage():
+    """
+    Returns the number of values, and their size if it's tracked, kept by
+    the memory regions of this process.
+    """
+    from . import region_meta
+    usage = collections.OrderedDict()
+    for name, region in sorted(region_meta.dogpile_cache_regions.items()):
+        backend = getattr(region, 'actual_backend', None)
+        if hasattr(backend, 'get_usage'):
+            usage[name] = backend.get_usage()
+    return usage
+
+
+def start_request():
+    """
+    Starts collecting the cache lookups of the current request.
+    """
+    _local.request_stats = RequestCacheStats()
+    return _local.request_stats
+
+
+def end_request():
+    """
+    Stops collecting the cache lookups of the current request and returns
+    them.
+    """
+    request_stats = getattr(_local, 'request_stats', None)
+    _local.request_stats = None
+    return request_stats
+
+
+def record(region, namespace, function, hit, compute_time=0.0,
+           value_size=None):
+    cache_stats_registry.add(
+        region, namespace, function, hit, compute_time, value_size)
+    request_stats = getattr(_local, 'request_stats', None)
+    if request_stats is not None:
+        request_stats.add(region, hit, compute_time)
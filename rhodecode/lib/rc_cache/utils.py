@@ -24,7 +24,9 @@ import functools
 import threading
 
 from dogpile.cache import CacheRegion
+from dogpile.cache.api import NO_VALUE, CachedValue
 from dogpile.cache.util import compat
+from pyramid import threadlocal
 
 import rhodecode
 from rhodecode.lib.utils import safe_str, sha1
@@ -32,6 +34,10 @@ from rhodecode.lib.utils2 import safe_unicode, str2bool
 from rhodecode.model.db import Session, CacheKey, IntegrityError
 
 from . import region_meta
+from . import stats as cache_stats
+from .generations import (
+    get_generation_store, seen_generations, get_namespace_generation,
+    bump_namespace_generation)
 
 log = logging.getLogger(__name__)
 
@@ -56,27 +62,61 @@ class RhodeCodeCacheRegion(CacheRegion):
             function_key_generator = self.function_key_generator
 
         def decorator(fn):
-            if to_str is compat.string_type:
-                # backwards compatible
-                key_generator = function_key_generator(namespace, fn)
-            else:
-                key_generator = function_key_generator(namespace, fn, to_str=to_str)
+            def make_key_generator(key_namespace):
+                if to_str is compat.string_type:
+                    # backwards compatible
+                    return function_key_generator(key_namespace, fn)
+                return function_key_generator(key_namespace, fn, to_str=to_str)
+
+            region_name = cache_stats.get_region_name(self)
+            namespace_key_generator = make_key_generator(namespace)
+
+            def key_generator(*arg, **kw):
+                if namespace and _clears_by_generation(self.actual_backend):
+                    generation = get_namespace_generation(
+                        region_name, namespace)
+                    if generation:
+                        return make_key_generator('{}:g{}'.format(
+                            namespace, generation))(*arg, **kw)
+                return namespace_key_generator(*arg, **kw)
+
+            stats_key = (
+                region_name,
+                cache_stats.get_namespace_name(namespace), fn.__name__)
+
+            def record_miss(compute_time):
+                # the size of the value is taken from the serialized data the
+                # backend stored for it
+                cache_stats.record(
+                    *stats_key, hit=False, compute_time=compute_time,
+                    value_size=cache_stats.pop_stored_size())
 
             @functools.wraps(fn)
             def decorate(*arg, **kw):
                 key = key_generator(*arg, **kw)
+                compute_times = []
 
                 @functools.wraps(fn)
                 def creator():
-                    return fn(*arg, **kw)
+                    start = time.time()
+                    value = fn(*arg, **kw)
+                    compute_times.append(time.time() - start)
+                    # forget the sizes of values stored by `fn`
+                    cache_stats.pop_stored_size()
+                    return value
 
                 if not condition:
-                    return creator()
+                    return fn(*arg, **kw)
 
                 timeout = expiration_time() if expiration_time_is_callable \
                     else expiration_time
 
-                return self.get_or_create(key, creator, timeout, should_cache_fn)
+                value = self.get_or_create(key, creator, timeout, should_cache_fn)
+                if compute_times:
+                    record_miss(compute_times[0])
+                else:
+                    cache_stats.record(*stats_key, hit=True)
+                return value
 
             def invalidate(*arg, **kw):
                 key = key_generator(*arg, **kw)
@@ -92,8 +132,18 @@ class RhodeCodeCacheRegion(CacheRegion):
 
             def refresh(*arg, **kw):
                 key = key_generator(*arg, **kw)
+                timeout = expiration_time() if expiration_time_is_callable \
+                    else expiration_time
+                if self.async_creation_runner and self._expire(key, timeout):
+                    # serve the current value while it's recomputed
+                    return decorate(*arg, **kw)
+
+                start = time.time()
                 value = fn(*arg, **kw)
+                compute_time = time.time() - start
+                cache_stats.pop_stored_size()
                 self.set(key, value)
+                record_miss(compute_time)
                 return value
 
             decorate.set = set_
@@ -108,11 +158,89 @@ class RhodeCodeCacheRegion(CacheRegion):
 
         return decorator
 
+    def _expire(self, key, expiration_time=None):
+        """
+        Marks the value of `key` as expired and returns True, or False if
+        there is no value or the values never expire.
+        """
+        if expiration_time is None:
+            expiration_time = self.expiration_time
+        if expiration_time is None or expiration_time < 0:
+            return False
+        if self.key_mangler:
+            key = self.key_mangler(key)
+        value = self.backend.get(key)
+        if value is NO_VALUE:
+            return False
+        metadata = dict(value.metadata, ct=0)
+        self.backend.set(key, CachedValue(value.payload, metadata))
+        return True
+
 
 def make_region(*arg, **kw):
     return RhodeCodeCacheRegion(*arg, **kw)
 
 
+def _revalidate(region, key, creator, stale_ct, threadlocals=None):
+    mangled_key = region.key_mangler(key) if region.key_mangler else key
+    mutex = region._mutex(mangled_key)
+    # another worker is recomputing the value already
+    if not mutex.acquire(False):
+        return
+    # creators render templates and generate urls with the request and
+    # registry of the request which served the stale value
+    if threadlocals is not None:
+        threadlocal.manager.push(threadlocals)
+    try:
+        value = region.backend.get(mangled_key)
+        if value is not NO_VALUE and value.metadata['ct'] != stale_ct:
+            log.debug('Value of %s was revalidated in the meantime', key)
+            return
+        start = time.time()
+        region.set(key, creator())
+        log.debug('Revalidated %s in %.3fs', key, time.time() - start)
+    except Exception:
+        # the stale value would be served and fail to revalidate over and
+        # over, the next lookup computes it again instead
+        log.exception('Failed to revalidate cached value of %s, dropping it',
+                      key)
+        region.delete(key)
+    finally:
+        if threadlocals is not None:
+            threadlocal.manager.pop()
+        mutex.release()
+        # the creator might have used the thread local database session
+        Session.remove()
+
+
+def background_creation_runner(region, key, creator, mutex):
+    """
+    Creation runner of the regions with `stale_while_revalidate` enabled,
+    expired values are served while they are recomputed in a background
+    thread, which is a greenlet with gevent workers.
+
+    The file and redis locks are bound to the thread which acquired them,
+    so the mutex acquired by dogpile is released right away and the
+    background thread takes it again. It skips the computation if the
+    value was revalidated by another worker in the meantime, which keeps
+    it to a single computation across workers.
+    """
+    mangled_key = region.key_mangler(key) if region.key_mangler else key
+    try:
+        value = region.backend.get(mangled_key)
+    finally:
+        mutex.release()
+    if value is NO_VALUE:
+        return
+    worker = threading.Thread(
+        target=_revalidate,
+        args=(region, key, creator, value.metadata['ct'],
+              threadlocal.manager.get()),
+        name='rc_cache_revalidate')
+    worker.daemon = True
+    worker.start()
+
+
 def get_default_cache_settings(settings, prefixes=None):
     prefixes = prefixes or []
     cache_settings = {}
@@ -167,15 +295,18 @@ def get_or_create_region(region_name, region_namespace=None):
         if not os.path.isdir(cache_dir):
             os.makedirs(cache_dir)
         new_region = make_region(
-            name=region_uid_name, function_key_generator=key_generator
+            name=region_uid_name, function_key_generator=key_generator,
+            async_creation_runner=region_obj.async_creation_runner
         )
         namespace_filename = os.path.join(
             cache_dir, "{}.cache.dbm".format(region_namespace))
+        arguments = {"filename": namespace_filename}
+        arguments.update(region_obj.actual_backend.serializer_arguments)
         # special type that allows 1db per namespace
         new_region.configure(
             backend='dogpile.cache.rc.file_namespace',
             expiration_time=expiration_time,
-            arguments={"filename": namespace_filename}
+            arguments=arguments
         )
 
         # create and save in region caches
@@ -185,8 +316,38 @@ def get_or_create_region(region_name, region_namespace=None):
     return region_obj
 
 
+def _clears_by_generation(backend):
+    """
+    Backends which keep all namespaces in one keyspace, and expire or evict
+    their values, clear namespaces by their generation. Only if the
+    generations are shared by all nodes, with a node local store the other
+    nodes would keep reading the keys of the old generation.
+    """
+    if not getattr(backend, 'clear_by_generation', False):
+        return False
+    store = get_generation_store()
+    return store is not None and store.shared
+
+
 def clear_cache_namespace(cache_region, cache_namespace_uid):
+    """
+    Clears all values of a cache namespace and returns the number of deleted
+    keys.
+
+    Regions which keep all namespaces in one keyspace, like redis, would
+    have to scan all of it for the keys of the namespace. If the generations
+    are kept in Redis, their namespaces are cleared by bumping the generation
+    which is part of their keys instead, and None is returned. The values of
+    older generations are left until they expire or are evicted.
+    """
     region = get_or_create_region(cache_region, cache_namespace_uid)
+    if _clears_by_generation(region.actual_backend):
+        generation = bump_namespace_generation(
+            cache_region, cache_namespace_uid)
+        log.debug('Cleared cache namespace %s of region %s, generation %s',
+                  cache_namespace_uid, cache_region, generation)
+        return None
+
     cache_keys = region.backend.list_keys(prefix=cache_namespace_uid)
     num_delete_keys = len(cache_keys)
     if num_delete_keys:
@@ -284,9 +445,13 @@ class InvalidationContext(object):
         Test if current object is valid, and return CacheRegion function
         that does invalidation and calculation
         """
+        self._start_time = time.time()
+        self.store = get_generation_store()
+        if self.store is not None:
+            return self._enter_generation()
+
         # register or get a new key based on uid
         self.cache_obj = self.get_or_create_cache_obj(uid=self.uid)
-        self._start_time = time.time()
         if self.cache_obj.cache_active:
             # means our cache obj is existing and marked as it's
             # cache is not outdated, we return ActiveRegionCache
@@ -300,6 +465,25 @@ class InvalidationContext(object):
         self.skip_cache_active_change = False
         return FreshRegionCache(context=self)
 
+    def _enter_generation(self):
+        """
+        Checks the generation counter of the invalidation namespace instead
+        of the `cache_invalidation` table.
+        """
+        try:
+            self.generation = self.store.get(self.invalidation_namespace)
+        except Exception:
+            log.exception('Failed to read generation of %s, computing the '
+                          'cache again', self.invalidation_namespace)
+            self.generation = None
+        if self.generation is not None and seen_generations.is_current(
+                self.cache_key, self.generation):
+            self.skip_cache_active_change = True
+            return ActiveRegionCache(context=self)
+
+        self.skip_cache_active_change = False
+        return FreshRegionCache(context=self)
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         # save compute time
         self.compute_time = time.time() - self._start_time
@@ -307,6 +491,11 @@ class InvalidationContext(object):
         if self.skip_cache_active_change:
             return
 
+        if self.store is not None:
+            if exc_type is None and self.generation is not None:
+                seen_generations.set(self.cache_key, self.generation)
+            return
+
         try:
             self.cache_obj.cache_active = True
             Session().add(self.cache_obj)
@@ -321,3 +510,122 @@ class InvalidationContext(object):
             Session().rollback()
             if self.raise_exception:
                 raise
+
+
+class RefsSnapshot(object):
+    """
+    Snapshot of the refs of a repository, shared by all processes through
+    the `cache_repo` region.
+
+    Snapshots are stored under the hash of their refs, a version key points
+    to the current one. It is bumped by the post push hook and dropped when
+    the caches of the repository are invalidated, readers which miss it
+    fetch the refs and store a new snapshot.
+
+    The region might be local to a node, so the snapshot is only used until
+    the repository is invalidated on any node, see :meth:`get_or_fetch`.
+    """
+    region_name = 'cache_repo'
+
+    def __init__(self, repo_id):
+        self.namespace = 'cache_repo.{}'.format(repo_id)
+        # keys have to be prefixed by the namespace to be cleared with it
+        self.version_key = '{}:refs_version'.format(self.namespace)
+        self.invalidation_namespace = \
+            CacheKey.REPO_INVALIDATION_NAMESPACE.format(repo_id=repo_id)
+
+    def __repr__(self):
+        return '<RefsSnapshot:{}>'.format(self.namespace)
+
+    @property
+    def region(self):
+        """
+        The region of the snapshots, or None if it is not configured or
+        disabled.
+        """
+        region_obj = region_meta.dogpile_cache_regions.get(self.region_name)
+        if not region_obj or not region_obj.expiration_time:
+            return None
+        return get_or_create_region(self.region_name, self.namespace)
+
+    def _get_snapshot_key(self, version):
+        return '{}:refs_snapshot_{}'.format(self.namespace, version)
+
+    @staticmethod
+    def compute_version(refs):
+        return sha1(repr(sorted(refs.items())))
+
+    def get(self):
+        """
+        Returns the refs of the current snapshot, or None.
+        """
+        region = self.region
+        if region is None:
+            return None
+        version = region.get(self.version_key)
+        if version is NO_VALUE:
+            return None
+        refs = region.get(self._get_snapshot_key(version))
+        if refs is NO_VALUE:
+            return None
+        log.debug('Using refs snapshot %s of %s', version, self)
+        return refs
+
+    def set(self, refs, bump=True):
+        """
+        Stores `refs` as a snapshot, it becomes the current one if `bump` is
+        set or if there is no current snapshot.
+        """
+        region = self.region
+        if region is None:
+            return
+        version = self.compute_version(refs)
+        current_version = region.get(self.version_key)
+        if not bump and current_version is not NO_VALUE and region.get(
+                self._get_snapshot_key(current_version)) is not NO_VALUE:
+            # don't replace a snapshot stored by a more recent push
+            return
+
+        region.set(self._get_snapshot_key(version), refs)
+        if current_version != version:
+            region.set(self.version_key, version)
+            if current_version is not NO_VALUE:
+                region.delete(self._get_snapshot_key(current_version))
+
+    def get_or_fetch(self, fetch_refs):
+        """
+        Returns the refs of the current snapshot, or fetches them with
+        `fetch_refs()` and stores them. Once the repository was invalidated,
+        on any node, every process fetches the refs once and makes them the
+        current snapshot, instead of using the one of its node.
+        """
+        if self.region is None:
+            return fetch_refs()
+
+        inv_context_manager = InvalidationContext(
+            uid='{}:refs'.format(self.namespace),
+            invalidation_namespace=self.invalidation_namespace,
+            thread_scoped=False)
+        with inv_context_manager as invalidation_context:
+            invalidated = invalidation_context.should_invalidate()
+            refs = None
+            if not invalidated:
+                refs = self.get()
+            if refs is None:
+                try:
+                    refs = fetch_refs()
+                except Exception:
+                    # fetch them again on the next lookup
+                    inv_context_manager.skip_cache_active_change = True
+                    raise
+                self.set(refs, bump=invalidated)
+            return refs
+
+    def invalidate(self):
+        region = self.region
+        if region is None:
+            return
+        version = region.get(self.version_key)
+        if version is not NO_VALUE:
+            region.delete(self._get_snapshot_key(version))
+        region.delete(self.version_key)
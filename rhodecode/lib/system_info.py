@@ -552,6 +552,7 @@ def vcs_backends():
 
 def vcs_server():
     import rhodecode
+    from rhodecode.lib.vcs import connection as vcs_connection
     from rhodecode.lib.vcs.backends import get_vcsserver_service_data
 
     server_url = rhodecode.CONFIG.get('vcs.server')
@@ -575,12 +576,22 @@ def vcs_server():
         connection = 'failed'
         state = {'message': str(e), 'type': STATE_ERR}
 
+    nodes = {}
+    pool = vcs_connection.ServerPool
+    if pool and len(pool.servers) > 1:
+        nodes = pool.check_health()
+        failed_nodes = [node for node, healthy in nodes.items() if not healthy]
+        if failed_nodes and state == STATE_OK_DEFAULT:
+            state = {'message': 'VCSServers {} are not reachable'.format(
+                ', '.join(sorted(failed_nodes))), 'type': STATE_WARN}
+
     value = dict(
         url=server_url,
         enabled=enabled,
         protocol=protocol,
         connection=connection,
         version=version,
+        nodes=nodes,
         text='',
     )
 
@@ -740,6 +751,20 @@ def usage_info():
     return SysInfoRes(value=value)
 
 
+def cache_stats():
+    from rhodecode.lib.rc_cache.stats import cache_stats_registry
+
+    value = cache_stats_registry.get_region_stats()
+    human_value = dict(value)
+    human_value['text'] = ', '.join(
+        '{}: {:.0%} hits ({}/{}), {:.1f}s computing'.format(
+            region, data['hit_ratio'], data['hits'],
+            data['hits'] + data['misses'], data['compute_time'])
+        for region, data in value.items()) or 'no cached lookups yet'
+
+    return SysInfoRes(value=value, human_value=human_value)
+
+
 def get_system_info(environ):
     environ = environ or {}
     return {
@@ -769,6 +794,7 @@ def get_system_info(environ):
 
         'vcs_backends': SysInfo(vcs_backends)(),
         'vcs_server': SysInfo(vcs_server)(),
+        'cache_stats': SysInfo(cache_stats)(),
 
         'git': SysInfo(git_info)(),
         'hg': SysInfo(hg_info)(),
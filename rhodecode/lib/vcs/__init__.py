@@ -66,27 +66,31 @@ def get_version():
 
 
 def connect_http(server_and_port):
-    from rhodecode.lib.vcs import connection, client_http
+    from rhodecode.lib.vcs import connection, client_http, server_pool
     from rhodecode.lib.middleware.utils import scm_app
 
     session_factory = client_http.ThreadlocalSessionFactory()
+    pool = server_pool.VcsServerPool(server_and_port)
 
+    connection.ServerPool = pool
     connection.Git = client_http.RepoMaker(
-        server_and_port, '/git', 'git', session_factory)
+        pool, '/git', 'git', session_factory)
     connection.Hg = client_http.RepoMaker(
-        server_and_port, '/hg', 'hg', session_factory)
+        pool, '/hg', 'hg', session_factory)
     connection.Svn = client_http.RepoMaker(
-        server_and_port, '/svn', 'svn', session_factory)
+        pool, '/svn', 'svn', session_factory)
     connection.Service = client_http.ServiceConnection(
-        server_and_port, '/_service', session_factory)
+        pool, '/_service', session_factory)
 
+    # the legacy scm_app proxies always use the first VCSServer
     scm_app.HG_REMOTE_WSGI = client_http.VcsHttpProxy(
-        server_and_port, '/proxy/hg')
+        pool.get_node(), '/proxy/hg')
     scm_app.GIT_REMOTE_WSGI = client_http.VcsHttpProxy(
-        server_and_port, '/proxy/git')
+        pool.get_node(), '/proxy/git')
 
     @atexit.register
     def free_connection_resources():
+        connection.ServerPool = None
         connection.Git = None
         connection.Hg = None
         connection.Svn = None
@@ -97,7 +101,8 @@ def connect_vcs(server_and_port, protocol):
     """
     Initializes the connection to the vcs server.
 
-    :param server_and_port: str, e.g. "localhost:9900"
+    :param server_and_port: str, e.g. "localhost:9900" or a comma separated
+        list of several servers
     :param protocol: str or "http"
     """
     if protocol == 'http':
@@ -114,10 +119,11 @@ def create_vcsserver_proxy(server_and_port, protocol):
 
 
 def _create_vcsserver_proxy_http(server_and_port):
-    from rhodecode.lib.vcs import client_http
+    from rhodecode.lib.vcs import client_http, server_pool
 
     session = _create_http_rpc_session()
-    url = urlparse.urljoin('http://%s' % server_and_port, '/server')
+    server = server_pool.get_pool(server_and_port).get_node()
+    url = urlparse.urljoin('http://%s' % server, '/server')
     return client_http.RemoteObject(url, session)
 
 
@@ -142,8 +148,10 @@ class CurlSession(object):
         curl.setopt(curl.TCP_NODELAY, True)
         curl.setopt(curl.PROTOCOLS, curl.PROTO_HTTP)
         self._curl = curl
+        self._headers = None
+        self._response_headers = None
 
-    def post(self, url, data, allow_redirects=False):
+    def post(self, url, data, allow_redirects=False, headers=None):
         response_buffer = StringIO()
 
         curl = self._curl
@@ -152,11 +160,33 @@ class CurlSession(object):
         curl.setopt(curl.POSTFIELDS, data)
         curl.setopt(curl.FOLLOWLOCATION, allow_redirects)
         curl.setopt(curl.WRITEDATA, response_buffer)
+        if headers != self._headers:
+            self._set_headers(headers)
+        if self._response_headers is not None:
+            self._response_headers = {}
         curl.perform()
 
         status_code = curl.getinfo(pycurl.HTTP_CODE)
 
-        return CurlResponse(response_buffer, status_code)
+        return CurlResponse(
+            response_buffer, status_code, self._response_headers)
+
+    def _set_headers(self, headers):
+        curl = self._curl
+        curl.setopt(curl.HTTPHEADER, ["Expect:"] + [
+            '{}: {}'.format(key, val) for key, val in (headers or {}).items()])
+        self._headers = headers
+
+        # response headers are only needed once extra headers are sent,
+        # parsing them is skipped for plain calls
+        if headers and self._response_headers is None:
+            self._response_headers = {}
+            curl.setopt(curl.HEADERFUNCTION, self._parse_header_line)
+
+    def _parse_header_line(self, line):
+        if ':' in line:
+            key, val = line.split(':', 1)
+            self._response_headers[key.strip().lower()] = val.strip()
 
 
 class CurlResponse(object):
@@ -168,9 +198,11 @@ class CurlResponse(object):
     `requests` as a drop in replacement for benchmarking purposes.
     """
 
-    def __init__(self, response_buffer, status_code):
+    def __init__(self, response_buffer, status_code, headers=None):
         self._response_buffer = response_buffer
         self._status_code = status_code
+        # lower cased header names, only set for requests with extra headers
+        self.headers = headers or {}
 
     @property
     def content(self):
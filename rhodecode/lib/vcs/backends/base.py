@@ -261,6 +261,10 @@ class BaseRepository(object):
     EMPTY_COMMIT_ID = '0' * 40
 
     path = None
+    # backend specific :class:`Diff`, used by :meth:`get_diff_lazy`
+    diff_class = None
+    # shared snapshot of the refs, see :class:`rhodecode.lib.rc_cache.RefsSnapshot`
+    refs_snapshot = None
 
     def __init__(self, repo_path, config=None, create=False, **kwargs):
         """
@@ -504,6 +508,30 @@ class BaseRepository(object):
         """
         raise NotImplementedError
 
+    def get_diff_streamed(
+            self, commit1, commit2, path=None, ignore_whitespace=False,
+            context=3, path1=None):
+        """
+        Returns an iterator over chunks of the raw diff, parameters are the
+        same as for :meth:`get_diff`. Backends which can fetch the diff in
+        chunks override it, by default the whole diff is fetched at once.
+        """
+        diff = self.get_diff(
+            commit1, commit2, path=path, ignore_whitespace=ignore_whitespace,
+            context=context, path1=path1)
+        return iter([diff.raw])
+
+    def get_diff_lazy(
+            self, commit1, commit2, path=None, ignore_whitespace=False,
+            context=3, path1=None):
+        """
+        Returns a diff like :meth:`get_diff`, which is read in chunks from
+        :meth:`get_diff_streamed` while its files are iterated.
+        """
+        return self.diff_class(self.get_diff_streamed(
+            commit1, commit2, path=path, ignore_whitespace=ignore_whitespace,
+            context=context, path1=path1))
+
     def strip(self, commit_id, branch=None):
         """
         Strip given commit_id from the repository
@@ -1030,6 +1058,34 @@ class BaseCommit(object):
         """
         raise NotImplementedError
 
+    def get_file_id(self, path):
+        """
+        Returns the id of the content of the file at the given `path`, like
+        the blob id of git, or None if the backend doesn't have one.
+        """
+        return None
+
+    def get_file_content_streamed(self, path):
+        """
+        Returns an iterator over chunks of the content of the file at the
+        given `path`, by default the whole content is fetched at once.
+        """
+        return iter([self.get_file_content(path)])
+
+    def get_file_contents(self, paths):
+        """
+        Returns a list with contents of the files at the given `paths`.
+        Backends can override it to fetch all of them in one batched call.
+        """
+        return [self.get_file_content(path) for path in paths]
+
+    def get_file_sizes(self, paths):
+        """
+        Returns a list with sizes of the files at the given `paths`.
+        Backends can override it to fetch all of them in one batched call.
+        """
+        return [self.get_file_size(path) for path in paths]
+
     def get_path_commit(self, path, pre_load=None):
         """
         Returns last commit of the file at the given `path`.
@@ -1646,6 +1702,9 @@ class EmptyRepository(BaseRepository):
 
 
 class CollectionGenerator(object):
+    # number of commits created together, allows backends to batch the
+    # remote calls needed to create them
+    batch_size = 50
 
     def __init__(self, repo, commit_ids, collection_size=None, pre_load=None, translate_tag=None):
         self.repo = repo
@@ -1661,9 +1720,11 @@ class CollectionGenerator(object):
         return self.commit_ids.__len__()
 
     def __iter__(self):
-        for commit_id in self.commit_ids:
+        for start in xrange(0, len(self.commit_ids), self.batch_size):
             # TODO: johbo: Mercurial passes in commit indices or commit ids
-            yield self._commit_factory(commit_id)
+            commit_ids = self.commit_ids[start:start + self.batch_size]
+            for commit in self._commit_batch_factory(commit_ids):
+                yield commit
 
     def _commit_factory(self, commit_id):
         """
@@ -1673,6 +1734,13 @@ class CollectionGenerator(object):
             commit_id=commit_id, pre_load=self.pre_load,
             translate_tag=self.translate_tag)
 
+    def _commit_batch_factory(self, commit_ids):
+        """
+        Allows backends to generate a batch of commits at once, by default
+        every commit is created by :meth:`_commit_factory`.
+        """
+        return [self._commit_factory(commit_id) for commit_id in commit_ids]
+
     def __getslice__(self, i, j):
         """
         Returns an iterator of sliced repository
@@ -1696,6 +1764,8 @@ class Config(object):
 
     def __init__(self):
         self._values = {}
+        # bumped on every change, allows users to cache the serialized form
+        self.version = 0
 
     def copy(self):
         clone = Config()
@@ -1716,9 +1786,11 @@ class Config(object):
     def set(self, section, option, value):
         section_values = self._values.setdefault(section, {})
         section_values[option] = value
+        self.version += 1
 
     def clear_section(self, section):
         self._values[section] = {}
+        self.version += 1
 
     def serialize(self):
         """
@@ -1733,10 +1805,64 @@ class Config(object):
         return items
 
 
+# chunks of a streamed diff smaller than this are joined with the end of the
+# previous chunk, bigger ones are searched for file headers in place
+_DIFF_COPY_LIMIT = 64 * 1024
+
+
+def split_diff_parts(raw_chunks, separator='\ndiff --git'):
+    """
+    Yields the parts of a raw diff between its `separator` lines together
+    with a flag of the last part, like `('\n' + raw).split(separator)` does
+    for a whole diff. The diff is read from the iterable `raw_chunks` while
+    the parts are consumed, so only a single part is kept in memory.
+    """
+    keep = len(separator) - 1
+    pieces = []
+    # the diff starts with a separator as well, just without the newline
+    tail = '\n'
+    for raw_chunk in raw_chunks:
+        if len(raw_chunk) < max(_DIFF_COPY_LIMIT, keep):
+            data, start = tail + raw_chunk, 0
+        else:
+            # a separator might start in the end of the previous chunk
+            data = raw_chunk
+            idx = (tail + raw_chunk[:keep]).find(separator)
+            if idx == -1:
+                pieces.append(tail)
+                start = 0
+            else:
+                pieces.append(tail[:idx])
+                yield ''.join(pieces), False
+                pieces = []
+                start = idx + len(separator) - len(tail)
+
+        idx = data.find(separator, start)
+        while idx != -1:
+            pieces.append(data[start:idx])
+            yield ''.join(pieces), False
+            pieces = []
+            start = idx + len(separator)
+            idx = data.find(separator, start)
+
+        # the end of the chunk might be the start of a separator
+        tail_start = max(start, len(data) - keep)
+        pieces.append(data[start:tail_start])
+        tail = data[tail_start:]
+
+    pieces.append(tail)
+    yield ''.join(pieces), True
+
+
 class Diff(object):
     """
     Represents a diff result from a repository backend.
 
+    The raw diff is either a string or an iterable of its chunks, e.g. from
+    :meth:`BaseRepository.get_diff_streamed`. Streamed diffs are read while
+    iterating over :meth:`chunks`, which can be done only once, unless
+    :attr:`raw` was accessed before.
+
     Subclasses have to provide a backend specific value for
     :attr:`_header_re` and :attr:`_meta_re`.
     """
@@ -1744,7 +1870,21 @@ class Diff(object):
     _header_re = None
 
     def __init__(self, raw_diff):
-        self.raw = raw_diff
+        if isinstance(raw_diff, compat.string_types):
+            self._raw = raw_diff
+            self._raw_chunks = None
+        else:
+            self._raw = None
+            self._raw_chunks = raw_diff
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            if self._raw_chunks is None:
+                raise ValueError('Streamed diff was already consumed')
+            self._raw = ''.join(self._raw_chunks)
+            self._raw_chunks = None
+        return self._raw
 
     def chunks(self):
         """
@@ -1752,19 +1892,22 @@ class Diff(object):
         to make diffs consistent we must prepend with \n, and make sure
         we can detect last chunk as this was also has special rule
         """
+        if self._raw is not None:
+            raw_chunks = [self._raw]
+        elif self._raw_chunks is not None:
+            raw_chunks, self._raw_chunks = self._raw_chunks, None
+        else:
+            raise ValueError('Streamed diff was already consumed')
 
-        diff_parts = ('\n' + self.raw).split('\ndiff --git')
-        header = diff_parts[0]
+        diff_parts = split_diff_parts(raw_chunks)
+        header, __ = next(diff_parts)
 
         if self._meta_re:
             match = self._meta_re.match(header)
 
-        chunks = diff_parts[1:]
-        total_chunks = len(chunks)
-
         return (
-            DiffChunk(chunk, self, cur_chunk == total_chunks)
-            for cur_chunk, chunk in enumerate(chunks, start=1))
+            DiffChunk(chunk, self, last_chunk)
+            for chunk, last_chunk in diff_parts)
 
 
 class DiffChunk(object):
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Compact containers of the commit ids of a repository.
+
+The commit ids are kept as 20 byte binary shas in a single buffer, ordered
+by their commit index, plus a buffer of `(binary sha, commit index)` entries
+sorted by the sha which is used for lookups with a binary search. That's 44
+bytes per commit instead of ~150 bytes of a list and a dict of hex strings.
+The buffers can be plain strings or memory-mapped files, see
+:mod:`rhodecode.lib.vcs.backends.git.commit_index`.
+
+Filtered histories, e.g. of a branch, are represented by
+:class:`LazyCommitIds`, which only fetches the requested range of ids.
+"""
+
+import binascii
+import struct
+
+
+SHA_SIZE = 20
+SORTED_ENTRY = struct.Struct('>20sI')
+
+
+def to_binary(commit_id):
+    """
+    Returns the binary form of the full hex `commit_id`, or None.
+    """
+    if len(commit_id) != SHA_SIZE * 2:
+        return None
+    try:
+        return binascii.unhexlify(commit_id)
+    except (TypeError, UnicodeEncodeError):
+        return None
+
+
+def iter_sorted_entries(ids_data, count):
+    """
+    Yields the packed sorted entries of the first `count` ids of `ids_data`.
+    """
+    entries = sorted(
+        (ids_data[idx * SHA_SIZE:(idx + 1) * SHA_SIZE], idx)
+        for idx in xrange(count))
+    for binary_id, idx in entries:
+        yield SORTED_ENTRY.pack(binary_id, idx)
+
+
+def compact_commit_ids(commit_ids):
+    """
+    Returns `commit_ids` as :class:`CommitIdList`, or unchanged if they are
+    not all full shas.
+    """
+    try:
+        return CommitIdList.from_commit_ids(commit_ids)
+    except (TypeError, ValueError):
+        return commit_ids
+
+
+class CommitIdList(object):
+    """
+    Read only, list like container of the commit ids of a repository. Items
+    are returned as hex strings, :attr:`positions` maps them back to their
+    index.
+
+    Only the first `sorted_count` ids are covered by `sorted_data`, the
+    remaining ones are looked up in a dict.
+    """
+
+    def __init__(self, ids_data, count, sorted_data, sorted_count):
+        self._ids = ids_data
+        self._count = count
+        self._sorted = sorted_data
+        self._sorted_count = sorted_count
+        self._tail = dict(
+            (ids_data[idx * SHA_SIZE:(idx + 1) * SHA_SIZE], idx)
+            for idx in xrange(sorted_count, count))
+        # commits created by this instance, e.g. by an in-memory commit
+        self._appended = []
+        self.positions = CommitIdPositions(self)
+
+    @classmethod
+    def from_commit_ids(cls, commit_ids):
+        """
+        Creates the container from a list of hex commit ids, raises
+        `ValueError` if they are not all full shas.
+        """
+        count = len(commit_ids)
+        ids_data = binascii.unhexlify(''.join(commit_ids))
+        if len(ids_data) != count * SHA_SIZE:
+            raise ValueError('Commit ids have to be full shas')
+        sorted_data = ''.join(iter_sorted_entries(ids_data, count))
+        return cls(ids_data, count, sorted_data, count)
+
+    def __repr__(self):
+        return '<%s: %s commits>' % (self.__class__.__name__, len(self))
+
+    def __len__(self):
+        return self._count + len(self._appended)
+
+    def __iter__(self):
+        chunk_size = 1024
+        for start in xrange(0, self._count, chunk_size):
+            for commit_id in self._slice(
+                    start, min(start + chunk_size, self._count)):
+                yield commit_id
+        for commit_id in self._appended:
+            yield commit_id
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self._slice(start, stop)
+            return [self[idx] for idx in xrange(start, stop, step)]
+
+        idx = int(key)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('commit index out of range')
+        if idx >= self._count:
+            return self._appended[idx - self._count]
+        return binascii.hexlify(
+            self._ids[idx * SHA_SIZE:(idx + 1) * SHA_SIZE])
+
+    def __contains__(self, commit_id):
+        return self.index(commit_id, None) is not None
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def _slice(self, start, stop):
+        stop = max(start, stop)
+        stored_stop = min(stop, self._count)
+        result = []
+        if start < stored_stop:
+            data = binascii.hexlify(
+                self._ids[start * SHA_SIZE:stored_stop * SHA_SIZE])
+            step = SHA_SIZE * 2
+            result = [data[pos:pos + step]
+                      for pos in xrange(0, len(data), step)]
+        if stop > self._count:
+            result.extend(self._appended[
+                max(0, start - self._count):stop - self._count])
+        return result
+
+    def _find_sorted(self, binary_id):
+        lo, hi = 0, self._sorted_count
+        entry_size = SORTED_ENTRY.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = mid * entry_size
+            entry_id, idx = SORTED_ENTRY.unpack(
+                self._sorted[offset:offset + entry_size])
+            if entry_id < binary_id:
+                lo = mid + 1
+            elif entry_id > binary_id:
+                hi = mid
+            else:
+                return idx
+        return None
+
+    def index(self, commit_id, default=None):
+        """
+        Returns the commit index of `commit_id` or `default`.
+        """
+        binary_id = to_binary(commit_id)
+        if binary_id is None:
+            return default
+
+        idx = self._tail.get(binary_id)
+        if idx is None:
+            idx = self._find_sorted(binary_id)
+        if idx is None and commit_id in self._appended:
+            idx = self._count + self._appended.index(commit_id)
+        return default if idx is None else idx
+
+    def append(self, commit_id):
+        self._appended.append(commit_id)
+
+
+class CommitIdPositions(object):
+    """
+    Dict like view mapping commit ids to their commit index.
+    """
+
+    def __init__(self, commit_id_list):
+        self._commit_id_list = commit_id_list
+
+    def __len__(self):
+        return len(self._commit_id_list)
+
+    def __getitem__(self, commit_id):
+        idx = self._commit_id_list.index(commit_id)
+        if idx is None:
+            raise KeyError(commit_id)
+        return idx
+
+    def __contains__(self, commit_id):
+        return self._commit_id_list.index(commit_id) is not None
+
+    def get(self, commit_id, default=None):
+        return self._commit_id_list.index(commit_id, default)
+
+
+class LazyCommitIds(object):
+    """
+    Read only, list like sequence of commit ids which are fetched from the
+    repository on demand. Its length comes from `get_count()`, slices from
+    `get_range(start, stop, count)`, so showing a page of a long history only
+    fetches the ids of that page.
+
+    Unless `fetch_all` is disabled, the whole sequence is fetched once a
+    second range is requested, which keeps iterating over it in batches
+    cheap.
+    """
+
+    def __init__(self, get_count, get_range, fetch_all=True):
+        self._get_count = get_count
+        self._get_range = get_range
+        self._fetch_all = fetch_all
+        self._count = None
+        self._commit_ids = None
+        self._ranges_fetched = 0
+
+    @classmethod
+    def window(cls, commit_ids, start, stop):
+        """
+        Returns a lazy `commit_ids[start:stop]` which doesn't fetch or copy
+        any ids until it is sliced itself.
+        """
+        def get_bounds():
+            return slice(start, stop).indices(len(commit_ids))[:2]
+
+        def get_count():
+            window_start, window_stop = get_bounds()
+            return max(0, window_stop - window_start)
+
+        def get_range(range_start, range_stop, count):
+            offset = get_bounds()[0]
+            return commit_ids[offset + range_start:offset + range_stop]
+
+        return cls(get_count, get_range, fetch_all=False)
+
+    def __repr__(self):
+        return '<LazyCommitIds: %s commits>' % len(self)
+
+    def __len__(self):
+        if self._count is None:
+            if self._commit_ids is not None:
+                self._count = len(self._commit_ids)
+            else:
+                self._count = self._get_count()
+        return self._count
+
+    def __iter__(self):
+        return iter(self._get_all())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self._get_all()[key]
+            if stop <= start:
+                return []
+            if self._commit_ids is None and (
+                    not self._fetch_all or not self._ranges_fetched):
+                self._ranges_fetched += 1
+                return list(self._get_range(start, stop, len(self)))
+            return self._get_all()[start:stop]
+
+        idx = int(key)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('commit index out of range')
+        return self[idx:idx + 1][0]
+
+    def __contains__(self, commit_id):
+        return commit_id in self._get_all()
+
+    def _get_all(self):
+        if self._commit_ids is None:
+            count = len(self)
+            self._commit_ids = list(self._get_range(0, count, count))
+        return self._commit_ids
@@ -87,15 +87,20 @@ class GitCommit(base.BaseCommit):
         self.nodes = {}
         self._submodules = None
 
+    @classmethod
+    def _get_bulk_pre_load(cls, pre_load):
+        return [entry for entry in pre_load or []
+                if entry not in cls._filter_pre_load]
+
     def _set_bulk_properties(self, pre_load):
-        if not pre_load:
-            return
-        pre_load = [entry for entry in pre_load
-                    if entry not in self._filter_pre_load]
+        pre_load = self._get_bulk_pre_load(pre_load)
         if not pre_load:
             return
 
         result = self._remote.bulk_request(self.raw_id, pre_load)
+        self._update_bulk_properties(result)
+
+    def _update_bulk_properties(self, result):
         for attr, value in result.items():
             if attr in ["author", "message"]:
                 if value:
@@ -292,6 +297,10 @@ class GitCommit(base.BaseCommit):
         id_, _ = self._get_id_for_path(path)
         return self._remote.blob_as_pretty_string(id_)
 
+    def get_file_content_streamed(self, path):
+        id_, _ = self._get_id_for_path(path)
+        return self._remote.stream_call('blob_as_pretty_string', id_)
+
     def get_file_size(self, path):
         """
         Returns size of the file at given `path`.
@@ -299,6 +308,25 @@ class GitCommit(base.BaseCommit):
         id_, _ = self._get_id_for_path(path)
         return self._remote.blob_raw_length(id_)
 
+    def get_file_id(self, path):
+        """
+        Returns the blob id of the file at given `path`.
+        """
+        id_, _ = self._get_id_for_path(path)
+        return id_
+
+    def get_file_contents(self, paths):
+        ids = [self._get_id_for_path(path)[0] for path in paths]
+        with self._remote.batch() as batch:
+            results = [batch.blob_as_pretty_string(id_) for id_ in ids]
+        return [result.result() for result in results]
+
+    def get_file_sizes(self, paths):
+        ids = [self._get_id_for_path(path)[0] for path in paths]
+        with self._remote.batch() as batch:
+            results = [batch.blob_raw_length(id_) for id_ in ids]
+        return [result.result() for result in results]
+
     def get_path_history(self, path, limit=None, pre_load=None):
         """
         Returns history of file as reversed list of `GitCommit` objects for
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Persistent index of the commit ids of a Git repository.
+
+The index is stored inside of the git directory and consists of
+
+- an append only file with the binary commit ids in the order of their
+  commit index,
+- a file with `(binary commit id, commit index)` records sorted by the
+  commit id, which covers the first `sorted_count` commits and is searched
+  with a binary search,
+- a json meta file with the number of commits and the ref tips the index
+  was built for. It is replaced atomically and marks the data as valid.
+
+Commits appended after the last sort are looked up in a small in-memory
+dict. The data files are memory-mapped as a
+:class:`~rhodecode.lib.vcs.backends.commit_ids.CommitIdList`, so all
+processes share the pages of the page cache instead of holding a list and a
+dict of every commit id.
+"""
+
+import binascii
+import contextlib
+import errno
+import fcntl
+import json
+import logging
+import mmap
+import os
+import time
+import uuid
+
+from rhodecode.lib.vcs.backends.commit_ids import (
+    CommitIdList, SHA_SIZE, SORTED_ENTRY, iter_sorted_entries)
+
+
+log = logging.getLogger(__name__)
+
+INDEX_DIR = 'rhodecode-commit-index'
+INDEX_VERSION = 1
+
+# the sorted file is rewritten once more commits than this were appended
+MAX_UNSORTED = 5000
+
+# waiting for the lock of another update longer than this fails, the commit
+# ids are then loaded without the index
+LOCK_TIMEOUT = 60
+LOCK_RETRY_WAIT = 0.03
+
+
+def _map_file(path, size):
+    if not size:
+        return ''
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+
+class CommitIndexStore(object):
+    """
+    Storage of the persistent commit index in the directory `path`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return '<CommitIndexStore: %s>' % self.path
+
+    def _get_path(self, name):
+        return os.path.join(self.path, name)
+
+    def _acquire_lock(self, lock_file):
+        # flock blocks the whole process, which would block all greenlets of
+        # a gevent worker while an update calls the vcsserver. It is retried
+        # instead, gevent makes `time.sleep` cooperative.
+        start_lock_time = time.time()
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except (OSError, IOError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                elif (time.time() - start_lock_time) > LOCK_TIMEOUT:
+                    raise IOError(
+                        errno.EAGAIN, 'Failed to acquire lock on `{}` after '
+                        'waiting {}s'.format(lock_file.name, LOCK_TIMEOUT))
+            time.sleep(LOCK_RETRY_WAIT)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Exclusive lock held while the index is updated, readers don't need
+        it as they only rely on the atomically replaced meta file.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(self._get_path('lock'), 'a') as lock_file:
+            self._acquire_lock(lock_file)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_meta(self):
+        try:
+            with open(self._get_path('meta.json'), 'rb') as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('version') != INDEX_VERSION:
+            return None
+        return meta
+
+    def _write_meta(self, meta):
+        meta['version'] = INDEX_VERSION
+        tmp_path = self._get_path('meta.json.%s' % uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            json.dump(meta, f)
+        os.rename(tmp_path, self._get_path('meta.json'))
+
+    def _write_sorted(self, ids_data, count):
+        name = 'sorted-%s' % uuid.uuid4().hex
+        with open(self._get_path(name), 'wb') as f:
+            for entry in iter_sorted_entries(ids_data, count):
+                f.write(entry)
+        return name
+
+    def _remove_stale(self, meta):
+        """
+        Removes data files not referenced by `meta`, processes which still
+        have them mapped keep their copy until they are done.
+        """
+        current = (meta['ids_file'], meta['sorted_file'])
+        for name in os.listdir(self.path):
+            if name.startswith(('ids-', 'sorted-')) and name not in current:
+                try:
+                    os.remove(self._get_path(name))
+                except OSError:
+                    pass
+
+    def load(self, meta=None):
+        """
+        Returns a :class:`CommitIdList` of the stored data, or None if there
+        is no valid index.
+        """
+        meta = meta or self.read_meta()
+        if meta is None:
+            return None
+        count, sorted_count = meta['count'], meta['sorted_count']
+        try:
+            ids_data = _map_file(
+                self._get_path(meta['ids_file']), count * SHA_SIZE)
+            sorted_data = _map_file(
+                self._get_path(meta['sorted_file']),
+                sorted_count * SORTED_ENTRY.size)
+        except (IOError, OSError, ValueError):
+            # replaced by a concurrent update
+            log.debug('Failed to map commit index %s', self, exc_info=True)
+            return None
+        return CommitIdList(ids_data, count, sorted_data, sorted_count)
+
+    def write(self, commit_ids, tips):
+        """
+        Replaces the index with `commit_ids`, built for the ref `tips`.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        ids_file = 'ids-%s' % uuid.uuid4().hex
+        with open(self._get_path(ids_file), 'wb') as f:
+            for commit_id in commit_ids:
+                f.write(binascii.unhexlify(commit_id))
+
+        count = len(commit_ids)
+        ids_data = _map_file(self._get_path(ids_file), count * SHA_SIZE)
+        meta = {
+            'count': count,
+            'sorted_count': count,
+            'ids_file': ids_file,
+            'sorted_file': self._write_sorted(ids_data, count),
+            'tips': sorted(tips),
+        }
+        self._write_meta(meta)
+        self._remove_stale(meta)
+        return meta
+
+    def append(self, meta, commit_ids, tips):
+        """
+        Appends new `commit_ids` to the index described by `meta`.
+        """
+        count = meta['count']
+        ids_path = self._get_path(meta['ids_file'])
+        with open(ids_path, 'r+b') as f:
+            # drop leftovers of an interrupted update
+            f.truncate(count * SHA_SIZE)
+            f.seek(0, os.SEEK_END)
+            for commit_id in commit_ids:
+                f.write(binascii.unhexlify(commit_id))
+
+        meta = dict(meta)
+        meta['count'] = count + len(commit_ids)
+        meta['tips'] = sorted(tips)
+        if meta['count'] - meta['sorted_count'] > MAX_UNSORTED:
+            ids_data = _map_file(ids_path, meta['count'] * SHA_SIZE)
+            meta['sorted_file'] = self._write_sorted(ids_data, meta['count'])
+            meta['sorted_count'] = meta['count']
+        self._write_meta(meta)
+        self._remove_stale(meta)
+        return meta
+
+    def update(self, tips, get_all_commit_ids, get_new_commit_ids):
+        """
+        Brings the index up to date with the ref `tips` and returns it.
+
+        New commits are appended with the result of
+        `get_new_commit_ids(old_tips, tips)`, which returns None if commits
+        were removed from the repository. In that case, or if there is no
+        index yet, it is rebuilt from `get_all_commit_ids()`.
+        """
+        tips = sorted(tips)
+        meta = self.read_meta()
+        if meta is not None and meta['tips'] == tips:
+            return self.load(meta)
+
+        with self.lock():
+            # another process might have done the update in the meantime
+            meta = self.read_meta()
+            if meta is None or meta['tips'] != tips:
+                new_commit_ids = None
+                if meta is not None:
+                    new_commit_ids = get_new_commit_ids(meta['tips'], tips)
+
+                if new_commit_ids is None:
+                    log.debug('Building commit index %s', self)
+                    meta = self.write(get_all_commit_ids(), tips)
+                else:
+                    log.debug('Appending %s commits to commit index %s',
+                              len(new_commit_ids), self)
+                    meta = self.append(meta, new_commit_ids, tips)
+            return self.load(meta)
@@ -33,10 +33,15 @@ from rhodecode.lib.datelib import (
     utcdate_fromtimestamp, makedate, date_astimestamp)
 from rhodecode.lib.utils import safe_unicode, safe_str
 from rhodecode.lib.vcs import connection, path as vcspath
+from rhodecode.lib.vcs.conf import settings
 from rhodecode.lib.vcs.backends.base import (
     BaseRepository, CollectionGenerator, Config, MergeResponse,
     MergeFailureReason, Reference)
 from rhodecode.lib.vcs.backends.git.commit import GitCommit
+from rhodecode.lib.vcs.backends.commit_ids import (
+    CommitIdList, LazyCommitIds, compact_commit_ids)
+from rhodecode.lib.vcs.backends.git.commit_index import (
+    CommitIndexStore, INDEX_DIR)
 from rhodecode.lib.vcs.backends.git.diff import GitDiff
 from rhodecode.lib.vcs.backends.git.inmemory import GitInMemoryCommit
 from rhodecode.lib.vcs.exceptions import (
@@ -54,6 +59,7 @@ class GitRepository(BaseRepository):
     Git repository backend.
     """
     DEFAULT_BRANCH_NAME = 'master'
+    diff_class = GitDiff
 
     contact = BaseRepository.DEFAULT_CONTACT
 
@@ -87,14 +93,74 @@ class GitRepository(BaseRepository):
         Returns list of commit ids, in ascending order.  Being lazy
         attribute allows external tools to inject commit ids from cache.
         """
-        commit_ids = self._get_all_commit_ids()
+        commit_ids = self._load_commit_ids()
         self._rebuild_cache(commit_ids)
         return commit_ids
 
+    def _load_commit_ids(self):
+        commit_ids = None
+        if settings.GIT_COMMIT_INDEX:
+            commit_ids = self._get_commit_index()
+        if commit_ids is None:
+            commit_ids = compact_commit_ids(self._get_all_commit_ids())
+        return commit_ids
+
     def _rebuild_cache(self, commit_ids):
+        if isinstance(commit_ids, CommitIdList):
+            self._commit_ids = commit_ids.positions
+            return
         self._commit_ids = dict((commit_id, index)
                                 for index, commit_id in enumerate(commit_ids))
 
+    @LazyProperty
+    def _commit_index_store(self):
+        git_dir = self.path
+        if os.path.isdir(os.path.join(self.path, '.git')):
+            git_dir = os.path.join(self.path, '.git')
+        return CommitIndexStore(os.path.join(git_dir, INDEX_DIR))
+
+    def _get_commit_index(self):
+        """
+        Returns the persistent commit index of this repository,
+        updated to the current refs, or None if it can't be used.
+        """
+        tips = [sha for ref, sha in self._refs.iteritems()
+                if ref.startswith(('refs/heads/', 'refs/tags/'))]
+        if not tips:
+            return None
+        try:
+            return self._commit_index_store.update(
+                tips, self._get_all_commit_ids, self._get_new_commit_ids)
+        except (IOError, OSError, ValueError):
+            log.warning('Failed to use the commit index of %s', self,
+                        exc_info=True)
+            return None
+
+    def _get_new_commit_ids(self, old_tips, tips):
+        """
+        Returns the commits reachable from `tips` but not from `old_tips`,
+        in the order they would be appended by `_get_all_commit_ids`, or None
+        if some of the commits of `old_tips` are gone.
+        """
+        removed_tips = set(old_tips).difference(tips)
+        added_tips = sorted(set(tips).difference(old_tips))
+        try:
+            if removed_tips:
+                cmd = (['rev-list', '--max-count=1'] + sorted(removed_tips) +
+                       ['--not'] + sorted(tips))
+                output, __ = self.run_git_command(cmd)
+                if output.strip():
+                    return None
+            if not added_tips:
+                return []
+            cmd = (['rev-list', '--reverse', '--date-order'] + added_tips +
+                   ['--not'] + sorted(old_tips))
+            output, __ = self.run_git_command(cmd)
+        except RepositoryError:
+            # old tips might have been garbage collected
+            return None
+        return output.splitlines()
+
     def run_git_command(self, cmd, **opts):
         """
         Runs given ``cmd`` as git command and returns tuple
@@ -185,15 +251,7 @@ class GitRepository(BaseRepository):
         except OSError as err:
             raise RepositoryError(err)
 
-    def _get_all_commit_ids(self, filters=None):
-        # we must check if this repo is not empty, since later command
-        # fails if it is. And it's cheaper to ask than throw the subprocess
-        # errors
-
-        head = self._remote.head(show_exc=False)
-        if not head:
-            return []
-
+    def _get_rev_filter(self, filters=None):
         rev_filter = ['--branches', '--tags']
         extra_filter = []
 
@@ -206,15 +264,19 @@ class GitRepository(BaseRepository):
                 rev_filter = ['--tags']
                 extra_filter.append(filters['branch_name'])
         rev_filter.extend(extra_filter)
+        return rev_filter
 
-            # if filters.get('start') or filters.get('end'):
-            #     # skip is offset, max-count is limit
-            #     if filters.get('start'):
-            #         extra_filter += ' --skip=%s' % filters['start']
-            #     if filters.get('end'):
-            #         extra_filter += ' --max-count=%s' % (filters['end'] - (filters['start'] or 0))
+    def _get_all_commit_ids(self, filters=None):
+        # we must check if this repo is not empty, since later command
+        # fails if it is. And it's cheaper to ask than throw the subprocess
+        # errors
+
+        head = self._remote.head(show_exc=False)
+        if not head:
+            return []
 
-        cmd = ['rev-list', '--reverse', '--date-order'] + rev_filter
+        cmd = ['rev-list', '--reverse', '--date-order'] + \
+            self._get_rev_filter(filters)
         try:
             output, __ = self.run_git_command(cmd)
         except RepositoryError:
@@ -222,6 +284,35 @@ class GitRepository(BaseRepository):
             return []
         return output.splitlines()
 
+    def _get_filtered_commit_ids(self, filters):
+        """
+        Returns the commit ids matching `filters` as :class:`LazyCommitIds`,
+        git counts them and returns just the requested range of them.
+        """
+        rev_filter = self._get_rev_filter(filters)
+
+        def get_count():
+            try:
+                output, __ = self.run_git_command(
+                    ['rev-list', '--count'] + rev_filter)
+            except RepositoryError:
+                return 0
+            return int(output.strip() or 0)
+
+        def get_range(start, stop, count):
+            # --reverse is applied after skipping, so the range is counted
+            # from the most recent commit
+            cmd = ['rev-list', '--reverse', '--date-order',
+                   '--skip=%s' % (count - stop),
+                   '--max-count=%s' % (stop - start)] + rev_filter
+            try:
+                output, __ = self.run_git_command(cmd)
+            except RepositoryError:
+                return []
+            return output.splitlines()
+
+        return LazyCommitIds(get_count, get_range)
+
     def _get_commit_id(self, commit_id_or_idx):
         def is_null(value):
             return len(value) == commit_id_or_idx.count('0')
@@ -402,11 +493,20 @@ class GitRepository(BaseRepository):
             raise RepositoryError(e.strerror)
 
     def _get_refs(self):
-        return self._remote.get_refs()
+        """
+        Fetches the refs of the repository and makes them the current refs
+        snapshot, used after the refs were changed.
+        """
+        refs = self._remote.get_refs()
+        if self.refs_snapshot is not None:
+            self.refs_snapshot.set(refs)
+        return refs
 
     @LazyProperty
     def _refs(self):
-        return self._get_refs()
+        if self.refs_snapshot is None:
+            return self._remote.get_refs()
+        return self.refs_snapshot.get_or_fetch(self._remote.get_refs)
 
     @property
     def _ref_tree(self):
@@ -503,34 +603,21 @@ class GitRepository(BaseRepository):
             filter_.append({'since': start_date})
             filter_.append({'until': end_date})
 
-        # if start_pos or end_pos:
-        #     filter_.append({'start': start_pos})
-        #     filter_.append({'end': end_pos})
-
         if filter_:
             revfilters = {
                 'branch_name': branch_name,
                 'since': start_date.strftime('%m/%d/%y %H:%M:%S') if start_date else None,
                 'until': end_date.strftime('%m/%d/%y %H:%M:%S') if end_date else None,
-                'start': start_pos,
-                'end': end_pos,
             }
-            commit_ids = self._get_all_commit_ids(filters=revfilters)
-
-            # pure python stuff, it's slow due to walker walking whole repo
-            # def get_revs(walker):
-            #     for walker_entry in walker:
-            #         yield walker_entry.commit.id
-            # revfilters = {}
-            # commit_ids = list(reversed(list(get_revs(self._repo.get_walker(**revfilters)))))
+            commit_ids = self._get_filtered_commit_ids(revfilters)
         else:
             commit_ids = self.commit_ids
 
         if start_pos or end_pos:
-            commit_ids = commit_ids[start_pos: end_pos]
+            commit_ids = LazyCommitIds.window(commit_ids, start_pos, end_pos)
 
-        return CollectionGenerator(self, commit_ids, pre_load=pre_load,
-                                   translate_tag=translate_tags)
+        return GitCollectionGenerator(self, commit_ids, pre_load=pre_load,
+                                      translate_tag=translate_tags)
 
     def get_diff(
             self, commit1, commit2, path='', ignore_whitespace=False,
@@ -589,7 +676,8 @@ class GitRepository(BaseRepository):
         commit = commit.parents[0]
         self._remote.set_refs('refs/heads/%s' % branch_name, commit.raw_id)
 
-        self.commit_ids = self._get_all_commit_ids()
+        self._refs = self._get_refs()
+        self.commit_ids = self._load_commit_ids()
         self._rebuild_cache(self.commit_ids)
 
     def get_common_ancestor(self, commit_id1, commit_id2, repo2):
@@ -1010,3 +1098,40 @@ class GitRepository(BaseRepository):
         return MergeResponse(
             merge_possible, merge_succeeded, merge_ref, merge_failure_reason,
             metadata=metadata)
+
+
+class GitCollectionGenerator(CollectionGenerator):
+
+    def _commit_batch_factory(self, commit_ids):
+        """
+        Creates commits using batched remote calls, one for translating the
+        commit ids and one for the pre loaded properties.
+        """
+        repo = self.repo
+        commit_ids = [repo._get_commit_id(commit_id) for commit_id in commit_ids]
+
+        objects = [None] * len(commit_ids)
+        if self.translate_tag:
+            # Need to call remote to translate id for tagging scenario
+            with repo._remote.batch() as batch:
+                objects = [batch.get_object(commit_id) for commit_id in commit_ids]
+
+        commits = []
+        for commit_id, obj in zip(commit_ids, objects):
+            try:
+                if obj is not None:
+                    commit_id = obj.result()["commit_id"]
+                idx = repo._commit_ids[commit_id]
+            except KeyError:
+                raise RepositoryError("Cannot get object with id %s" % commit_id)
+            commits.append(GitCommit(repo, commit_id, idx))
+
+        pre_load = GitCommit._get_bulk_pre_load(self.pre_load)
+        if pre_load:
+            with repo._remote.batch() as batch:
+                results = [batch.bulk_request(commit.raw_id, pre_load)
+                           for commit in commits]
+            for commit, result in zip(commits, results):
+                commit._update_bulk_properties(result.result())
+
+        return commits
@@ -63,15 +63,20 @@ class MercurialCommit(base.BaseCommit):
         # caches
         self.nodes = {}
 
+    @classmethod
+    def _get_bulk_pre_load(cls, pre_load):
+        return [entry for entry in pre_load or []
+                if entry not in cls._filter_pre_load]
+
     def _set_bulk_properties(self, pre_load):
-        if not pre_load:
-            return
-        pre_load = [entry for entry in pre_load
-                    if entry not in self._filter_pre_load]
+        pre_load = self._get_bulk_pre_load(pre_load)
         if not pre_load:
             return
 
         result = self._remote.bulk_request(self.idx, pre_load)
+        self._update_bulk_properties(result)
+
+    def _update_bulk_properties(self, result):
         for attr, value in result.items():
             if attr in ["author", "branch", "message"]:
                 value = safe_unicode(value)
@@ -245,6 +250,10 @@ class MercurialCommit(base.BaseCommit):
         path = self._get_filectx(path)
         return self._remote.fctx_data(self.idx, path)
 
+    def get_file_content_streamed(self, path):
+        path = self._get_filectx(path)
+        return self._remote.stream_call('fctx_data', self.idx, path)
+
     def get_file_size(self, path):
         """
         Returns size of the file at given ``path``.
@@ -252,6 +261,18 @@ class MercurialCommit(base.BaseCommit):
         path = self._get_filectx(path)
         return self._remote.fctx_size(self.idx, path)
 
+    def get_file_contents(self, paths):
+        paths = [self._get_filectx(path) for path in paths]
+        with self._remote.batch() as batch:
+            results = [batch.fctx_data(self.idx, path) for path in paths]
+        return [result.result() for result in results]
+
+    def get_file_sizes(self, paths):
+        paths = [self._get_filectx(path) for path in paths]
+        with self._remote.batch() as batch:
+            results = [batch.fctx_size(self.idx, path) for path in paths]
+        return [result.result() for result in results]
+
     def get_path_history(self, path, limit=None, pre_load=None):
         """
         Returns history of file as reversed list of `MercurialCommit` objects
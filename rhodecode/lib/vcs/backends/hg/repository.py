@@ -36,6 +36,8 @@ from rhodecode.lib.vcs import connection, exceptions
 from rhodecode.lib.vcs.backends.base import (
     BaseRepository, CollectionGenerator, Config, MergeResponse,
     MergeFailureReason, Reference, BasePathPermissionChecker)
+from rhodecode.lib.vcs.backends.commit_ids import (
+    CommitIdList, LazyCommitIds, compact_commit_ids)
 from rhodecode.lib.vcs.backends.hg.commit import MercurialCommit
 from rhodecode.lib.vcs.backends.hg.diff import MercurialDiff
 from rhodecode.lib.vcs.backends.hg.inmemory import MercurialInMemoryCommit
@@ -55,6 +57,7 @@ class MercurialRepository(BaseRepository):
     Mercurial repository backend
     """
     DEFAULT_BRANCH_NAME = 'default'
+    diff_class = MercurialDiff
 
     def __init__(self, repo_path, config=None, create=False, src_url=None,
                  do_workspace_checkout=False, with_wire=None, bare=False):
@@ -95,11 +98,14 @@ class MercurialRepository(BaseRepository):
         Returns list of commit ids, in ascending order.  Being lazy
         attribute allows external tools to inject shas from cache.
         """
-        commit_ids = self._get_all_commit_ids()
+        commit_ids = compact_commit_ids(self._get_all_commit_ids())
         self._rebuild_cache(commit_ids)
         return commit_ids
 
     def _rebuild_cache(self, commit_ids):
+        if isinstance(commit_ids, CommitIdList):
+            self._commit_ids = commit_ids.positions
+            return
         self._commit_ids = dict((commit_id, index)
                                 for index, commit_id in enumerate(commit_ids))
 
@@ -267,11 +273,28 @@ class MercurialRepository(BaseRepository):
             context=context)
         return MercurialDiff(diff)
 
+    def get_diff_streamed(
+            self, commit1, commit2, path='', ignore_whitespace=False,
+            context=3, path1=None):
+        self._validate_diff_commits(commit1, commit2)
+        if path1 is not None and path1 != path:
+            raise ValueError("Diff of two different paths not supported.")
+
+        if path:
+            file_filter = [self.path, path]
+        else:
+            file_filter = None
+
+        return self._remote.stream_call(
+            'diff', commit1.raw_id, commit2.raw_id, file_filter=file_filter,
+            opt_git=True, opt_ignorews=ignore_whitespace,
+            context=context)
+
     def strip(self, commit_id, branch=None):
         self._remote.strip(commit_id, update=False, backup="none")
 
         self._remote.invalidate_vcs_cache()
-        self.commit_ids = self._get_all_commit_ids()
+        self.commit_ids = compact_commit_ids(self._get_all_commit_ids())
         self._rebuild_cache(self.commit_ids)
 
     def verify(self):
@@ -524,16 +547,18 @@ class MercurialRepository(BaseRepository):
             commit_filter.append('not hidden()')
 
         # TODO: johbo: Figure out a simpler way for this solution
-        collection_generator = CollectionGenerator
+        collection_generator = MercurialCollectionGenerator
         if commit_filter:
             commit_filter = ' and '.join(map(safe_str, commit_filter))
+            # the vcsserver can't count the revisions of a revset without
+            # listing them, so pages are sliced from the listed revisions
             revisions = self._remote.rev_range([commit_filter])
             collection_generator = MercurialIndexBasedCollectionGenerator
         else:
             revisions = self.commit_ids
 
         if start_pos or end_pos:
-            revisions = revisions[start_pos:end_pos]
+            revisions = LazyCommitIds.window(revisions, start_pos, end_pos)
 
         return collection_generator(self, revisions, pre_load=pre_load)
 
@@ -925,8 +950,33 @@ class MercurialRepository(BaseRepository):
             return None
 
 
-class MercurialIndexBasedCollectionGenerator(CollectionGenerator):
+class MercurialCollectionGenerator(CollectionGenerator):
 
-    def _commit_factory(self, commit_id):
-        return self.repo.get_commit(
-            commit_idx=commit_id, pre_load=self.pre_load)
+    def _commit_batch_factory(self, commit_ids):
+        """
+        Creates commits and loads their pre loaded properties with batched
+        remote calls.
+        """
+        commits = [self.repo.get_commit(commit_id=commit_id)
+                   for commit_id in commit_ids]
+        self._bulk_pre_load(commits)
+        return commits
+
+    def _bulk_pre_load(self, commits):
+        pre_load = MercurialCommit._get_bulk_pre_load(self.pre_load)
+        if not pre_load:
+            return
+        with self.repo._remote.batch() as batch:
+            results = [batch.bulk_request(commit.idx, pre_load)
+                       for commit in commits]
+        for commit, result in zip(commits, results):
+            commit._update_bulk_properties(result.result())
+
+
+class MercurialIndexBasedCollectionGenerator(MercurialCollectionGenerator):
+
+    def _commit_batch_factory(self, commit_ids):
+        commits = [self.repo.get_commit(commit_idx=commit_idx)
+                   for commit_idx in commit_ids]
+        self._bulk_pre_load(commits)
+        return commits
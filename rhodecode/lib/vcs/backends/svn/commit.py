@@ -46,6 +46,9 @@ class SubversionCommit(base.BaseCommit):
 
     """
 
+    # attributes which are read from the revision properties
+    _revision_property_attrs = ('author', 'date', 'message')
+
     def __init__(self, repository, commit_id):
         self.repository = repository
         self.idx = self.repository._get_commit_idx(commit_id)
@@ -117,10 +120,29 @@ class SubversionCommit(base.BaseCommit):
         path = self._fix_path(path)
         return self._remote.get_file_content(safe_str(path), self._svn_rev)
 
+    def get_file_content_streamed(self, path):
+        path = self._fix_path(path)
+        return self._remote.stream_call(
+            'get_file_content', safe_str(path), self._svn_rev)
+
     def get_file_size(self, path):
         path = self._fix_path(path)
         return self._remote.get_file_size(safe_str(path), self._svn_rev)
 
+    def get_file_contents(self, paths):
+        paths = [safe_str(self._fix_path(path)) for path in paths]
+        with self._remote.batch() as batch:
+            results = [
+                batch.get_file_content(path, self._svn_rev) for path in paths]
+        return [result.result() for result in results]
+
+    def get_file_sizes(self, paths):
+        paths = [safe_str(self._fix_path(path)) for path in paths]
+        with self._remote.batch() as batch:
+            results = [
+                batch.get_file_size(path, self._svn_rev) for path in paths]
+        return [result.result() for result in results]
+
     def get_path_history(self, path, limit=None, pre_load=None):
         path = safe_str(self._fix_path(path))
         history = self._remote.node_history(path, self._svn_rev, limit)
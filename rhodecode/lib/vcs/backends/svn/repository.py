@@ -64,6 +64,7 @@ class SubversionRepository(base.BaseRepository):
 
     # Note: Subversion does not really have a default branch name.
     DEFAULT_BRANCH_NAME = None
+    diff_class = SubversionDiff
 
     contact = base.BaseRepository.DEFAULT_CONTACT
     description = base.BaseRepository.DEFAULT_DESCRIPTION
@@ -309,7 +310,8 @@ class SubversionRepository(base.BaseRepository):
 
         if start_pos or end_pos:
             commit_ids = commit_ids[start_pos:end_pos]
-        return base.CollectionGenerator(self, commit_ids, pre_load=pre_load)
+        return SubversionCollectionGenerator(
+            self, commit_ids, pre_load=pre_load)
 
     def _sanitize_commit_id(self, commit_id):
         if commit_id and commit_id.isdigit():
@@ -336,6 +338,36 @@ class SubversionRepository(base.BaseRepository):
             ignore_whitespace=ignore_whitespace, context=context)
         return SubversionDiff(diff)
 
+    def get_diff_streamed(
+            self, commit1, commit2, path=None, ignore_whitespace=False,
+            context=3, path1=None):
+        self._validate_diff_commits(commit1, commit2)
+        svn_rev1 = long(commit1.raw_id)
+        svn_rev2 = long(commit2.raw_id)
+        return self._remote.stream_call(
+            'diff', svn_rev1, svn_rev2, path1=path1, path2=path,
+            ignore_whitespace=ignore_whitespace, context=context)
+
+
+class SubversionCollectionGenerator(base.CollectionGenerator):
+
+    def _commit_batch_factory(self, commit_ids):
+        """
+        Creates commits and loads their revision properties with batched
+        remote calls.
+        """
+        commits = [self._commit_factory(commit_id) for commit_id in commit_ids]
+
+        pre_load = set(self.pre_load or []).intersection(
+            SubversionCommit._revision_property_attrs)
+        if pre_load:
+            with self.repo._remote.batch() as batch:
+                results = [batch.revision_properties(commit._svn_rev)
+                           for commit in commits]
+            for commit, result in zip(commits, results):
+                commit.__dict__['_properties'] = result.result()
+        return commits
+
 
 def _sanitize_url(url):
     if '://' not in url:
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Statistics of the calls made to the VCSServer.
+
+Every call is recorded into the per process :data:`call_stats_registry`,
+which keeps latency histograms per backend and method. While a request is
+being handled, calls are additionally collected into a
+:class:`RequestCallStats` returned by :func:`start_request`.
+"""
+
+import collections
+import threading
+import time
+import urlparse
+
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# with gevent workers threading.local is patched to be greenlet local
+_local = threading.local()
+
+
+def get_backend(url):
+    """
+    Returns the backend of a VCSServer url, which is the path of its
+    endpoint, e.g. `git` or `_service`.
+    """
+    return urlparse.urlparse(url).path.strip('/') or 'unknown'
+
+
+class CallHistogram(object):
+    """
+    Aggregated statistics of the calls to a single remote method.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, duration, request_size, response_size):
+        self.count += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.request_bytes += request_size
+        self.response_bytes += response_size
+
+        for idx, upper_bound in enumerate(LATENCY_BUCKETS):
+            if duration <= upper_bound:
+                break
+        else:
+            idx = len(LATENCY_BUCKETS)
+        self.buckets[idx] += 1
+
+    def get_data(self):
+        labels = ['<={}s'.format(b) for b in LATENCY_BUCKETS]
+        labels.append('>{}s'.format(LATENCY_BUCKETS[-1]))
+        return {
+            'count': self.count,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.count if self.count else 0.0,
+            'max_time': self.max_time,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'histogram': collections.OrderedDict(zip(labels, self.buckets)),
+        }
+
+
+class CallStatsRegistry(object):
+    """
+    Thread safe collection of :class:`CallHistogram` per backend and method.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def add(self, backend, method, duration, request_size, response_size):
+        key = (backend, method)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = CallHistogram()
+            histogram.add(duration, request_size, response_size)
+
+    def get_stats(self):
+        """
+        Returns the statistics of all methods, slowest in total first.
+        """
+        with self._lock:
+            stats = []
+            for (backend, method), histogram in self._histograms.items():
+                data = histogram.get_data()
+                data.update({'backend': backend, 'method': method})
+                stats.append(data)
+        return sorted(stats, key=lambda d: d['total_time'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+call_stats_registry = CallStatsRegistry()
+
+
+class RequestCallStats(object):
+    """
+    Calls made while handling a single request.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def add(self, backend, method, duration, request_size, response_size):
+        self.calls.append(
+            (backend, method, duration, request_size, response_size))
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    @property
+    def total_time(self):
+        return sum(call[2] for call in self.calls)
+
+    def slowest_methods(self, limit=5):
+        """
+        Returns `(backend, method, count, total_time)` of the `limit` methods
+        which took the most time in total. A high count usually points to
+        calls made in a loop.
+        """
+        methods = collections.defaultdict(lambda: [0, 0.0])
+        for backend, method, duration, __, __ in self.calls:
+            entry = methods[(backend, method)]
+            entry[0] += 1
+            entry[1] += duration
+
+        slowest = sorted(
+            methods.items(), key=lambda item: item[1][1], reverse=True)
+        return [(backend, method, count, total)
+                for (backend, method), (count, total) in slowest[:limit]]
+
+    def summary(self, limit=5):
+        return ', '.join(
+            '{}.{} x{} {:.3f}s'.format(backend, method, count, total)
+            for backend, method, count, total in self.slowest_methods(limit))
+
+
+def start_request():
+    """
+    Starts collecting the calls of the current request.
+    """
+    _local.request_stats = RequestCallStats()
+    return _local.request_stats
+
+
+def end_request():
+    """
+    Stops collecting the calls of the current request and returns them.
+    """
+    request_stats = getattr(_local, 'request_stats', None)
+    _local.request_stats = None
+    return request_stats
+
+
+def record(backend, method, duration, request_size, response_size):
+    call_stats_registry.add(
+        backend, method, duration, request_size, response_size)
+    request_stats = getattr(_local, 'request_stats', None)
+    if request_stats is not None:
+        request_stats.add(
+            backend, method, duration, request_size, response_size)
+
+
+class CallTimer(object):
+    """
+    Measures a single call and records it once finished, can be used as a
+    context manager.
+    """
+
+    def __init__(self, url, method, request_size):
+        self.backend = get_backend(url)
+        self.method = method or 'unknown'
+        self.request_size = request_size
+        self.response_size = 0
+        self._start = time.time()
+        self._finished = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        record(self.backend, self.method, time.time() - self._start,
+               self.request_size, self.response_size)
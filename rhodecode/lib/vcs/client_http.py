@@ -22,8 +22,9 @@
 Client for the VCSServer implemented based on HTTP.
 """
 
-import copy
+import hashlib
 import logging
+import re
 import threading
 import urllib2
 import urlparse
@@ -33,15 +34,24 @@ import traceback
 import pycurl
 import msgpack
 import requests
+from dogpile.cache.api import NO_VALUE
 from requests.packages.urllib3.util.retry import Retry
 
 import rhodecode
 from rhodecode.lib.system_info import get_cert_path
-from rhodecode.lib.vcs import exceptions, CurlSession
+from rhodecode.lib.vcs import compression, exceptions, CurlSession
+from rhodecode.lib.vcs.call_stats import CallTimer
+from rhodecode.lib.vcs.server_pool import get_pool
+from rhodecode.lib.vcs.conf import settings
 
 
 log = logging.getLogger(__name__)
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# curl errors which mean that the call never reached the VCSServer
+CURL_CONNECT_ERRORS = (pycurl.E_COULDNT_RESOLVE_HOST, pycurl.E_COULDNT_CONNECT)
+
 
 # TODO: mikhail: Keep it in sync with vcsserver's
 # HTTPApplication.ALLOWED_EXCEPTIONS
@@ -50,20 +60,34 @@ EXCEPTIONS_MAP = {
     'URLError': urllib2.URLError,
 }
 
+# Methods which results can't change for the same object id given as the
+# first argument, e.g. the content of a git blob or the tree of a commit.
+IMMUTABLE_METHODS = {
+    'git': frozenset([
+        'revision', 'bulk_request', 'commit_attribute', 'get_object_attrs',
+        'tree_items', 'blob_as_pretty_string', 'blob_raw_length',
+        'is_large_file']),
+}
+
+SHA_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
 
 class RepoMaker(object):
 
     def __init__(self, server_and_port, backend_endpoint, backend_type, session_factory):
-        self.url = urlparse.urljoin(
-            'http://%s' % server_and_port, backend_endpoint)
+        self._pool = get_pool(server_and_port)
+        self._endpoint = backend_endpoint
+        self.url = self._pool.get_url(self._pool.get_node(), backend_endpoint)
         self._session_factory = session_factory
         self.backend_type = backend_type
+        self._call_cache = RemoteCallCache(
+            IMMUTABLE_METHODS.get(backend_type, ()))
 
     def __call__(self, path, config, with_wire=None):
         log.debug('RepoMaker call on %s', path)
         return RemoteRepo(
-            path, config, self.url, self._session_factory(),
-            with_wire=with_wire)
+            path, config, self._pool, self._endpoint, self._session_factory,
+            with_wire=with_wire, call_cache=self._call_cache)
 
     def __getattr__(self, name):
         def f(*args, **kwargs):
@@ -78,14 +102,16 @@ class RepoMaker(object):
             'backend': self.backend_type,
             'params': {'args': args, 'kwargs': kwargs}
         }
-        return _remote_call(
-            self.url, payload, EXCEPTIONS_MAP, self._session_factory())
+        return _pool_call(
+            self._pool, None, self._endpoint, msgpack.packb(payload),
+            self._session_factory, method=name)
 
 
 class ServiceConnection(object):
     def __init__(self, server_and_port, backend_endpoint, session_factory):
-        self.url = urlparse.urljoin(
-            'http://%s' % server_and_port, backend_endpoint)
+        self._pool = get_pool(server_and_port)
+        self._endpoint = backend_endpoint
+        self.url = self._pool.get_url(self._pool.get_node(), backend_endpoint)
         self._session_factory = session_factory
 
     def __getattr__(self, name):
@@ -101,15 +127,21 @@ class ServiceConnection(object):
             'method': name,
             'params': {'args': args, 'kwargs': kwargs}
         }
-        return _remote_call(
-            self.url, payload, EXCEPTIONS_MAP, self._session_factory())
+        return _pool_call(
+            self._pool, None, self._endpoint, msgpack.packb(payload),
+            self._session_factory, method=name)
 
 
 class RemoteRepo(object):
 
-    def __init__(self, path, config, url, session, with_wire=None):
-        self.url = url
-        self._session = session
+    def __init__(self, path, config, pool, endpoint, session_factory,
+                 with_wire=None, call_cache=None):
+        self._pool = pool
+        self._call_cache = call_cache or RemoteCallCache(())
+        self._endpoint = endpoint
+        # url of the VCSServer preferred for this repository
+        self.url = pool.get_url(pool.get_node(path), endpoint)
+        self._session_factory = session_factory
         self._wire = {
             "path": path,
             "config": config,
@@ -118,6 +150,11 @@ class RemoteRepo(object):
         if with_wire:
             self._wire.update(with_wire)
 
+        # serialized and msgpack encoded wire, re-created only on changes
+        self._wire_key = None
+        self._serialized_wire = None
+        self._packed_wire = None
+
         # johbo: Trading complexity for performance. Avoiding the call to
         # log.debug brings a few percent gain even if is is not active.
         if log.isEnabledFor(logging.DEBUG):
@@ -130,20 +167,53 @@ class RemoteRepo(object):
             return self._call(name, *args, **kwargs)
         return f
 
+    def _get_wire(self):
+        """
+        Returns the wire with a serialized config. The serialization is
+        only re-done if the config object, its version, or any other wire
+        value changed since the last call.
+        """
+        config = self._wire["config"]
+        wire_key = (config, config.version, [
+            (key, val) for key, val in self._wire.items() if key != "config"])
+
+        if wire_key != self._wire_key:
+            # TODO: oliver: This is currently necessary pre-call since the
+            # config object is being changed for hooking scenarios
+            wire = dict(self._wire)
+            wire["config"] = config.serialize()
+
+            wire["config"].append(('vcs', 'ssl_dir', self.cert_dir))
+            self._serialized_wire = wire
+            self._packed_wire = msgpack.packb(wire)
+            self._wire_key = wire_key
+        return self._serialized_wire
+
+    def _get_packed_wire(self):
+        self._get_wire()
+        return self._packed_wire
+
     @exceptions.map_vcs_exceptions
     def _call(self, name, *args, **kwargs):
-        # TODO: oliver: This is currently necessary pre-call since the
-        # config object is being changed for hooking scenarios
-        wire = copy.deepcopy(self._wire)
-        wire["config"] = wire["config"].serialize()
-
-        wire["config"].append(('vcs', 'ssl_dir', self.cert_dir))
-        payload = {
-            'id': str(uuid.uuid4()),
-            'method': name,
-            'params': {'wire': wire, 'args': args, 'kwargs': kwargs}
-        }
-        return _remote_call(self.url, payload, EXCEPTIONS_MAP, self._session)
+        cache_key = self._call_cache.get_key(
+            self._wire['path'], name, args, kwargs)
+        if cache_key:
+            result = self._call_cache.get(cache_key)
+            if result is not NO_VALUE:
+                return result
+
+        data = _pack_payload(
+            name, self._get_packed_wire(), args=args, kwargs=kwargs)
+        result = self._call_packed(data, name)
+
+        if cache_key:
+            self._call_cache.set(cache_key, result)
+        return result
+
+    def _call_packed(self, data, method):
+        return _pool_call(
+            self._pool, self._wire['path'], self._endpoint, data,
+            self._session_factory, method=method)
 
     def _call_with_logging(self, name, *args, **kwargs):
         context_uid = self._wire.get('context')
@@ -154,6 +224,37 @@ class RemoteRepo(object):
     def __getitem__(self, key):
         return self.revision(key)
 
+    @exceptions.map_vcs_exceptions
+    def stream_call(self, name, *args, **kwargs):
+        """
+        Calls the remote method `name` and returns an iterator over chunks
+        of its result. The response is decoded while it is read, so a
+        VCSServer sending chunked results keeps memory usage bounded.
+        """
+        data = _pack_payload(
+            name, self._get_packed_wire(), args=args, kwargs=kwargs,
+            chunked=True)
+
+        def call(server):
+            return _remote_call_streamed(
+                self._pool.get_url(server, self._endpoint), data,
+                EXCEPTIONS_MAP, stream_session_factory(), method=name)
+        return self._pool.call(self._wire['path'], call)
+
+    def batch(self):
+        """
+        Returns a :class:`RemoteBatch` which collects calls made on it and
+        sends them to the VCSServer in a single round trip.
+
+        usage::
+
+            with repo._remote.batch() as batch:
+                branches = batch.branches(normal=True, closed=False)
+                tags = batch.tags()
+            branches = branches.result()
+        """
+        return RemoteBatch(self)
+
     def _create_vcs_cache_context(self):
         """
         Creates a unique string which is passed to the VCSServer on every
@@ -170,6 +271,198 @@ class RemoteRepo(object):
         self._wire['context'] = self._create_vcs_cache_context()
 
 
+class RemoteFuture(object):
+    """
+    Placeholder for the result of a call queued in a :class:`RemoteBatch`.
+    """
+
+    def __init__(self, batch, name):
+        self._batch = batch
+        self.name = name
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def __repr__(self):
+        return '<RemoteFuture:%s done:%s>' % (self.name, self._done)
+
+    def set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done = True
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            # asking for a result flushes all calls queued so far
+            self._batch.execute()
+        if self._exception is not None:
+            _raise_remote_exception(self._exception)
+        return self._result
+
+
+class RemoteBatch(object):
+    """
+    Collects calls to a :class:`RemoteRepo`, every queued call returns a
+    :class:`RemoteFuture`. The calls are executed when the batch is left as
+    a context manager, when :meth:`execute` is called, or when the result of
+    a pending future is requested.
+
+    With `vcs.server.batch_calls` enabled all queued calls are sent as one
+    multi-call payload, otherwise they are executed one after another.
+    """
+
+    MULTI_CALL_METHOD = 'batch_call'
+
+    def __init__(self, remote):
+        self._remote = remote
+        self._calls = []
+
+    def __getattr__(self, name):
+        def f(*args, **kwargs):
+            return self._queue(name, args, kwargs)
+        return f
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    def _queue(self, name, args, kwargs):
+        future = RemoteFuture(self, name)
+        self._calls.append((future, name, args, kwargs))
+        return future
+
+    def execute(self):
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+
+        if settings.VCSSERVER_BATCH_CALLS and len(calls) > 1:
+            calls = self._resolve_cached(calls)
+            if len(calls) > 1:
+                self._execute_multi_call(calls)
+                return
+        self._execute_sequential(calls)
+
+    def _resolve_cached(self, calls):
+        """
+        Sets the results of calls found in the call cache and returns the
+        calls which have to be sent.
+        """
+        call_cache = self._remote._call_cache
+        path = self._remote._wire['path']
+        pending = []
+        for call in calls:
+            future, name, args, kwargs = call
+            cache_key = call_cache.get_key(path, name, args, kwargs)
+            result = call_cache.get(cache_key) if cache_key else NO_VALUE
+            if result is NO_VALUE:
+                pending.append(call)
+            else:
+                future.set_result(result)
+        return pending
+
+    def _execute_sequential(self, calls):
+        for future, name, args, kwargs in calls:
+            try:
+                future.set_result(self._remote._call(name, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _execute_multi_call(self, calls):
+        log.debug('Calling %s@%s with %s batched calls',
+                  self._remote.url, self.MULTI_CALL_METHOD, len(calls))
+        data = _pack_payload(
+            self.MULTI_CALL_METHOD, self._remote._get_packed_wire(),
+            calls=[{'method': name, 'args': args, 'kwargs': kwargs}
+                   for __, name, args, kwargs in calls])
+        try:
+            results = self._remote._call_packed(data, self.MULTI_CALL_METHOD)
+            if len(results) != len(calls):
+                raise exceptions.HttpVCSCommunicationError(
+                    'Expected {} results of batched call, got {}'.format(
+                        len(calls), len(results)))
+        except Exception as e:
+            for future, __, __, __ in calls:
+                future.set_exception(e)
+            raise
+
+        call_cache = self._remote._call_cache
+        path = self._remote._wire['path']
+        for (future, name, args, kwargs), entry in zip(calls, results):
+            error = entry.get('error')
+            if error:
+                future.set_exception(
+                    _build_remote_exception(error, EXCEPTIONS_MAP))
+                continue
+
+            result = entry.get('result')
+            cache_key = call_cache.get_key(path, name, args, kwargs)
+            if cache_key:
+                call_cache.set(cache_key, result)
+            future.set_result(result)
+
+
+class RemoteCallCache(object):
+    """
+    Caches the results of immutable calls in the `cache_vcs_calls` region.
+
+    A call is cached if its method is one of `methods` and its first
+    argument is a full object id. Results are stored msgpack encoded, so
+    every hit returns a fresh copy, and results bigger than `max_item_size`
+    are not cached at all to bound the memory used by the region.
+    """
+
+    region_name = 'cache_vcs_calls'
+    max_item_size = 256 * 1024
+
+    def __init__(self, methods):
+        self.methods = methods
+
+    @property
+    def region(self):
+        # the regions are configured after the VCSServer connection is set up
+        from rhodecode.lib.rc_cache import region_meta
+        return region_meta.dogpile_cache_regions.get(self.region_name)
+
+    def get_key(self, path, name, args, kwargs):
+        if name not in self.methods or not args:
+            return None
+        object_id = args[0]
+        if not (isinstance(object_id, str) and SHA_PATTERN.match(object_id)):
+            return None
+        call_hash = hashlib.sha1(msgpack.packb([path, args, kwargs]))
+        return 'vcs_call:{}:{}'.format(name, call_hash.hexdigest())
+
+    def get(self, key):
+        region = self.region
+        if region is None:
+            return NO_VALUE
+        value = region.get(key)
+        if value is NO_VALUE:
+            return NO_VALUE
+        return msgpack.unpackb(value)
+
+    def set(self, key, result):
+        region = self.region
+        if region is None:
+            return
+        value = msgpack.packb(result)
+        if len(value) <= self.max_item_size:
+            region.set(key, value)
+
+
 class RemoteObject(object):
 
     def __init__(self, url, session):
@@ -200,17 +493,86 @@ class RemoteObject(object):
         return RemoteObject._call(self, name, *args, **kwargs)
 
 
+def _pack_payload(method, packed_wire, **params):
+    """
+    Packs the payload of a call on a remote repository. The already msgpack
+    encoded wire is inserted as is, so only the method and its parameters
+    have to be encoded on every call.
+    """
+    packer = msgpack.Packer()
+    data = [
+        packer.pack_map_header(3),
+        packer.pack('id'), packer.pack(str(uuid.uuid4())),
+        packer.pack('method'), packer.pack(method),
+        packer.pack('params'), packer.pack_map_header(len(params) + 1),
+        packer.pack('wire'), packed_wire,
+    ]
+    for key, value in params.items():
+        data.append(packer.pack(key))
+        data.append(packer.pack(value))
+    return ''.join(data)
+
+
+def _pool_call(pool, key, endpoint, data, session_factory, method=None):
+    """
+    Sends the packed call to the VCSServer responsible for `key`, falling
+    over to the next VCSServer of the pool if it can't be reached.
+    """
+    def call(server):
+        return _remote_call_packed(
+            pool.get_url(server, endpoint), data, EXCEPTIONS_MAP,
+            session_factory(server), method=method)
+    return pool.call(key, call)
+
+
 def _remote_call(url, payload, exceptions_map, session):
+    return _remote_call_packed(
+        url, msgpack.packb(payload), exceptions_map, session,
+        method=payload.get('method'))
+
+
+def _remote_call_packed(url, data, exceptions_map, session, method=None):
+    codec = compression.get_codec(settings.VCSSERVER_COMPRESSION)
+    headers = None
+    if codec:
+        data, headers = compression.encode_request(
+            codec, data, settings.VCSSERVER_COMPRESSION_MIN_SIZE)
+
+    with CallTimer(url, method, len(data)) as timer:
+        response = _post_packed(url, data, session, headers)
+        content = response.content
+        timer.response_size = len(content)
+
+    if codec:
+        content = compression.decode_response(content, response.headers)
+    try:
+        response = msgpack.unpackb(content)
+    except Exception:
+        log.exception('Failed to decode response %r', content)
+        raise
+
+    error = response.get('error')
+    if error:
+        raise _build_remote_exception(error, exceptions_map)
+    return response.get('result')
+
+
+def _post_packed(url, data, session, headers=None):
     try:
-        response = session.post(url, data=msgpack.packb(payload))
+        if headers:
+            response = session.post(url, data=data, headers=headers)
+        else:
+            response = session.post(url, data=data)
     except pycurl.error as e:
         msg = '{}. \npycurl traceback: {}'.format(e, traceback.format_exc())
+        if e.args and e.args[0] in CURL_CONNECT_ERRORS:
+            raise exceptions.HttpVCSConnectionError(msg)
         raise exceptions.HttpVCSCommunicationError(msg)
     except Exception as e:
         message = getattr(e, 'message', '')
         if 'Failed to connect' in message:
             # gevent doesn't return proper pycurl errors
-            raise exceptions.HttpVCSCommunicationError(e)
+            raise exceptions.HttpVCSConnectionError(e)
         else:
             raise
 
@@ -218,32 +580,92 @@ def _remote_call(url, payload, exceptions_map, session):
         log.error('Call to %s returned non 200 HTTP code: %s',
                   url, response.status_code)
         raise exceptions.HttpVCSCommunicationError(repr(response.content))
+    return response
 
+
+def _remote_call_streamed(url, data, exceptions_map, session,
+                          chunk_size=STREAM_CHUNK_SIZE, method=None):
+    """
+    Sends a call and decodes the response incrementally. A VCSServer which
+    supports chunked results responds with a header ``{'chunked': True}``
+    followed by the raw chunks of the result, other servers respond with a
+    regular result which is returned as a single chunk.
+    """
+    # the call is recorded once the whole response was read
+    timer = CallTimer(url, method, len(data))
     try:
-        response = msgpack.unpackb(response.content)
-    except Exception:
-        log.exception('Failed to decode response %r', response.content)
-        raise
+        response = session.post(url, data=data, stream=True)
+    except requests.ConnectionError as e:
+        timer.finish()
+        # streamed calls only read data, so they are safe to send again
+        raise exceptions.HttpVCSConnectionError(e)
 
-    error = response.get('error')
+    if response.status_code >= 400:
+        timer.finish()
+        log.error('Call to %s returned non 200 HTTP code: %s',
+                  url, response.status_code)
+        raise exceptions.HttpVCSCommunicationError(repr(response.content))
+
+    unpacker = msgpack.Unpacker()
+    objects = _iter_unpacked(response, unpacker, chunk_size, timer)
+    try:
+        header = next(objects)
+    except StopIteration:
+        raise exceptions.HttpVCSCommunicationError(
+            'Empty response from call to {}'.format(url))
+
+    error = header.get('error')
     if error:
-        type_ = error.get('type', 'Exception')
-        exc = exceptions_map.get(type_, Exception)
-        exc = exc(error.get('message'))
-        try:
-            exc._vcs_kind = error['_vcs_kind']
-        except KeyError:
-            pass
+        raise _build_remote_exception(error, exceptions_map)
 
-        try:
-            exc._vcs_server_traceback = error['traceback']
-            exc._vcs_server_org_exc_name = error['org_exc']
-            exc._vcs_server_org_exc_tb = error['org_exc_tb']
-        except KeyError:
-            pass
+    if header.get('chunked'):
+        return _iter_result_chunks(objects, exceptions_map)
+    return iter([header.get('result')])
 
-        raise exc
-    return response.get('result')
+
+def _iter_unpacked(response, unpacker, chunk_size, timer):
+    try:
+        for data in response.iter_content(chunk_size=chunk_size):
+            timer.response_size += len(data)
+            unpacker.feed(data)
+            for obj in unpacker:
+                yield obj
+    finally:
+        timer.finish()
+
+
+def _iter_result_chunks(objects, exceptions_map):
+    for chunk in objects:
+        if isinstance(chunk, dict):
+            # the server failed while sending the result
+            error = chunk.get('error') or {}
+            _raise_remote_exception(
+                _build_remote_exception(error, exceptions_map))
+        yield chunk
+
+
+def _build_remote_exception(error, exceptions_map):
+    type_ = error.get('type', 'Exception')
+    exc = exceptions_map.get(type_, Exception)
+    exc = exc(error.get('message'))
+    try:
+        exc._vcs_kind = error['_vcs_kind']
+    except KeyError:
+        pass
+
+    try:
+        exc._vcs_server_traceback = error['traceback']
+        exc._vcs_server_org_exc_name = error['org_exc']
+        exc._vcs_server_org_exc_tb = error['org_exc_tb']
+    except KeyError:
+        pass
+
+    return exc
+
+
+@exceptions.map_vcs_exceptions
+def _raise_remote_exception(exc):
+    raise exc
 
 
 class VcsHttpProxy(object):
@@ -297,15 +719,37 @@ class VcsHttpProxy(object):
         return iterator, status, headers
 
 
-class ThreadlocalSessionFactory(object):
+class ThreadlocalStreamSessionFactory(object):
     """
-    Creates one CurlSession per thread on demand.
+    Creates one `requests.Session` per thread on demand, used for calls
+    which stream their results.
     """
 
     def __init__(self):
         self._thread_local = threading.local()
 
     def __call__(self):
-        if not hasattr(self._thread_local, 'curl_session'):
-            self._thread_local.curl_session = CurlSession()
-        return self._thread_local.curl_session
+        if not hasattr(self._thread_local, 'stream_session'):
+            self._thread_local.stream_session = requests.Session()
+        return self._thread_local.stream_session
+
+
+stream_session_factory = ThreadlocalStreamSessionFactory()
+
+
+class ThreadlocalSessionFactory(object):
+    """
+    Creates one CurlSession per thread and VCSServer on demand.
+    """
+
+    def __init__(self):
+        self._thread_local = threading.local()
+
+    def __call__(self, server=None):
+        sessions = getattr(self._thread_local, 'curl_sessions', None)
+        if sessions is None:
+            sessions = self._thread_local.curl_sessions = {}
+        session = sessions.get(server)
+        if session is None:
+            session = sessions[server] = CurlSession()
+        return session
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Compression of the calls sent to the VCSServer.
+
+The compression is negotiated with the standard HTTP headers. Every call
+announces the configured codec in `Accept-Encoding`, request bodies above
+a size threshold are compressed and marked with `Content-Encoding`, and
+responses are decompressed based on their `Content-Encoding`.
+"""
+
+import threading
+import zlib
+
+
+class Codec(object):
+
+    def __init__(self, name, encoding, compress, decompress):
+        self.name = name
+        # the HTTP content-coding of this codec
+        self.encoding = encoding
+        self.compress = compress
+        self.decompress = decompress
+
+    def __repr__(self):
+        return '<Codec:%s encoding:%s>' % (self.name, self.encoding)
+
+
+_codecs = {}
+
+
+def register_codec(name, encoding, compress, decompress):
+    """
+    Registers a codec which can then be selected by its `name` in
+    `vcs.server.compression`.
+    """
+    _codecs[name] = Codec(name, encoding, compress, decompress)
+
+
+def get_codec(name):
+    """
+    Returns the codec registered as `name`, or None if compression is
+    disabled.
+    """
+    if not name or name == 'none':
+        return None
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError('Unknown VCSServer compression `{}`, available: {}'
+                         .format(name, ', '.join(sorted(_codecs))))
+
+
+def get_codec_by_encoding(encoding):
+    for codec in _codecs.values():
+        if codec.encoding == encoding:
+            return codec
+    return None
+
+
+# level 1 is the fastest one, the data is compressed on every call
+register_codec(
+    'zlib', 'deflate', lambda data: zlib.compress(data, 1), zlib.decompress)
+
+
+class CompressionStats(object):
+    """
+    Counts the bytes before and after compression, per direction.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.sent_raw = 0
+        self.sent_compressed = 0
+        self.received_raw = 0
+        self.received_compressed = 0
+
+    def add_sent(self, raw_size, compressed_size):
+        with self._lock:
+            self.sent_raw += raw_size
+            self.sent_compressed += compressed_size
+
+    def add_received(self, raw_size, compressed_size):
+        with self._lock:
+            self.received_raw += raw_size
+            self.received_compressed += compressed_size
+
+    def get_data(self):
+        return {
+            'sent_raw_bytes': self.sent_raw,
+            'sent_compressed_bytes': self.sent_compressed,
+            'received_raw_bytes': self.received_raw,
+            'received_compressed_bytes': self.received_compressed,
+            'saved_bytes': (self.sent_raw - self.sent_compressed +
+                            self.received_raw - self.received_compressed),
+        }
+
+
+compression_stats = CompressionStats()
+
+
+def encode_request(codec, data, min_size):
+    """
+    Returns the body and the headers of a call, the body is compressed if
+    it is at least `min_size` bytes long.
+    """
+    headers = {'Accept-Encoding': codec.encoding}
+    if len(data) >= min_size:
+        compressed = codec.compress(data)
+        # incompressible data is sent as it is
+        if len(compressed) < len(data):
+            compression_stats.add_sent(len(data), len(compressed))
+            headers['Content-Encoding'] = codec.encoding
+            data = compressed
+    return data, headers
+
+
+def decode_response(content, headers):
+    """
+    Decompresses the response `content` according to its `Content-Encoding`.
+    """
+    encoding = headers.get('content-encoding')
+    if not encoding or encoding == 'identity':
+        return content
+
+    codec = get_codec_by_encoding(encoding)
+    if codec is None:
+        raise ValueError(
+            'Unsupported Content-Encoding `{}` of VCSServer response'.format(
+                encoding))
+    raw = codec.decompress(content)
+    compression_stats.add_received(len(raw), len(content))
+    return raw
@@ -29,6 +29,10 @@ DEFAULT_ENCODINGS = ['utf8']
 # It can also be ['--branches', '--tags']
 GIT_REV_FILTER = ['--all']
 
+# Keep a persistent index of the commit ids inside of git repositories
+# instead of listing all commits for every repository instance
+GIT_COMMIT_INDEX = True
+
 # Compatibility version when creating SVN repositories. None means newest.
 # Other available options are: pre-1.4-compatible, pre-1.5-compatible,
 # pre-1.6-compatible, pre-1.8-compatible
@@ -53,6 +57,16 @@ HOOKS_PROTOCOL = None
 HOOKS_DIRECT_CALLS = False
 HOOKS_HOST = '127.0.0.1'
 
+# Send calls collected by `RemoteRepo.batch()` as a single multi-call
+# request, requires a VCSServer which supports batched calls
+VCSSERVER_BATCH_CALLS = False
+
+# Name of the codec used to compress calls to the VCSServer, see
+# `rhodecode.lib.vcs.compression`, requests smaller than the min size are
+# sent uncompressed
+VCSSERVER_COMPRESSION = None
+VCSSERVER_COMPRESSION_MIN_SIZE = 4096
+
 
 MERGE_MESSAGE_TMPL = (
     u'Merge pull request #{pr_id} from {source_repo} {source_ref_name}\n\n '
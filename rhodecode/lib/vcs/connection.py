@@ -32,6 +32,9 @@ def _not_initialized(*args, **kwargs):
 # TODO: figure out a nice default value for these things
 Service = _not_initialized
 
+# the :class:`VcsServerPool` of the configured VCSServers
+ServerPool = None
+
 Git = _not_initialized
 Hg = _not_initialized
 Svn = _not_initialized
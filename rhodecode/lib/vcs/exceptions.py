@@ -38,6 +38,12 @@ class HttpVCSCommunicationError(VCSCommunicationError):
     pass
 
 
+class HttpVCSConnectionError(HttpVCSCommunicationError):
+    """
+    The VCSServer could not be reached, the call was never delivered.
+    """
+
+
 class VCSError(Exception):
     pass
 
@@ -29,7 +29,7 @@ from zope.cachedescriptors.property import Lazy as LazyProperty
 
 from rhodecode.config.conf import LANGUAGES_EXTENSIONS_MAP
 from rhodecode.lib.utils import safe_unicode, safe_str
-from rhodecode.lib.utils2 import md5
+from rhodecode.lib.utils2 import md5, sha1_safe
 from rhodecode.lib.vcs import path as vcspath
 from rhodecode.lib.vcs.backends.base import EmptyCommit, FILEMODE_DEFAULT
 from rhodecode.lib.vcs.conf.mtypes import get_mimetypes_db
@@ -369,6 +369,16 @@ class FileNode(Node):
             content = self._content
         return content
 
+    def stream_bytes(self):
+        """
+        Returns an iterator over chunks of the raw bytes of the FileNode,
+        without keeping the whole content in memory if it's not loaded yet.
+        """
+        if self.commit and self._content is None \
+                and 'raw_bytes' not in self.__dict__:
+            return self.commit.get_file_content_streamed(self.path)
+        return iter([self.raw_bytes])
+
     @LazyProperty
     def md5(self):
         """
@@ -376,6 +386,20 @@ class FileNode(Node):
         """
         return md5(self.raw_bytes)
 
+    @LazyProperty
+    def content_id(self):
+        """
+        Returns an id of the content of the file node, the id the backend
+        stores it by if it has one, otherwise the sha1 of the content.
+        """
+        # large file nodes don't have a commit
+        commit = getattr(self, 'commit', None)
+        if commit:
+            file_id = commit.get_file_id(self.path)
+            if file_id:
+                return file_id
+        return sha1_safe(self.raw_bytes)
+
     def metadata_uncached(self):
         """
         Returns md5, binary flag of the file node, without any cache usage.
@@ -842,6 +866,14 @@ class LargeFileNode(FileNode):
             content = f.read()
         return content
 
+    def stream_bytes(self, chunk_size=64 * 1024):
+        with open(self.path, 'rb') as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                yield data
+
     @LazyProperty
     def name(self):
         """
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Pool of VCSServer nodes.
+
+Calls for a repository are routed by a consistent hash of the repository
+path, so every repository is handled by the same node as long as it is
+available and the repository objects cached by that node stay warm. Nodes
+which can't be reached are skipped until `retry_interval` passed.
+"""
+
+import bisect
+import hashlib
+import logging
+import threading
+import time
+import urlparse
+
+import requests
+
+from rhodecode.lib.vcs import exceptions
+from rhodecode.lib.utils2 import safe_str
+
+
+log = logging.getLogger(__name__)
+
+
+def parse_servers(value):
+    """
+    Parses the value of `vcs.server`, a comma or whitespace separated list
+    of `host:port` entries.
+    """
+    servers = []
+    for server in value.replace(',', ' ').split():
+        if server not in servers:
+            servers.append(server)
+    return servers
+
+
+def get_pool(servers):
+    """
+    Returns a :class:`VcsServerPool` for `servers`, which can be a pool
+    already or the value of `vcs.server`.
+    """
+    if isinstance(servers, VcsServerPool):
+        return servers
+    return VcsServerPool(servers)
+
+
+def _hash(key):
+    return int(hashlib.md5(safe_str(key)).hexdigest()[:8], 16)
+
+
+class VcsServerPool(object):
+
+    # virtual nodes per server, spreads the keys evenly over the servers
+    replicas = 100
+
+    def __init__(self, servers, retry_interval=30):
+        if isinstance(servers, basestring):
+            servers = parse_servers(servers)
+        if not servers:
+            raise ValueError('At least one VCSServer is required')
+
+        self.servers = servers
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._failed = {}
+        self._urls = {}
+
+        ring = []
+        for server in servers:
+            for idx in xrange(self.replicas):
+                ring.append((_hash('{}-{}'.format(server, idx)), server))
+        ring.sort()
+        self._ring_hashes = [h for h, __ in ring]
+        self._ring_servers = [s for __, s in ring]
+
+    def __repr__(self):
+        return '<VcsServerPool: %s>' % ', '.join(self.servers)
+
+    def get_nodes(self, key=None):
+        """
+        Returns all servers in the order they should be tried for `key`,
+        the servers of the consistent hash ring first and servers marked as
+        failed last. Calls without a key go to the first configured server.
+        """
+        if len(self.servers) == 1:
+            return self.servers
+
+        if key is None:
+            ordered = self.servers
+        else:
+            ordered = []
+            start = bisect.bisect(self._ring_hashes, _hash(key))
+            ring_size = len(self._ring_servers)
+            for idx in xrange(ring_size):
+                server = self._ring_servers[(start + idx) % ring_size]
+                if server not in ordered:
+                    ordered.append(server)
+                    if len(ordered) == len(self.servers):
+                        break
+
+        if not self._failed:
+            return ordered
+        available = [s for s in ordered if self.is_available(s)]
+        return available + [s for s in ordered if s not in available]
+
+    def get_node(self, key=None):
+        return self.get_nodes(key)[0]
+
+    def get_url(self, server, endpoint):
+        url = self._urls.get((server, endpoint))
+        if url is None:
+            url = urlparse.urljoin('http://%s' % server, endpoint)
+            self._urls[(server, endpoint)] = url
+        return url
+
+    def is_available(self, server):
+        failed_at = self._failed.get(server)
+        if failed_at is None:
+            return True
+        # give the server another chance once the retry interval passed
+        return time.time() - failed_at >= self.retry_interval
+
+    def mark_failed(self, server):
+        log.warning('VCSServer %s is not reachable, failing over', server)
+        with self._lock:
+            self._failed[server] = time.time()
+
+    def mark_available(self, server):
+        if server in self._failed:
+            log.info('VCSServer %s is reachable again', server)
+            with self._lock:
+                self._failed.pop(server, None)
+
+    def call(self, key, func):
+        """
+        Calls `func(server)` with the servers for `key` until one of them
+        can be reached.
+        """
+        error = None
+        for server in self.get_nodes(key):
+            try:
+                result = func(server)
+            except exceptions.HttpVCSConnectionError as e:
+                if len(self.servers) == 1:
+                    raise
+                self.mark_failed(server)
+                error = e
+                continue
+            self.mark_available(server)
+            return result
+        raise error
+
+    def check_health(self, timeout=5):
+        """
+        Checks the status endpoint of every server, marks them accordingly
+        and returns a dict of server to its state.
+        """
+        states = {}
+        for server in self.servers:
+            try:
+                response = requests.get(
+                    'http://{}/status'.format(server), timeout=timeout)
+                healthy = response.status_code == 200
+            except requests.RequestException:
+                healthy = False
+
+            if healthy:
+                self.mark_available(server)
+            else:
+                self.mark_failed(server)
+            states[server] = healthy
+        return states
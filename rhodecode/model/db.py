@@ -2440,6 +2440,9 @@ class Repository(Base, BaseModel):
             with_wire=custom_wire,
             create=False,
             _vcs_alias=self.repo_type)
+        if repo is not None:
+            from rhodecode.lib import rc_cache
+            repo.refs_snapshot = rc_cache.RefsSnapshot(self.repo_id)
 
         return repo
 
@@ -3362,8 +3365,22 @@ class CacheKey(Base, BaseModel):
     @classmethod
     def set_invalidate(cls, cache_uid, delete=False):
         """
-        Mark all caches of a repo as invalid in the database.
+        Mark all caches of a repo as invalid. Unless the invalidation state
+        is kept in the database, this bumps the generation of `cache_uid`.
         """
+        from rhodecode.lib import rc_cache
+
+        store = rc_cache.get_generation_store()
+        if store is not None:
+            try:
+                generation = store.bump(cache_uid)
+                log.debug('cache generation of %s bumped to %s',
+                          safe_str(cache_uid), generation)
+            except Exception:
+                log.exception(
+                    'Cache generation bump failed for cache args %s',
+                    safe_str(cache_uid))
+            return
 
         try:
             qry = Session().query(cls).filter(cls.cache_args == cache_uid)
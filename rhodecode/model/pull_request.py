@@ -24,6 +24,7 @@ pull request model for RhodeCode
 """
 
 
+import os
 import json
 import logging
 import datetime
@@ -33,20 +34,22 @@ import collections
 from pyramid import compat
 from pyramid.threadlocal import get_current_request
 
+import rhodecode
 from rhodecode import events
 from rhodecode.translation import lazy_ugettext
-from rhodecode.lib import helpers as h, hooks_utils, diffs
+from rhodecode.lib import helpers as h, hooks_utils, diffs, codeblocks
 from rhodecode.lib import audit_logger
 from rhodecode.lib.compat import OrderedDict
 from rhodecode.lib.hooks_daemon import prepare_callback_daemon
 from rhodecode.lib.markup_renderer import (
     DEFAULT_COMMENTS_RENDERER, RstTemplateRenderer)
-from rhodecode.lib.utils2 import safe_unicode, safe_str, md5_safe
+from rhodecode.lib.utils2 import safe_unicode, safe_str, safe_int, md5_safe
 from rhodecode.lib.vcs.backends.base import (
-    Reference, MergeResponse, MergeFailureReason, UpdateFailureReason)
+    Reference, MergeResponse, MergeFailureReason, UpdateFailureReason,
+    EmptyCommit)
 from rhodecode.lib.vcs.conf import settings as vcs_settings
 from rhodecode.lib.vcs.exceptions import (
-    CommitDoesNotExistError, EmptyRepositoryError)
+    CommitDoesNotExistError, EmptyRepositoryError, RepositoryRequirementError)
 from rhodecode.model import BaseModel
 from rhodecode.model.changeset_status import ChangesetStatusModel
 from rhodecode.model.comment import CommentsModel
@@ -1507,6 +1510,173 @@ class PullRequestModel(BaseModel):
             ignore_whitespace=hide_whitespace_changes, context=diff_context)
         return vcs_diff
 
+    def get_diff_commits(
+            self, commits_source_repo, pull_request_at_ver, source_commit,
+            source_ref_id, source_scm, target_commit, target_ref_id, target_scm):
+        """
+        Returns the `(ancestor_commit, commit_cache, missing_requirements,
+        source_commit, target_commit)` a diff of a pull request is shown for,
+        the given commits are kept if they can't be found.
+        """
+        commit_cache = collections.OrderedDict()
+        missing_requirements = False
+        try:
+            pre_load = ["author", "branch", "date", "message", "parents"]
+            show_revs = pull_request_at_ver.revisions
+            for rev in show_revs:
+                comm = commits_source_repo.get_commit(
+                    commit_id=rev, pre_load=pre_load)
+                commit_cache[comm.raw_id] = comm
+
+            # Order here matters, we first need to get target, and then
+            # the source
+            target_commit = commits_source_repo.get_commit(
+                commit_id=safe_str(target_ref_id))
+
+            source_commit = commits_source_repo.get_commit(
+                commit_id=safe_str(source_ref_id))
+        except CommitDoesNotExistError:
+            log.warning(
+                'Failed to get commit from `{}` repo'.format(
+                    commits_source_repo), exc_info=True)
+        except RepositoryRequirementError:
+            log.warning(
+                'Failed to get all required data from repo', exc_info=True)
+            missing_requirements = True
+        ancestor_commit = None
+        try:
+            ancestor_id = source_scm.get_common_ancestor(
+                source_commit.raw_id, target_commit.raw_id, target_scm)
+            ancestor_commit = source_scm.get_commit(ancestor_id)
+        except Exception:
+            ancestor_commit = None
+        return ancestor_commit, commit_cache, missing_requirements, source_commit, target_commit
+
+    def get_diffset(self, repo_name, source_repo_name, source_repo,
+                    source_ref_id, target_ref_id,
+                    target_commit, source_commit, diff_limit, file_limit,
+                    fulldiff, hide_whitespace_changes, diff_context,
+                    path_filter=None):
+        """
+        Renders the diff of a pull request, only with the files allowed by
+        the path permissions of `path_filter` if it's given.
+        """
+        vcs_diff = self.get_diff(
+            source_repo, source_ref_id, target_ref_id,
+            hide_whitespace_changes, diff_context)
+
+        diff_processor = diffs.DiffProcessor(
+            vcs_diff, format='newdiff', diff_limit=diff_limit,
+            file_limit=file_limit, show_full_diff=fulldiff)
+
+        _parsed = diff_processor.iter_patches()
+
+        diffset = codeblocks.DiffSet(
+            repo_name=repo_name,
+            source_repo_name=source_repo_name,
+            source_node_getter=codeblocks.diffset_node_getter(target_commit),
+            target_node_getter=codeblocks.diffset_node_getter(source_commit),
+        )
+        if path_filter is None:
+            diffset = diffset.render_patchset(
+                _parsed, target_commit.raw_id, source_commit.raw_id)
+            diffset.has_hidden_changes = False
+            return diffset
+
+        return path_filter.render_patchset_filtered(
+            diffset, _parsed, target_commit.raw_id, source_commit.raw_id)
+
+    def get_diff_cache_file_path(
+            self, target_scm, target_repo, pull_request_id, version,
+            from_version, source_ref_id, target_ref_id,
+            hide_whitespace_changes, diff_context, fulldiff):
+        """
+        Returns the path of the cached diff of a pull request shown at
+        `version`, compared to `from_version`.
+        """
+        cache_path = target_scm.get_create_shadow_cache_pr_path(target_repo)
+        # empty version means latest, so we keep this to prevent
+        # double caching
+        return diffs.diff_cache_exist(
+            cache_path, 'pull_request', pull_request_id,
+            version or 'latest', from_version or 'latest',
+            source_ref_id, target_ref_id,
+            hide_whitespace_changes, diff_context, fulldiff)
+
+    def generate_diff_cache(self, pull_request):
+        """
+        Renders the diff of the latest version of a pull request, the way it
+        is shown by default, into the diff cache of its target repository.
+        Returns the path of the cache file, or None if the diff isn't
+        cached.
+        """
+        pull_request = self.__get_pull_request(pull_request)
+        if not self._get_general_setting(pull_request, 'rhodecode_diff_cache'):
+            return None
+
+        source_repo = pull_request.source_repo
+        target_repo = pull_request.target_repo
+        source_scm = source_repo.scm_instance()
+        target_scm = target_repo.scm_instance()
+
+        if target_scm.get_path_permissions(
+                pull_request.author.username) is not None:
+            # diffs filtered by path permissions depend on the viewing user
+            log.debug('Skipping diff cache of %s, repository has path '
+                      'permissions', pull_request)
+            return None
+
+        source_ref_id = pull_request.source_ref_parts.commit_id
+        target_ref_id = pull_request.target_ref_parts.commit_id
+        diff_context = diffs.DEFAULT_CONTEXT
+        hide_whitespace_changes = False
+        fulldiff = False
+
+        cache_file_path = self.get_diff_cache_file_path(
+            target_scm, target_repo, pull_request.pull_request_id, None, None,
+            source_ref_id, target_ref_id, hide_whitespace_changes,
+            diff_context, fulldiff)
+        if os.path.isfile(cache_file_path):
+            return cache_file_path
+
+        diff_commit_cache = \
+            (ancestor_commit, commit_cache, missing_requirements,
+             source_commit, target_commit) = self.get_diff_commits(
+                source_scm, pull_request, EmptyCommit(), source_ref_id,
+                source_scm, EmptyCommit(), target_ref_id, target_scm)
+
+        if (missing_requirements
+                or isinstance(source_commit, EmptyCommit)
+                or source_commit == target_commit):
+            return None
+
+        diffset = self.get_diffset(
+            target_repo.repo_name, source_repo.repo_name, source_scm,
+            source_ref_id, target_ref_id, target_commit, source_commit,
+            safe_int(rhodecode.CONFIG.get('cut_off_limit_diff')),
+            safe_int(rhodecode.CONFIG.get('cut_off_limit_file')),
+            fulldiff, hide_whitespace_changes, diff_context)
+
+        diffs.cache_diff(cache_file_path, diffset, diff_commit_cache)
+        return cache_file_path
+
+    def schedule_diff_cache_generation(self, pull_request):
+        """
+        Generates the diff cache of a created or updated pull request in a
+        celery task. Without celery the diff is rendered by its first view,
+        instead of delaying the current request.
+        """
+        if not rhodecode.CELERY_ENABLED:
+            return None
+        pull_request = self.__get_pull_request(pull_request)
+        if not self._get_general_setting(pull_request, 'rhodecode_diff_cache'):
+            return None
+
+        from rhodecode.lib.celerylib import tasks, run_task
+        return run_task(
+            tasks.generate_pull_request_diff_cache,
+            pull_request.pull_request_id)
+
     def _is_merge_enabled(self, pull_request):
         return self._get_general_setting(
             pull_request, 'rhodecode_pr_merge_enabled')
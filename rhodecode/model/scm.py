@@ -275,6 +275,7 @@ class ScmModel(BaseModel):
             CacheKey.set_invalidate(invalidation_namespace, delete=delete)
 
             repo_id = repo.repo_id
+            rc_cache.RefsSnapshot(repo_id).invalidate()
             config = repo._config
             config.set('extensions', 'largefiles', '')
             repo.update_commit_cache(config=config, cs_cache=None)
@@ -525,6 +526,8 @@ class ScmModel(BaseModel):
             commit = _repo.scm_instance().get_commit(commit_id=commit_id)
             root_path = root_path.lstrip('/')
             for __, dirs, files in commit.walk(root_path):
+                if not flat and (extended_info or content):
+                    self._preload_file_nodes(commit, files)
 
                 for f in files:
                     _content = None
@@ -582,6 +585,22 @@ class ScmModel(BaseModel):
 
         return _dirs, _files
 
+    def _preload_file_nodes(self, commit, file_nodes):
+        """
+        Fetches content and size of given file nodes using batched calls,
+        instead of one remote call per node and attribute.
+        """
+        file_nodes = [f for f in file_nodes if f.commit and f._content is None]
+        if not file_nodes:
+            return
+
+        paths = [f.path for f in file_nodes]
+        contents = commit.get_file_contents(paths)
+        sizes = commit.get_file_sizes(paths)
+        for f, f_content, f_size in zip(file_nodes, contents, sizes):
+            f._content = f_content
+            f.__dict__['size'] = f_size
+
     def get_node(self, repo_name, commit_id, file_path,
                  extended_info=False, content=False, max_file_bytes=None, cache=True):
         """
@@ -209,7 +209,8 @@
     <%namespace name="cbdiffs" file="/codeblocks/diffs.mako"/>
     ${cbdiffs.render_diffset_menu(c.changes[c.commit.raw_id])}
     ${cbdiffs.render_diffset(
-      c.changes[c.commit.raw_id], commit=c.commit, use_comments=True,inline_comments=c.inline_comments )}
+      c.changes[c.commit.raw_id], commit=c.commit, use_comments=True,inline_comments=c.inline_comments,
+      lazy_load_files_over=c.visual.lazy_load_diff_files_over, lazy_load_url=c.lazy_load_url)}
   </div>
 
     ## template for inline comment form
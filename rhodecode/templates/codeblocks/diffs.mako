@@ -49,6 +49,11 @@ return '%s_%s_%i' % (h.md5_safe(commit+filename), type, line)
     # for cache purpose
     inline_comments=None,
 
+    # render only the diffs of this many files, the diffs of the remaining
+    # files are loaded from `lazy_load_url` once they are shown
+    lazy_load_files_over=0,
+    lazy_load_url=None,
+
 )">
 %if use_comments:
 <div id="cb-comments-inline-container-template" class="js-template">
@@ -153,134 +158,17 @@ collapse_all = len(diffset.files) > collapse_when_files_over
         <%
         lines_changed = filediff.patch['stats']['added'] + filediff.patch['stats']['deleted']
         over_lines_changed_limit = lines_changed > lines_changed_limit
+        ## files with inline comments are always rendered, so links to
+        ## their comments work
+        lazy_load = (lazy_load_url and lazy_load_files_over
+                     and i >= lazy_load_files_over
+                     and filediff.patch['filename'] not in (inline_comments or {}))
         %>
-        ## anchor with support of sticky header
-        <div class="anchor" id="a_${h.FID(filediff.raw_id, filediff.patch['filename'])}"></div>
-
-        <input ${(collapse_all and 'checked' or '')} class="filediff-collapse-state" id="filediff-collapse-${id(filediff)}" type="checkbox" onchange="updateSticky();">
-        <div
-            class="filediff"
-            data-f-path="${filediff.patch['filename']}"
-            data-anchor-id="${h.FID(filediff.raw_id, filediff.patch['filename'])}"
-        >
-        <label for="filediff-collapse-${id(filediff)}" class="filediff-heading">
-            <div class="filediff-collapse-indicator"></div>
-            ${diff_ops(filediff)}
-        </label>
-
-        ${diff_menu(filediff, use_comments=use_comments)}
-        <table data-f-path="${filediff.patch['filename']}" data-anchor-id="${h.FID(filediff.raw_id, filediff.patch['filename'])}" class="code-visible-block cb cb-diff-${c.user_session_attrs["diffmode"]} code-highlight ${(over_lines_changed_limit and 'cb-collapsed' or '')}">
-
-        ## new/deleted/empty content case
-        % if not filediff.hunks:
-            ## Comment container, on "fakes" hunk that contains all data to render comments
-            ${render_hunk_lines(filediff, c.user_session_attrs["diffmode"], filediff.hunk_ops, use_comments=use_comments, inline_comments=inline_comments)}
-        % endif
-
-        %if filediff.limited_diff:
-                <tr class="cb-warning cb-collapser">
-                    <td class="cb-text" ${(c.user_session_attrs["diffmode"] == 'unified' and 'colspan=4' or 'colspan=6')}>
-                        ${_('The requested commit or file is too big and content was truncated.')} <a href="${h.current_route_path(request, fulldiff=1)}" onclick="return confirm('${_("Showing a big diff might take some time and resources, continue?")}')">${_('Show full diff')}</a>
-                    </td>
-                </tr>
+        %if lazy_load:
+            ${render_filediff_placeholder(filediff, lazy_load_url, collapse_all=collapse_all)}
         %else:
-            %if over_lines_changed_limit:
-                <tr class="cb-warning cb-collapser">
-                    <td class="cb-text" ${(c.user_session_attrs["diffmode"] == 'unified' and 'colspan=4' or 'colspan=6')}>
-                        ${_('This diff has been collapsed as it changes many lines, (%i lines changed)' % lines_changed)}
-                        <a href="#" class="cb-expand"
-                           onclick="$(this).closest('table').removeClass('cb-collapsed'); updateSticky(); return false;">${_('Show them')}
-                        </a>
-                        <a href="#" class="cb-collapse"
-                           onclick="$(this).closest('table').addClass('cb-collapsed'); updateSticky(); return false;">${_('Hide them')}
-                        </a>
-                    </td>
-                </tr>
-            %endif
+            ${render_filediff(filediff, collapse_all=collapse_all, lines_changed_limit=lines_changed_limit, use_comments=use_comments, inline_comments=inline_comments)}
         %endif
-
-        % for hunk in filediff.hunks:
-            <tr class="cb-hunk">
-                <td ${(c.user_session_attrs["diffmode"] == 'unified' and 'colspan=3' or '')}>
-                    ## TODO: dan: add ajax loading of more context here
-                    ## <a href="#">
-                        <i class="icon-more"></i>
-                    ## </a>
-                </td>
-                <td ${(c.user_session_attrs["diffmode"] == 'sideside' and 'colspan=5' or '')}>
-                    @@
-                    -${hunk.source_start},${hunk.source_length}
-                    +${hunk.target_start},${hunk.target_length}
-                    ${hunk.section_header}
-                </td>
-            </tr>
-            ${render_hunk_lines(filediff, c.user_session_attrs["diffmode"], hunk, use_comments=use_comments, inline_comments=inline_comments)}
-        % endfor
-
-        <% unmatched_comments = (inline_comments or {}).get(filediff.patch['filename'], {}) %>
-
-        ## outdated comments that do not fit into currently displayed lines
-        % for lineno, comments in unmatched_comments.items():
-
-            %if c.user_session_attrs["diffmode"] == 'unified':
-                % if loop.index == 0:
-                <tr class="cb-hunk">
-                    <td colspan="3"></td>
-                    <td>
-                        <div>
-                        ${_('Unmatched inline comments below')}
-                        </div>
-                    </td>
-                </tr>
-                % endif
-                <tr class="cb-line">
-                    <td class="cb-data cb-context"></td>
-                    <td class="cb-lineno cb-context"></td>
-                    <td class="cb-lineno cb-context"></td>
-                    <td class="cb-content cb-context">
-                        ${inline_comments_container(comments, inline_comments)}
-                    </td>
-                </tr>
-            %elif c.user_session_attrs["diffmode"] == 'sideside':
-                % if loop.index == 0:
-                <tr class="cb-comment-info">
-                    <td colspan="2"></td>
-                    <td class="cb-line">
-                        <div>
-                        ${_('Unmatched inline comments below')}
-                        </div>
-                    </td>
-                    <td colspan="2"></td>
-                    <td class="cb-line">
-                        <div>
-                        ${_('Unmatched comments below')}
-                        </div>
-                    </td>
-                </tr>
-                % endif
-                <tr class="cb-line">
-                    <td class="cb-data cb-context"></td>
-                    <td class="cb-lineno cb-context"></td>
-                    <td class="cb-content cb-context">
-                        % if lineno.startswith('o'):
-                            ${inline_comments_container(comments, inline_comments)}
-                        % endif
-                    </td>
-
-                    <td class="cb-data cb-context"></td>
-                    <td class="cb-lineno cb-context"></td>
-                    <td class="cb-content cb-context">
-                        % if lineno.startswith('n'):
-                            ${inline_comments_container(comments, inline_comments)}
-                        % endif
-                    </td>
-                </tr>
-            %endif
-
-        % endfor
-
-            </table>
-        </div>
     %endfor
 
     ## outdated comments that are made for a file that has been deleted
@@ -350,6 +238,217 @@ collapse_all = len(diffset.files) > collapse_when_files_over
 
 </div>
 </div>
+
+%if lazy_load_url and lazy_load_files_over and len(diffset.files) > lazy_load_files_over:
+<script type="text/javascript">
+$(document).ready(function () {
+    var loadFileDiff = function (container) {
+        if (container.data('loading')) {
+            return;
+        }
+        container.data('loading', true);
+        $.ajax({
+            url: container.data('lazyUrl'),
+            data: {'f_path': container.data('fPath')},
+            dataType: 'html'
+        }).done(function (data) {
+            container.removeClass('filediff-lazy').html(data);
+            timeagoActivate();
+            if (typeof updateSticky === 'function') {
+                updateSticky();
+            }
+        }).fail(function () {
+            container.data('loading', false);
+            container.find('.cb-lazy-load-status').html(
+                _gettext('Failed to load the diff of this file, reload the page to show it.'));
+        });
+    };
+
+    // collapsed files are loaded once they are expanded
+    var loadVisibleFileDiffs = $.debounce(100, function () {
+        var bottom = $(window).scrollTop() + 2 * $(window).height();
+        $('.filediff-lazy').each(function () {
+            var container = $(this);
+            if (container.offset().top > bottom) {
+                return false;
+            }
+            if (!container.find('.filediff-collapse-state').prop('checked')) {
+                loadFileDiff(container);
+            }
+        });
+    });
+
+    $(document).on('change', '.filediff-lazy .filediff-collapse-state', function () {
+        if (!$(this).prop('checked')) {
+            loadFileDiff($(this).closest('.filediff-lazy'));
+        }
+    });
+    $(window).on('scroll resize', loadVisibleFileDiffs);
+    loadVisibleFileDiffs();
+});
+</script>
+%endif
+</%def>
+
+<%def name="render_filediff(filediff, collapse_all=False, lines_changed_limit=500, use_comments=False, inline_comments=None)">
+<%
+lines_changed = filediff.patch['stats']['added'] + filediff.patch['stats']['deleted']
+over_lines_changed_limit = lines_changed > lines_changed_limit
+%>
+    ## anchor with support of sticky header
+    <div class="anchor" id="a_${h.FID(filediff.raw_id, filediff.patch['filename'])}"></div>
+
+    <input ${(collapse_all and 'checked' or '')} class="filediff-collapse-state" id="filediff-collapse-${h.FID(filediff.raw_id, filediff.patch['filename'])}" type="checkbox" onchange="updateSticky();">
+    <div
+        class="filediff"
+        data-f-path="${filediff.patch['filename']}"
+        data-anchor-id="${h.FID(filediff.raw_id, filediff.patch['filename'])}"
+    >
+    <label for="filediff-collapse-${h.FID(filediff.raw_id, filediff.patch['filename'])}" class="filediff-heading">
+        <div class="filediff-collapse-indicator"></div>
+        ${diff_ops(filediff)}
+    </label>
+
+    ${diff_menu(filediff, use_comments=use_comments)}
+    <table data-f-path="${filediff.patch['filename']}" data-anchor-id="${h.FID(filediff.raw_id, filediff.patch['filename'])}" class="code-visible-block cb cb-diff-${c.user_session_attrs["diffmode"]} code-highlight ${(over_lines_changed_limit and 'cb-collapsed' or '')}">
+
+    ## new/deleted/empty content case
+    % if not filediff.hunks:
+        ## Comment container, on "fakes" hunk that contains all data to render comments
+        ${render_hunk_lines(filediff, c.user_session_attrs["diffmode"], filediff.hunk_ops, use_comments=use_comments, inline_comments=inline_comments)}
+    % endif
+
+    %if filediff.limited_diff:
+            <tr class="cb-warning cb-collapser">
+                <td class="cb-text" ${(c.user_session_attrs["diffmode"] == 'unified' and 'colspan=4' or 'colspan=6')}>
+                    ${_('The requested commit or file is too big and content was truncated.')} <a href="${h.current_route_path(request, fulldiff=1)}" onclick="return confirm('${_("Showing a big diff might take some time and resources, continue?")}')">${_('Show full diff')}</a>
+                </td>
+            </tr>
+    %else:
+        %if over_lines_changed_limit:
+            <tr class="cb-warning cb-collapser">
+                <td class="cb-text" ${(c.user_session_attrs["diffmode"] == 'unified' and 'colspan=4' or 'colspan=6')}>
+                    ${_('This diff has been collapsed as it changes many lines, (%i lines changed)' % lines_changed)}
+                    <a href="#" class="cb-expand"
+                       onclick="$(this).closest('table').removeClass('cb-collapsed'); updateSticky(); return false;">${_('Show them')}
+                    </a>
+                    <a href="#" class="cb-collapse"
+                       onclick="$(this).closest('table').addClass('cb-collapsed'); updateSticky(); return false;">${_('Hide them')}
+                    </a>
+                </td>
+            </tr>
+        %endif
+    %endif
+
+    % for hunk in filediff.hunks:
+        <tr class="cb-hunk">
+            <td ${(c.user_session_attrs["diffmode"] == 'unified' and 'colspan=3' or '')}>
+                ## TODO: dan: add ajax loading of more context here
+                ## <a href="#">
+                    <i class="icon-more"></i>
+                ## </a>
+            </td>
+            <td ${(c.user_session_attrs["diffmode"] == 'sideside' and 'colspan=5' or '')}>
+                @@
+                -${hunk.source_start},${hunk.source_length}
+                +${hunk.target_start},${hunk.target_length}
+                ${hunk.section_header}
+            </td>
+        </tr>
+        ${render_hunk_lines(filediff, c.user_session_attrs["diffmode"], hunk, use_comments=use_comments, inline_comments=inline_comments)}
+    % endfor
+
+    <% unmatched_comments = (inline_comments or {}).get(filediff.patch['filename'], {}) %>
+
+    ## outdated comments that do not fit into currently displayed lines
+    % for lineno, comments in unmatched_comments.items():
+
+        %if c.user_session_attrs["diffmode"] == 'unified':
+            % if loop.index == 0:
+            <tr class="cb-hunk">
+                <td colspan="3"></td>
+                <td>
+                    <div>
+                    ${_('Unmatched inline comments below')}
+                    </div>
+                </td>
+            </tr>
+            % endif
+            <tr class="cb-line">
+                <td class="cb-data cb-context"></td>
+                <td class="cb-lineno cb-context"></td>
+                <td class="cb-lineno cb-context"></td>
+                <td class="cb-content cb-context">
+                    ${inline_comments_container(comments, inline_comments)}
+                </td>
+            </tr>
+        %elif c.user_session_attrs["diffmode"] == 'sideside':
+            % if loop.index == 0:
+            <tr class="cb-comment-info">
+                <td colspan="2"></td>
+                <td class="cb-line">
+                    <div>
+                    ${_('Unmatched inline comments below')}
+                    </div>
+                </td>
+                <td colspan="2"></td>
+                <td class="cb-line">
+                    <div>
+                    ${_('Unmatched comments below')}
+                    </div>
+                </td>
+            </tr>
+            % endif
+            <tr class="cb-line">
+                <td class="cb-data cb-context"></td>
+                <td class="cb-lineno cb-context"></td>
+                <td class="cb-content cb-context">
+                    % if lineno.startswith('o'):
+                        ${inline_comments_container(comments, inline_comments)}
+                    % endif
+                </td>
+
+                <td class="cb-data cb-context"></td>
+                <td class="cb-lineno cb-context"></td>
+                <td class="cb-content cb-context">
+                    % if lineno.startswith('n'):
+                        ${inline_comments_container(comments, inline_comments)}
+                    % endif
+                </td>
+            </tr>
+        %endif
+
+    % endfor
+
+        </table>
+    </div>
+</%def>
+
+<%def name="render_filediff_placeholder(filediff, lazy_load_url, collapse_all=False)">
+    ## the diff of the file is loaded from `lazy_load_url` once it's expanded
+    ## and scrolled into view, see `render_diffset`
+    <div class="filediff-lazy" data-f-path="${filediff.patch['filename']}" data-lazy-url="${lazy_load_url}">
+        <div class="anchor" id="a_${h.FID(filediff.raw_id, filediff.patch['filename'])}"></div>
+
+        <input ${(collapse_all and 'checked' or '')} class="filediff-collapse-state" id="filediff-collapse-${h.FID(filediff.raw_id, filediff.patch['filename'])}" type="checkbox" onchange="updateSticky();">
+        <div
+            class="filediff"
+            data-f-path="${filediff.patch['filename']}"
+            data-anchor-id="${h.FID(filediff.raw_id, filediff.patch['filename'])}"
+        >
+        <label for="filediff-collapse-${h.FID(filediff.raw_id, filediff.patch['filename'])}" class="filediff-heading">
+            <div class="filediff-collapse-indicator"></div>
+            ${diff_ops(filediff)}
+        </label>
+        <table class="cb cb-diff-${c.user_session_attrs["diffmode"]} code-highlight">
+            <tr class="cb-warning">
+                <td class="cb-text cb-lazy-load-status" ${(c.user_session_attrs["diffmode"] == 'unified' and 'colspan=4' or 'colspan=6')}>
+                    ${_('Loading the diff of this file...')}
+                </td>
+            </tr>
+        </table>
+        </div>
+    </div>
 </%def>
 
 <%def name="diff_ops(filediff)">
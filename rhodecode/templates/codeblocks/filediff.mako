@@ -0,0 +1,6 @@
+## diff of a single file, loaded by the pages which render only the diffs of
+## the first files of a diffset, see `render_diffset`
+<%namespace name="cbdiffs" file="/codeblocks/diffs.mako"/>
+${cbdiffs.render_filediff(
+  c.filediff, use_comments=c.use_comments,
+  inline_comments=c.inline_comments)}
@@ -557,7 +557,9 @@
                           collapse_when_files_over=30,
                           disable_new_comments=not c.allowed_to_comment,
                           deleted_files_comments=c.deleted_files_comments,
-                          inline_comments=c.inline_comments)}
+                          inline_comments=c.inline_comments,
+                          lazy_load_files_over=c.visual.lazy_load_diff_files_over,
+                          lazy_load_url=c.lazy_load_url)}
                     % endif
 
                 </div>
@@ -109,6 +109,8 @@ class TestSanitizeVcsSettings(object):
     _bool_settings = [
         ('vcs.hooks.direct_calls', False),
         ('vcs.server.enable', True),
+        ('vcs.server.batch_calls', False),
+        ('vcs.git.commit_index', True),
         ('vcs.start_server', False),
         ('startup.import_repos', False),
     ]
@@ -122,6 +124,7 @@ class TestSanitizeVcsSettings(object):
         ('vcs.server', ''),
         ('vcs.server.log_level', 'debug'),
         ('vcs.server.protocol', 'http'),
+        ('vcs.server.compression', ''),
     ]
 
     _list_settings = [
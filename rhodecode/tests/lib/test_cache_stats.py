@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+import pytest
+
+from rhodecode.lib import rc_cache
+from rhodecode.lib.rc_cache import stats
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = stats.CacheStatsRegistry()
+    monkeypatch.setattr(stats, 'cache_stats_registry', registry)
+    return registry
+
+
+@pytest.mark.parametrize('namespace, expected', [
+    (None, 'default'),
+    ('cache_repo.42', 'cache_repo.*'),
+    ('cache_user_auth.7', 'cache_user_auth.*'),
+    ('repo_cache:1', 'repo_cache:*'),
+    ('cache_perms', 'cache_perms'),
+])
+def test_get_namespace_name(namespace, expected):
+    assert stats.get_namespace_name(namespace) == expected
+
+
+def test_cached_function_records_hits_and_misses(registry, tmpdir):
+    region = rc_cache.make_region(name='cache_repo:cache_repo.1').configure(
+        'dogpile.cache.rc.sqlite',
+        arguments={'filename': str(tmpdir.join('cache_repo'))})
+
+    @region.conditional_cache_on_arguments(namespace='cache_repo.1')
+    def compute(arg):
+        return 'x' * 100
+
+    compute(1)
+    compute(1)
+    compute(2)
+    compute.refresh(1)
+
+    data, = registry.get_stats()
+    assert data['region'] == 'cache_repo'
+    assert data['namespace'] == 'cache_repo.*'
+    assert data['function'] == 'compute'
+    assert (data['hits'], data['misses']) == (1, 3)
+    assert data['max_value_bytes'] > 100
+    assert registry.get_region_stats()['cache_repo']['hit_ratio'] == 0.25
+
+
+def test_values_of_memory_regions_are_not_measured(registry):
+    region = rc_cache.make_region(name='cache_repo_longterm').configure(
+        'dogpile.cache.rc.memory_lru')
+
+    @region.conditional_cache_on_arguments(namespace='cache_repo_instance.1')
+    def compute():
+        return object()
+
+    compute()
+
+    data, = registry.get_stats()
+    assert data['misses'] == 1
+    assert data['max_value_bytes'] == 0
+
+
+def test_value_sizes_of_nested_functions(registry, tmpdir):
+    region = rc_cache.make_region(name='cache_perms').configure(
+        'dogpile.cache.rc.sqlite',
+        arguments={'filename': str(tmpdir.join('cache_perms'))})
+    memory_region = rc_cache.make_region(name='cache_repo_longterm').configure(
+        'dogpile.cache.rc.memory_lru')
+
+    @region.conditional_cache_on_arguments(namespace='cache_perms')
+    def inner():
+        return 'x' * 100
+
+    @memory_region.conditional_cache_on_arguments(namespace='cache_repo.1')
+    def outer():
+        return [inner()]
+
+    outer()
+
+    sizes = dict((data['function'], data['max_value_bytes'])
+                 for data in registry.get_stats())
+    assert sizes['inner'] > 100
+    # stored by the memory region as it is
+    assert sizes['outer'] == 0
+
+
+def test_disabled_cache_is_not_recorded(registry):
+    region = rc_cache.make_region().configure('dogpile.cache.memory')
+
+    @region.conditional_cache_on_arguments(condition=False)
+    def compute():
+        return 1
+
+    compute()
+
+    assert registry.get_stats() == []
+
+
+def test_request_stats(registry):
+    request_stats = stats.start_request()
+    stats.record('cache_perms', 'cache_user_auth.*', 'compute', hit=True)
+    stats.record('cache_perms', 'cache_user_auth.*', 'compute', hit=False,
+                 compute_time=0.5)
+    assert stats.end_request() is request_stats
+
+    assert request_stats.count == 2
+    assert request_stats.summary() == \
+        'cache_perms hits:1 misses:1 compute:0.500s'
+    # lookups outside of requests only go to the registry
+    stats.record('cache_perms', 'cache_user_auth.*', 'compute', hit=True)
+    assert request_stats.count == 2
@@ -18,11 +18,19 @@
 # RhodeCode Enterprise Edition, including its added features, Support services,
 # and proprietary license terms, please see https://rhodecode.com/licenses/
 
+import os
+import json
 import time
+import threading
+import cPickle as pickle
 
+import mock
 import pytest
+from dogpile.cache.api import CachedValue
 
 from rhodecode.lib import rc_cache
+from rhodecode.lib.rc_cache import generations, serializers
+from rhodecode.lib.rc_cache.serializers import CacheSerializer
 
 
 @pytest.mark.usefixtures('app')
@@ -106,3 +114,716 @@ class TestCaches(object):
         # once computed we have only one value (the same from cache)
         # after executing it 10x
         assert len(result) == 1
+
+
+@pytest.fixture
+def repo_cache_region(monkeypatch):
+    from rhodecode.lib.rc_cache import region_meta, make_region
+    region = make_region().configure(
+        'dogpile.cache.memory', expiration_time=60)
+    monkeypatch.setitem(region_meta.dogpile_cache_regions, 'cache_repo', region)
+    return region
+
+
+class TestRefsSnapshot(object):
+    refs = {'refs/heads/master': 'a' * 40}
+    pushed_refs = {'refs/heads/master': 'b' * 40}
+
+    def test_get_without_snapshot(self, repo_cache_region):
+        assert rc_cache.RefsSnapshot(1).get() is None
+
+    def test_set_stores_first_snapshot(self, repo_cache_region):
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.set(self.refs, bump=False)
+
+        assert snapshot.get() == self.refs
+        assert rc_cache.RefsSnapshot(2).get() is None
+
+    def test_set_without_bump_keeps_current_snapshot(self, repo_cache_region):
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.set(self.pushed_refs)
+        snapshot.set(self.refs, bump=False)
+
+        assert snapshot.get() == self.pushed_refs
+
+    def test_bump_replaces_snapshot(self, repo_cache_region):
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.set(self.refs)
+        snapshot.set(self.pushed_refs)
+
+        assert snapshot.get() == self.pushed_refs
+        old_key = snapshot._get_snapshot_key(
+            snapshot.compute_version(self.refs))
+        assert repo_cache_region.get(old_key) is rc_cache.utils.NO_VALUE
+
+    def test_invalidate(self, repo_cache_region):
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.set(self.refs)
+        snapshot.invalidate()
+
+        assert snapshot.get() is None
+
+    def test_keys_are_in_repo_namespace(self, repo_cache_region):
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.set(self.refs)
+        keys = [snapshot.version_key, snapshot._get_snapshot_key(
+            snapshot.compute_version(self.refs))]
+
+        assert all(key.startswith('cache_repo.1:') for key in keys)
+
+    def test_disabled_region(self, monkeypatch):
+        from rhodecode.lib.rc_cache import region_meta
+        monkeypatch.delitem(
+            region_meta.dogpile_cache_regions, 'cache_repo', raising=False)
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.set(self.refs)
+
+        assert snapshot.get() is None
+
+    def test_get_or_fetch_uses_snapshot(
+            self, repo_cache_region, generation_store):
+        snapshot = rc_cache.RefsSnapshot(1)
+        assert snapshot.get_or_fetch(lambda: self.refs) == self.refs
+
+        fetch = mock.Mock(return_value=self.pushed_refs)
+        assert snapshot.get_or_fetch(fetch) == self.refs
+        assert not fetch.called
+
+    def test_get_or_fetch_after_invalidation_on_other_node(
+            self, repo_cache_region, generation_store):
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.get_or_fetch(lambda: self.refs)
+        # the push was handled by another node, the snapshot of this node
+        # wasn't bumped
+        generation_store.bump(snapshot.invalidation_namespace)
+
+        assert snapshot.get_or_fetch(lambda: self.pushed_refs) == \
+            self.pushed_refs
+        assert snapshot.get() == self.pushed_refs
+
+    def test_get_or_fetch_failure(self, repo_cache_region, generation_store):
+        snapshot = rc_cache.RefsSnapshot(1)
+        snapshot.get_or_fetch(lambda: self.refs)
+        generation_store.bump(snapshot.invalidation_namespace)
+
+        with pytest.raises(ValueError):
+            snapshot.get_or_fetch(mock.Mock(side_effect=ValueError))
+        assert snapshot.get_or_fetch(lambda: self.pushed_refs) == \
+            self.pushed_refs
+
+
+@pytest.fixture
+def generation_store(monkeypatch):
+    from rhodecode.lib.rc_cache import region_meta
+    store = generations.MemoryGenerationStore()
+    monkeypatch.setattr(region_meta, 'generation_store', store)
+    generations.seen_generations.clear()
+    generations.namespace_generations.clear()
+    yield store
+    generations.seen_generations.clear()
+    generations.namespace_generations.clear()
+
+
+@pytest.fixture
+def shared_generation_store(generation_store, monkeypatch):
+    # stands in for the redis store shared by all nodes
+    monkeypatch.setattr(generation_store, 'shared', True, raising=False)
+    return generation_store
+
+
+class TestFileGenerationStore(object):
+
+    def test_get_unknown_namespace(self, tmpdir):
+        store = generations.FileGenerationStore(str(tmpdir.join('gen')))
+        assert store.get('repo_cache:1') == 0
+
+    def test_bump(self, tmpdir):
+        store = generations.FileGenerationStore(str(tmpdir.join('gen')))
+        assert store.bump('repo_cache:1') == 1
+        assert store.bump('repo_cache:1') == 2
+
+        # shared by all stores of the same directory
+        other_store = generations.FileGenerationStore(str(tmpdir.join('gen')))
+        assert other_store.get('repo_cache:1') == 2
+        assert other_store.get('repo_cache:2') == 0
+
+
+@pytest.mark.parametrize('settings, expected_store', [
+    ({}, type(None)),
+    ({'cache_invalidation.backend': 'database'}, type(None)),
+    ({'cache_invalidation.backend': 'file'},
+     generations.FileGenerationStore),
+])
+def test_configure_generation_store(
+        tmpdir, monkeypatch, settings, expected_store):
+    from rhodecode.lib.rc_cache import region_meta
+    monkeypatch.setattr(region_meta, 'generation_store', None)
+    settings['cache_invalidation.path'] = str(tmpdir.join('gen'))
+
+    generations.configure_generation_store(settings)
+    assert isinstance(region_meta.generation_store, expected_store)
+
+
+class TestGenerationInvalidation(object):
+
+    def _compute(self, namespace='repo_cache:1'):
+        inv_context_manager = rc_cache.InvalidationContext(
+            uid='cache_uid', invalidation_namespace=namespace)
+        with inv_context_manager as invalidation_context:
+            return invalidation_context.should_invalidate()
+
+    def test_first_access_computes(self, generation_store):
+        assert self._compute() is True
+
+    def test_cache_is_active_after_compute(self, generation_store):
+        self._compute()
+        assert self._compute() is False
+
+    def test_bump_invalidates(self, generation_store):
+        self._compute()
+        generation_store.bump('repo_cache:1')
+
+        assert self._compute() is True
+        assert self._compute() is False
+
+    def test_bump_of_other_namespace(self, generation_store):
+        self._compute()
+        generation_store.bump('repo_cache:2')
+
+        assert self._compute() is False
+
+    def test_set_invalidate_bumps_generation(self, generation_store):
+        from rhodecode.model.db import CacheKey
+        CacheKey.set_invalidate('repo_cache:1')
+
+        assert generation_store.get('repo_cache:1') == 1
+
+    def test_failed_compute_is_not_marked_active(self, generation_store):
+        with pytest.raises(ValueError):
+            with rc_cache.InvalidationContext(
+                    uid='cache_uid', invalidation_namespace='repo_cache:1'):
+                raise ValueError('compute failed')
+
+        assert self._compute() is True
+
+
+class FakeRedisClient(object):
+    def __init__(self):
+        self.data = {}
+        self.published = []
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+@pytest.fixture
+def layered_backend():
+    from rhodecode.lib.rc_cache.backends import LayeredRedisBackend
+    backend = LayeredRedisBackend({'l1_max_size': 10, 'db': 3})
+    backend.client = FakeRedisClient()
+    # don't start the listener thread
+    backend._listener_pid = os.getpid()
+    return backend
+
+
+class TestLayeredRedisBackend(object):
+
+    def test_hits_are_served_from_l1(self, layered_backend):
+        layered_backend.set('key', 'value')
+        layered_backend.client.data.clear()
+
+        assert layered_backend.get('key') == 'value'
+
+    def test_misses_fall_through_to_redis(self, layered_backend):
+        layered_backend.set('key', 'value')
+        layered_backend._l1.clear()
+
+        assert layered_backend.get('key') == 'value'
+        assert layered_backend.get_multi(['key', 'other']) == [
+            'value', rc_cache.utils.NO_VALUE]
+
+    def test_changes_are_published(self, layered_backend):
+        layered_backend.set('key', 'value')
+        layered_backend.delete_multi(['key'])
+
+        channels = set(c for c, __ in layered_backend.client.published)
+        keys = [json.loads(m)['keys'] for __, m in layered_backend.client.published]
+        assert channels == {'rc_cache_l1_invalidate:3'}
+        assert keys == [['key'], ['key']]
+
+    def test_messages_of_other_processes_invalidate_l1(self, layered_backend):
+        layered_backend.set('key', 'value')
+        layered_backend.client.data.clear()
+        layered_backend._on_message({
+            'type': 'message',
+            'data': json.dumps({'sender': 'other', 'keys': ['key']})})
+
+        assert layered_backend.get('key') is rc_cache.utils.NO_VALUE
+
+    def test_own_messages_are_ignored(self, layered_backend):
+        layered_backend.set('key', 'value')
+        __, message = layered_backend.client.published[-1]
+        layered_backend._on_message({'type': 'message', 'data': message})
+
+        assert layered_backend._l1_get('key') == 'value'
+
+    def test_l1_entries_expire(self, layered_backend):
+        layered_backend.set('key', 'value')
+        layered_backend.client.data.clear()
+        layered_backend.l1_expiration_time = -1
+
+        assert layered_backend.get('key') is rc_cache.utils.NO_VALUE
+
+
+@pytest.fixture
+def sqlite_backend(tmpdir):
+    from rhodecode.lib.rc_cache.backends import SQLiteBackend
+    return SQLiteBackend({'filename': str(tmpdir.join('cache'))})
+
+
+class TestSQLiteBackend(object):
+
+    def test_set_and_get(self, sqlite_backend):
+        sqlite_backend.set('key', {'value': 1})
+
+        assert sqlite_backend.get('key') == {'value': 1}
+        assert sqlite_backend.get('missing') is rc_cache.utils.NO_VALUE
+        assert sqlite_backend.filename.endswith('cache.sqlite')
+
+    def test_multi(self, sqlite_backend):
+        sqlite_backend.set_multi({'a': 1, 'b': 2})
+        sqlite_backend.delete_multi(['a'])
+
+        assert sqlite_backend.get_multi(['a', 'b']) == [
+            rc_cache.utils.NO_VALUE, 2]
+
+    def test_list_keys(self, sqlite_backend):
+        sqlite_backend.set_multi({'ns1:a': 1, 'ns1:b': 2, 'ns2:a': 3})
+
+        assert sorted(sqlite_backend.list_keys(prefix='ns1:')) == [
+            'ns1:a', 'ns1:b']
+        assert len(sqlite_backend.list_keys()) == 3
+
+    def test_shared_between_instances(self, sqlite_backend):
+        from rhodecode.lib.rc_cache.backends import SQLiteBackend
+        sqlite_backend.set('key', 'value')
+        other = SQLiteBackend({'filename': sqlite_backend.filename})
+
+        assert other.get('key') == 'value'
+
+    def test_expiration(self, sqlite_backend):
+        sqlite_backend.expiration_time = -1
+        sqlite_backend.set('key', 'value')
+
+        assert sqlite_backend.get('key') is rc_cache.utils.NO_VALUE
+        sqlite_backend.cull()
+        assert sqlite_backend.list_keys() == []
+
+    def test_cull_evicts_least_recently_used(self, sqlite_backend):
+        sqlite_backend.lru_update_interval = 0
+        for key in ['a', 'b', 'c']:
+            sqlite_backend.set(key, 'x' * 100)
+            time.sleep(0.01)
+        # reading `a` makes `b` the least recently used value
+        sqlite_backend.get('a')
+
+        sqlite_backend.max_size_bytes = 250
+        sqlite_backend.cull()
+
+        assert sorted(sqlite_backend.list_keys()) == ['a', 'c']
+
+    def _stored_size(self, sqlite_backend):
+        with sqlite_backend._connection() as conn:
+            return conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+
+    def test_total_size_follows_writes(self, sqlite_backend):
+        sqlite_backend.set_multi({'a': 'x' * 10, 'b': 'x' * 100})
+        sqlite_backend.set('a', 'x' * 1000)
+        sqlite_backend.delete('b')
+        assert sqlite_backend.get_total_size() == self._stored_size(
+            sqlite_backend)
+
+        sqlite_backend.expiration_time = -1
+        sqlite_backend.set('c', 'x' * 100)
+        sqlite_backend.cull()
+        sqlite_backend.max_size_bytes = 1
+        sqlite_backend.cull()
+        assert sqlite_backend.list_keys() == []
+        assert sqlite_backend.get_total_size() == 0
+
+    def test_total_size_of_existing_database(self, tmpdir):
+        import sqlite3
+        from rhodecode.lib.rc_cache.backends import SQLiteBackend
+        filename = str(tmpdir.join('cache.sqlite'))
+        conn = sqlite3.connect(filename)
+        with conn:
+            conn.execute(
+                'CREATE TABLE cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'size INTEGER NOT NULL, accessed REAL NOT NULL, expires REAL)')
+            conn.execute(
+                "INSERT INTO cache VALUES ('a', 'x', 42, 0, NULL)")
+        conn.close()
+
+        backend = SQLiteBackend({'filename': filename})
+        assert backend.get_total_size() == 42
+
+    def test_connection_is_shared_by_threads(self, sqlite_backend):
+        connections = []
+
+        def get_connection():
+            with sqlite_backend._connection() as conn:
+                connections.append(conn)
+
+        get_connection()
+        worker = threading.Thread(target=get_connection)
+        worker.start()
+        worker.join()
+        assert connections[0] is connections[1]
+
+    def test_forked_worker_connects_again(self, sqlite_backend, monkeypatch):
+        with sqlite_backend._connection() as conn:
+            pass
+        monkeypatch.setattr(sqlite_backend, '_conn_pid', -1)
+
+        with sqlite_backend._connection() as forked_conn:
+            assert forked_conn is not conn
+
+    def _lock_database(self, sqlite_backend):
+        import sqlite3
+        conn = sqlite3.connect(sqlite_backend.filename, isolation_level=None)
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    def test_write_waits_cooperatively_for_lock(self, sqlite_backend):
+        import gevent
+        conn = self._lock_database(sqlite_backend)
+        released = gevent.spawn_later(0.1, conn.execute, 'COMMIT')
+
+        sqlite_backend.set('key', 'value')
+        # the lock was released by another greenlet while the write waited
+        assert released.successful()
+        assert sqlite_backend.get('key') == 'value'
+
+    def test_write_fails_after_busy_timeout(self, sqlite_backend):
+        import sqlite3
+        conn = self._lock_database(sqlite_backend)
+        sqlite_backend.busy_timeout = 0.1
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                sqlite_backend.set('key', 'value')
+        finally:
+            conn.execute('ROLLBACK')
+
+    def test_region(self, tmpdir):
+        region = rc_cache.make_region().configure(
+            'dogpile.cache.rc.sqlite', expiration_time=60,
+            arguments={'filename': str(tmpdir.join('region'))})
+
+        @region.cache_on_arguments()
+        def compute(x):
+            return time.time()
+
+        assert compute(1) == compute(1)
+
+    def test_mutex_is_shared_by_workers(self, tmpdir):
+        backend = rc_cache.backends.SQLiteBackend(
+            {'filename': str(tmpdir.join('cache'))})
+        other_backend = rc_cache.backends.SQLiteBackend(
+            {'filename': str(tmpdir.join('cache'))})
+        mutex = backend.get_mutex('key')
+        assert mutex.acquire(False)
+        try:
+            result = []
+            worker = threading.Thread(target=lambda: result.append(
+                other_backend.get_mutex('key').acquire(False)))
+            worker.start()
+            worker.join()
+            assert result == [False]
+        finally:
+            mutex.release()
+
+
+def wait_for_revalidation():
+    for worker in threading.enumerate():
+        if worker.name == 'rc_cache_revalidate':
+            worker.join()
+
+
+class TestStaleWhileRevalidate(object):
+
+    @pytest.fixture
+    def region(self):
+        return rc_cache.make_region(
+            async_creation_runner=rc_cache.background_creation_runner
+        ).configure('dogpile.cache.rc.memory_lru', expiration_time=60)
+
+    def make_function(self, region, results):
+        @region.conditional_cache_on_arguments(namespace='swr')
+        def compute(x):
+            return results.pop(0)
+        return compute
+
+    def test_expired_value_is_served_while_recomputed(self, region):
+        compute = self.make_function(region, ['old', 'new'])
+        assert compute(1) == 'old'
+        region._expire(compute.key_generator(1))
+
+        assert compute(1) == 'old'
+        wait_for_revalidation()
+        assert compute(1) == 'new'
+
+    def test_refresh_serves_current_value(self, region):
+        compute = self.make_function(region, ['old', 'new'])
+        assert compute(1) == 'old'
+
+        assert compute.refresh(1) == 'old'
+        wait_for_revalidation()
+        assert compute(1) == 'new'
+
+    def test_refresh_without_value_computes(self, region):
+        compute = self.make_function(region, ['new'])
+        assert compute.refresh(1) == 'new'
+        assert compute(1) == 'new'
+
+    def test_refresh_of_values_which_never_expire(self):
+        region = rc_cache.make_region(
+            async_creation_runner=rc_cache.background_creation_runner
+        ).configure('dogpile.cache.rc.memory_lru')
+        compute = self.make_function(region, ['old', 'new'])
+        assert compute(1) == 'old'
+        assert compute.refresh(1) == 'new'
+
+    def test_revalidated_value_is_not_recomputed(self, region):
+        region.set('key', 'new')
+        stale_ct = 0
+
+        def creator():
+            raise AssertionError('value is computed again')
+
+        rc_cache.utils._revalidate(region, 'key', creator, stale_ct)
+        assert region.get('key') == 'new'
+
+    def test_failed_computation_drops_value(self, region):
+        region.set('key', 'old')
+        region._expire('key')
+
+        def creator():
+            raise ValueError('failed')
+
+        rc_cache.utils._revalidate(region, 'key', creator, 0)
+        assert region.get('key', ignore_expiration=True) is \
+            rc_cache.utils.NO_VALUE
+
+    def test_value_is_computed_after_failed_revalidation(self, region):
+        results = ['old', ValueError('failed'), 'new']
+
+        @region.conditional_cache_on_arguments(namespace='swr')
+        def compute(x):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        assert compute(1) == 'old'
+        assert compute.refresh(1) == 'old'
+        wait_for_revalidation()
+        assert compute(1) == 'new'
+
+    def test_creator_runs_with_request_of_stale_lookup(self, region):
+        from pyramid import threadlocal
+        request = mock.Mock()
+        results = ['old']
+
+        @region.conditional_cache_on_arguments(namespace='swr')
+        def compute(x):
+            if results:
+                return results.pop(0)
+            return threadlocal.get_current_request()
+
+        assert compute(1) == 'old'
+        threadlocal.manager.push({'request': request, 'registry': None})
+        try:
+            assert compute.refresh(1) == 'old'
+        finally:
+            threadlocal.manager.pop()
+        wait_for_revalidation()
+        assert compute(1) is request
+
+
+class TestClearCacheNamespace(object):
+
+    def make_sqlite_region(self, tmpdir, monkeypatch, **arguments):
+        from rhodecode.lib.rc_cache import region_meta
+        arguments['filename'] = str(tmpdir.join('region'))
+        region = rc_cache.make_region(
+            name='cache_perms', function_key_generator=rc_cache.key_generator
+        ).configure(
+            'dogpile.cache.rc.sqlite', expiration_time=60,
+            arguments=arguments)
+        monkeypatch.setitem(
+            region_meta.dogpile_cache_regions, 'cache_perms', region)
+        return region
+
+    @pytest.fixture
+    def sqlite_region(self, tmpdir, monkeypatch):
+        return self.make_sqlite_region(
+            tmpdir, monkeypatch, sqlite_expiration_time=3600)
+
+    def make_function(self, region, namespace):
+        @region.conditional_cache_on_arguments(namespace=namespace)
+        def compute(x):
+            return time.time()
+        return compute
+
+    def test_clearing_bumps_generation(
+            self, sqlite_region, shared_generation_store):
+        compute = self.make_function(sqlite_region, 'cache_user_auth.1')
+        other = self.make_function(sqlite_region, 'cache_user_auth.2')
+        value, other_value = compute(1), other(1)
+
+        assert rc_cache.clear_cache_namespace(
+            'cache_perms', 'cache_user_auth.1') is None
+
+        assert compute(1) != value
+        assert other(1) == other_value
+        assert compute.key_generator(1).startswith('cache_user_auth.1:g1:')
+
+    def test_keys_of_first_generation(
+            self, sqlite_region, shared_generation_store):
+        compute = self.make_function(sqlite_region, 'cache_user_auth.1')
+        assert compute.key_generator(1).startswith('cache_user_auth.1:compute_')
+
+    def test_generations_are_read_once_per_ttl(
+            self, sqlite_region, shared_generation_store, monkeypatch):
+        compute = self.make_function(sqlite_region, 'cache_user_auth.1')
+        compute(1)
+        # cleared by another process
+        shared_generation_store.bump(
+            'cache_namespace:cache_perms:cache_user_auth.1')
+        assert compute.key_generator(1).startswith('cache_user_auth.1:compute_')
+
+        monkeypatch.setattr(generations.namespace_generations, 'ttl', -1)
+        assert compute.key_generator(1).startswith('cache_user_auth.1:g1:')
+
+    def test_clearing_with_node_local_generation_store(
+            self, sqlite_region, generation_store):
+        generation_store.bump('cache_namespace:cache_perms:cache_user_auth.1')
+        compute = self.make_function(sqlite_region, 'cache_user_auth.1')
+        value = compute(1)
+
+        assert rc_cache.clear_cache_namespace(
+            'cache_perms', 'cache_user_auth.1') == 1
+        assert compute(1) != value
+        assert compute.key_generator(1).startswith('cache_user_auth.1:compute_')
+
+    def test_clearing_values_which_dont_expire(
+            self, tmpdir, monkeypatch, shared_generation_store):
+        region = self.make_sqlite_region(tmpdir, monkeypatch)
+        compute = self.make_function(region, 'cache_user_auth.1')
+        value = compute(1)
+
+        assert rc_cache.clear_cache_namespace(
+            'cache_perms', 'cache_user_auth.1') == 1
+        assert compute(1) != value
+
+    def test_clearing_without_generation_store(
+            self, sqlite_region, monkeypatch):
+        from rhodecode.lib.rc_cache import region_meta
+        monkeypatch.setattr(region_meta, 'generation_store', None)
+        compute = self.make_function(sqlite_region, 'cache_user_auth.1')
+        value = compute(1)
+
+        assert rc_cache.clear_cache_namespace(
+            'cache_perms', 'cache_user_auth.1') == 1
+        assert compute(1) != value
+
+    def test_file_namespace_regions_delete_keys(
+            self, tmpdir, monkeypatch, generation_store):
+        from rhodecode.lib.rc_cache import region_meta
+        monkeypatch.setattr(region_meta, 'dogpile_cache_regions', {})
+        monkeypatch.setitem(
+            region_meta.dogpile_config_defaults, 'cache_dir', str(tmpdir))
+        region_meta.dogpile_cache_regions['cache_perms'] = rc_cache.make_region(
+        ).configure('dogpile.cache.rc.file_namespace', expiration_time=60,
+                    arguments={'filename': str(tmpdir.join('cache_perms'))})
+        region = rc_cache.get_or_create_region(
+            'cache_perms', 'cache_user_auth.1')
+        compute = self.make_function(region, 'cache_user_auth.1')
+        compute(1)
+        compute(2)
+
+        assert rc_cache.clear_cache_namespace(
+            'cache_perms', 'cache_user_auth.1') == 2
+        assert region.backend.list_keys() == []
+
+
+class TestCacheSerializer(object):
+    plain_value = {u'name': u'ąć', 'raw': 'x' * 2000, 'items': [1, 2.5, None]}
+
+    @pytest.mark.parametrize('format_name', ['pickle', 'msgpack'])
+    @pytest.mark.parametrize('compression', [None, 'zlib'])
+    @pytest.mark.parametrize('value', [
+        plain_value,
+        {'set': {1, 2}, 'tuple': (1, 2)},
+        CachedValue({u'a': [1]}, {'ct': 1.5, 'v': 1}),
+        CachedValue({'set': {1}}, {'ct': 1.5, 'v': 1}),
+    ])
+    def test_round_trip(self, format_name, compression, value):
+        serializer = CacheSerializer(format_name, compression=compression)
+        loaded = serializer.loads(serializer.dumps(value))
+
+        assert loaded == value
+        assert type(loaded) == type(value)
+
+    def test_msgpack_keeps_str_and_unicode(self):
+        serializer = CacheSerializer('msgpack')
+        loaded = serializer.loads(serializer.dumps(self.plain_value))
+
+        assert isinstance(loaded['raw'], str)
+        assert isinstance(loaded[u'name'], unicode)
+
+    def test_compression_threshold(self):
+        serializer = CacheSerializer(
+            'msgpack', compression='zlib', compression_min_size=1024)
+
+        assert len(serializer.dumps(self.plain_value)) < 100
+        assert len(serializer.dumps({'small': 'x'})) > len('x')
+        assert serializer.dumps({'small': 'x'})[0] == chr(
+            serializers.FORMAT_MSGPACK)
+
+    def test_loads_values_of_older_versions(self):
+        serializer = CacheSerializer('msgpack', compression='zlib')
+
+        for protocol in (0, 2):
+            data = pickle.dumps(self.plain_value, protocol)
+            assert serializer.loads(data) == self.plain_value
+
+    def test_unknown_serializer(self):
+        with pytest.raises(ValueError):
+            CacheSerializer('json')
+
+    def test_region_arguments(self, tmpdir):
+        region = rc_cache.make_region().configure(
+            'dogpile.cache.rc.sqlite', expiration_time=60,
+            arguments={'filename': str(tmpdir.join('region')),
+                       'serializer': 'msgpack', 'compression': 'zlib'})
+        region.set('key', self.plain_value)
+
+        backend = region.actual_backend
+        assert backend.serializer_arguments == {
+            'serializer': 'msgpack', 'compression': 'zlib'}
+        assert region.get('key') == self.plain_value
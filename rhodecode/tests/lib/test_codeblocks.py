@@ -18,13 +18,15 @@
 # RhodeCode Enterprise Edition, including its added features, Support services,
 # and proprietary license terms, please see https://rhodecode.com/licenses/
 
+import mock
 import pytest
 from pygments.lexers import get_lexer_by_name
 
 from rhodecode.tests import no_newline_id_generator
 from rhodecode.lib.codeblocks import (
-    tokenize_string, split_token_stream, rollup_tokenstream,
-    render_tokenstream)
+    tokenize_string, tokenize_lines, split_token_stream, rollup_tokenstream,
+    render_tokenstream, filenode_as_lines_tokens, LinesTokensCache)
+from rhodecode.lib.vcs.nodes import FileNode
 
 
 class TestTokenizeString(object):
@@ -78,6 +80,84 @@ class TestTokenizeString(object):
         ]
 
 
+class TestTokenizeLines(object):
+
+    def test_tokenize_lines_as_python(self):
+        lexer = get_lexer_by_name('python')
+        lines = tokenize_lines(u'var = 6\nprint(var)\n', lexer)
+
+        assert lines == [
+            [('n', u'var'), ('', u' '), ('o', u'='), ('', u' '),
+             ('mi', u'6'), ('', u'')],
+            [('', u''), ('k', u'print'), ('p', u'('), ('n', u'var'),
+             ('p', u')'), ('', u'')],
+            [('', u'')],
+        ]
+
+    def test_tokenize_lines_as_text(self):
+        lexer = get_lexer_by_name('text')
+        lines = tokenize_lines(u'var = 6\nprint(var)\n', lexer)
+
+        assert lines == [[('', u'var = 6')], [('', u'print(var)')], [('', u'')]]
+
+
+@pytest.fixture
+def highlight_cache_region(monkeypatch):
+    from rhodecode.lib.rc_cache import region_meta, make_region
+    region = make_region().configure('dogpile.cache.memory')
+    monkeypatch.setitem(
+        region_meta.dogpile_cache_regions, 'cache_highlight', region)
+    return region
+
+
+class TestLinesTokensCache(object):
+
+    def test_tokens_are_cached_by_content(self, highlight_cache_region):
+        lexer = get_lexer_by_name('python')
+        node = FileNode('old/name.py', content='var = 6\n')
+        renamed_node = FileNode('new/name.py', content='var = 6\n')
+
+        with mock.patch('rhodecode.lib.codeblocks.tokenize_lines',
+                        wraps=tokenize_lines) as tokenize:
+            lines = filenode_as_lines_tokens(node, lexer)
+            assert filenode_as_lines_tokens(renamed_node, lexer) == lines
+            assert LinesTokensCache(renamed_node, lexer).get() == lines
+        assert tokenize.call_count == 1
+
+    def test_tokens_are_cached_by_lexer(self, highlight_cache_region):
+        node = FileNode('name.py', content='var = 6\n')
+        python_cache = LinesTokensCache(node, get_lexer_by_name('python'))
+        python_cache.compute()
+
+        assert python_cache.get() is not None
+        assert LinesTokensCache(node, get_lexer_by_name('ruby')).get() is None
+
+    def test_set(self, highlight_cache_region):
+        lexer = get_lexer_by_name('python')
+        node = FileNode('name.py', content='var = 6\n')
+        LinesTokensCache(node, lexer).set([[('n', u'cached')]])
+
+        assert filenode_as_lines_tokens(node, lexer) == [[('n', u'cached')]]
+
+    def test_plain_text_is_not_cached(self, highlight_cache_region):
+        node = FileNode('name.txt', content='var = 6\n')
+        cache = LinesTokensCache(node, get_lexer_by_name('text'))
+        cache.compute()
+
+        assert cache.get() is None
+
+    def test_without_region(self):
+        node = FileNode('name.py', content='var = 6\n')
+        cache = LinesTokensCache(node, get_lexer_by_name('python'))
+
+        assert cache.compute() == [
+            [('n', u'var'), ('', u' '), ('o', u'='), ('', u' '),
+             ('mi', u'6'), ('', u'')],
+            [('', u'')],
+        ]
+        assert cache.get() is None
+
+
 class TestSplitTokenStream(object):
 
     def test_split_token_stream(self):
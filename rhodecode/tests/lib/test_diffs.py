@@ -18,6 +18,9 @@
 # RhodeCode Enterprise Edition, including its added features, Support services,
 # and proprietary license terms, please see https://rhodecode.com/licenses/
 
+import bz2
+import os
+import cPickle as pickle
 import textwrap
 
 import mock
@@ -25,15 +28,17 @@ import pytest
 
 from rhodecode.lib.codeblocks import DiffSet
 from rhodecode.lib.diffs import (
-    DiffProcessor,
+    DiffProcessor, CURRENT_DIFF_VERSION, cache_diff, load_cached_diff,
+    load_cached_diff_file,
     NEW_FILENODE, DEL_FILENODE, MOD_FILENODE, RENAMED_FILENODE,
     CHMOD_FILENODE, BIN_FILENODE, COPIED_FILENODE)
-from rhodecode.lib.utils2 import AttributeDict
+from rhodecode.lib.utils2 import AttributeDict, StrictAttributeDict
 from rhodecode.lib.vcs.backends.git import GitCommit
 from rhodecode.tests.fixture import Fixture, no_newline_id_generator
 from rhodecode.lib.vcs.backends.git.repository import GitDiff
 from rhodecode.lib.vcs.backends.hg.repository import MercurialDiff
 from rhodecode.lib.vcs.backends.svn.repository import SubversionDiff
+from rhodecode.lib.vcs.nodes import FileNode
 
 fixture = Fixture()
 
@@ -790,6 +795,74 @@ def test_diff_over_limit(request):
     assert diffset.files[1].limited_diff is False
 
 
+def stream_diff(diff, chunk_size=7):
+    raw = diff.raw
+    return type(diff)(
+        raw[pos:pos + chunk_size] for pos in xrange(0, len(raw), chunk_size))
+
+
+def test_diff_lib_streamed(diff_fixture):
+    diff, expected_data = diff_fixture
+    prepared = DiffProcessor(diff, format='newdiff').prepare()
+
+    patches = DiffProcessor(stream_diff(diff), format='newdiff').iter_patches()
+    streamed = sorted(patches, key=DiffProcessor.patch_sort_key)
+    assert streamed == prepared
+
+
+def test_streamed_diff_is_read_once():
+    diff = stream_diff(GitDiff(fixture.load_resource('git_diff_mod_single_binary_file.diff')))
+    list(diff.chunks())
+    with pytest.raises(ValueError):
+        diff.raw
+
+
+def test_diff_over_limit_streamed():
+    raw_diff = fixture.load_resource('large_diff.diff')
+    diff_processor = DiffProcessor(
+        stream_diff(GitDiff(raw_diff), chunk_size=100), format='newdiff',
+        diff_limit=1024, file_limit=1024, show_full_diff=False)
+    patchset = diff_processor.iter_patches()
+
+    commit1 = GitCommit(repository=mock.Mock(), raw_id='abcdef12', idx=1)
+    commit2 = GitCommit(repository=mock.Mock(), raw_id='abcdef34', idx=2)
+    diffset = DiffSet(
+        repo_name='repo_name',
+        source_node_getter=lambda *a, **kw: AttributeDict({'commit': commit1}),
+        target_node_getter=lambda *a, **kw: AttributeDict({'commit': commit2})
+    )
+    diffset = diffset.render_patchset(patchset, commit1, commit2)
+
+    assert diffset.limited_diff is True
+    assert [f.patch['filename'] for f in diffset.files] == [
+        'example.go', 'README.md']
+    assert diffset.files[0].limited_diff is True
+    assert diffset.files[1].limited_diff is False
+
+
+def test_streamed_patches_are_filtered():
+    raw_diff = fixture.load_resource('large_diff.diff')
+    patchset = DiffProcessor(
+        GitDiff(raw_diff), format='newdiff').iter_patches()
+    patchset.filter(lambda filename: filename != 'README.md')
+
+    assert [patch['filename'] for patch in patchset] == ['example.go']
+    assert patchset.has_filtered
+
+
+@pytest.mark.parametrize('chunks, expected', [
+    ([''], [('\n', True)]),
+    (['diff --git a b\n'], [('', False), (' a b\n', True)]),
+    (['header\ndiff --git a\n', 'x\ndiff', ' --git b\n'],
+     [('\nheader', False), (' a\nx', False), (' b\n', True)]),
+    (['diff --', 'git a\n\n', 'diff --', 'git b'],
+     [('', False), (' a\n', False), (' b', True)]),
+])
+def test_split_diff_parts(chunks, expected):
+    from rhodecode.lib.vcs.backends.base import split_diff_parts
+    assert list(split_diff_parts(chunks)) == expected
+
+
 def test_diff_lib_newlines(diff_fixture_w_content):
     diff, expected_data = diff_fixture_w_content
     diff_proc = DiffProcessor(diff)
@@ -815,3 +888,106 @@ def test_diff_lib_newlines(diff_fixture_w_content):
 def test_splitlines(input_str):
     result = DiffProcessor.diff_splitter(input_str)
     assert list(result) == input_str.splitlines(True)
+
+
+def _make_cached_diffset(filenames):
+    files = []
+    for filename in filenames:
+        files.append(AttributeDict({
+            'patch': {'filename': filename, 'stats': {'added': 1}},
+            'source_filenode': None,
+            'target_filenode': None,
+            'hunks': [AttributeDict({'lines': ['+line of %s' % filename]})],
+            'diffset': StrictAttributeDict({'repo_name': 'repo_name'}),
+        }))
+    return AttributeDict({
+        'files': files, 'file_stats': {}, 'limited_diff': False,
+        'has_hidden_changes': False, 'lines_added': len(files)})
+
+
+class _SharedCommit(object):
+    """
+    Stands in for the commit the file nodes of a diff share, with the
+    content of its loaded nodes.
+    """
+
+    def __init__(self, size):
+        self.nodes_content = os.urandom(size)
+
+
+def _make_shared_commit_diffset(filenames, commit):
+    diffset = _make_cached_diffset(filenames)
+    for filediff in diffset.files:
+        filenode = FileNode(filediff.patch['filename'], commit=commit)
+        line = AttributeDict({
+            'original': AttributeDict({
+                'lineno': 1, 'action': '-',
+                'get_comment_args': (filenode, 'o', 1)}),
+            'modified': AttributeDict(),
+        })
+        filediff.source_filenode = filediff.target_filenode = filenode
+        filediff.hunks = [AttributeDict({
+            'lines': [line], 'sideside': [line],
+            'unified': [(1, None, '-', 'line', (filenode, 'o', 1))],
+        })]
+    return diffset
+
+
+class TestDiffCache(object):
+
+    def test_cache_and_load(self, tmpdir):
+        cache_file = str(tmpdir.join('diff'))
+        diffset = _make_cached_diffset(['a.py', 'b/c.py'])
+
+        cache_diff(cache_file, diffset, ('ancestor', {}, False, 'a', 'b'))
+        cached = load_cached_diff(cache_file)
+
+        assert cached['version'] == CURRENT_DIFF_VERSION
+        assert cached['commits'] == ('ancestor', {}, False, 'a', 'b')
+        assert cached['diff'] == diffset
+        assert cached['diff'].lines_added == 2
+        # the cached diffset is not modified
+        assert len(diffset.files) == 2
+        assert tmpdir.listdir() == [tmpdir.join('diff')]
+
+    def test_load_single_file(self, tmpdir):
+        cache_file = str(tmpdir.join('diff'))
+        diffset = _make_cached_diffset(['a.py', 'b/c.py', 'd.py'])
+        cache_diff(cache_file, diffset, None)
+
+        filediff = load_cached_diff_file(cache_file, 'b/c.py')
+        assert filediff == diffset.files[1]
+        assert filediff.hunks[0].lines == ['+line of b/c.py']
+        assert load_cached_diff_file(cache_file, 'missing.py') is None
+
+    def test_shared_commit_is_not_stored_per_file(self, tmpdir):
+        cache_file = tmpdir.join('diff')
+        commit = _SharedCommit(64 * 1024)
+        diffset = _make_shared_commit_diffset(
+            ['a.py', 'b.py', 'c.py', 'd.py'], commit)
+        cache_diff(str(cache_file), diffset, None)
+
+        assert cache_file.size() < len(commit.nodes_content)
+        filediff = load_cached_diff_file(str(cache_file), 'c.py')
+        assert filediff.source_filenode is None
+        assert filediff.target_filenode is None
+        hunk = filediff.hunks[0]
+        assert hunk.lines is hunk.sideside
+        assert hunk.sideside[0].original.get_comment_args == ('c.py', 'o', 1)
+        assert hunk.unified == [(1, None, '-', 'line', ('c.py', 'o', 1))]
+        # the rendered diffset keeps its file nodes
+        assert diffset.files[2].source_filenode.commit is commit
+
+    def test_load_missing_cache(self, tmpdir):
+        cache_file = str(tmpdir.join('diff'))
+        assert load_cached_diff(cache_file) == {
+            'version': CURRENT_DIFF_VERSION, 'diff': None, 'commits': None}
+        assert load_cached_diff_file(cache_file, 'a.py') is None
+
+    def test_cache_of_older_version_is_removed(self, tmpdir):
+        cache_file = tmpdir.join('diff')
+        with bz2.BZ2File(str(cache_file), 'wb') as f:
+            pickle.dump({'version': 'v4', 'diff': 'diff', 'commits': None}, f)
+
+        assert load_cached_diff(str(cache_file))['diff'] is None
+        assert not cache_file.check()
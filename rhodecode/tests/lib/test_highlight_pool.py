@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+import time
+
+import pytest
+
+from rhodecode.lib.highlight_pool import (
+    HighlightPool, configure_highlight_pool, get_highlight_pool)
+
+
+def add(a, b):
+    return a + b
+
+
+def fail():
+    raise ValueError('broken file')
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+@pytest.fixture
+def pool():
+    return HighlightPool(processes=2, timeout=1)
+
+
+class TestHighlightPool(object):
+
+    def test_submit_returns_result(self, pool):
+        tasks = [pool.submit(add, idx, 1) for idx in range(5)]
+        assert all(task.wait(10) for task in tasks)
+        assert [task.result for task in tasks] == [1, 2, 3, 4, 5]
+        assert [task.error for task in tasks] == [None] * 5
+
+    def test_failed_call_sets_error(self, pool):
+        task = pool.submit(fail)
+        assert task.wait(10)
+        assert task.result is None
+        assert 'broken file' in task.error
+
+    def test_timed_out_worker_is_replaced(self, pool):
+        slow_task = pool.submit(sleep, 30)
+        assert slow_task.wait(10)
+        assert 'took longer than 1s' in slow_task.error
+
+        tasks = [pool.submit(add, 1, 1) for __ in range(4)]
+        assert all(task.wait(10) for task in tasks)
+        assert [task.result for task in tasks] == [2] * 4
+
+    def test_cancelled_task_is_skipped(self):
+        pool = HighlightPool(processes=1, timeout=5)
+        slow_task = pool.submit(sleep, 0.5)
+        skipped_task = pool.submit(add, 1, 1)
+        assert not skipped_task.wait(10, queue_timeout=0)
+        assert not skipped_task.started
+        assert slow_task.wait(10)
+        time.sleep(0.5)
+        assert skipped_task.result is None
+
+    def test_timeout_starts_when_worker_picks_up_task(self):
+        pool = HighlightPool(processes=1, timeout=1)
+        slow_task = pool.submit(sleep, 30)
+        queued_task = pool.submit(add, 1, 1)
+        # queued for longer than the timeout, behind the slow task
+        assert queued_task.wait(1, queue_timeout=10)
+        assert queued_task.result == 2
+        assert slow_task.wait(0)
+        assert 'took longer than 1s' in slow_task.error
+
+    @pytest.mark.parametrize('processes, expected', [
+        ('0', None),
+        ('3', 3),
+    ])
+    def test_configure_highlight_pool(self, processes, expected):
+        configure_highlight_pool({
+            'highlight_pool.processes': processes,
+            'highlight_pool.timeout': '5'})
+        try:
+            pool = get_highlight_pool()
+            assert getattr(pool, 'processes', None) == expected
+        finally:
+            configure_highlight_pool({})
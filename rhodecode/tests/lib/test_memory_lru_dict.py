@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+
+import pytest
+from dogpile.cache.api import NO_VALUE
+
+from rhodecode.lib import rc_cache
+from rhodecode.lib.memory_lru_dict import SizedLRUDict, approximate_size
+
+
+def make_dict(max_bytes, max_entry_bytes=None):
+    # sizes are the length of the values to keep them predictable
+    return SizedLRUDict(max_bytes, max_entry_bytes=max_entry_bytes, get_size=len)
+
+
+class TestSizedLRUDict(object):
+
+    def test_set_and_get(self):
+        lru = make_dict(100)
+        lru['a'] = 'x' * 10
+        assert lru['a'] == 'x' * 10
+        assert lru.get('b') is None
+        assert lru.current_bytes == 10
+        with pytest.raises(KeyError):
+            lru['b']
+
+    def test_replacing_value_updates_size(self):
+        lru = make_dict(100)
+        lru['a'] = 'x' * 10
+        lru['a'] = 'x' * 30
+        assert lru.current_bytes == 30
+        assert len(lru) == 1
+
+    def test_evicts_least_recently_used(self):
+        lru = make_dict(100)
+        lru['a'] = 'x' * 40
+        lru['b'] = 'x' * 40
+        # reading `a` makes `b` the least recently used value
+        lru.get('a')
+        lru['c'] = 'x' * 40
+
+        assert sorted(lru.keys()) == ['a', 'c']
+        assert lru.current_bytes == 80
+        assert lru.evictions == 1
+
+    def test_big_value_evicts_many(self):
+        lru = make_dict(100)
+        for key in 'abcde':
+            lru[key] = 'x' * 20
+        lru['f'] = 'x' * 90
+
+        assert lru.keys() == ['f']
+        assert lru.current_bytes == 90
+
+    def test_values_over_entry_limit_are_rejected(self):
+        lru = make_dict(100, max_entry_bytes=50)
+        lru['a'] = 'x' * 10
+        lru['a'] = 'x' * 60
+
+        assert 'a' not in lru
+        assert lru.current_bytes == 0
+        assert lru.rejections == 1
+
+    def test_delete(self):
+        lru = make_dict(100)
+        lru['a'] = 'x' * 10
+        assert lru.pop('a') == 'x' * 10
+        assert lru.pop('a') is None
+        with pytest.raises(KeyError):
+            del lru['a']
+        assert lru.current_bytes == 0
+
+    def test_stats(self):
+        lru = make_dict(100, max_entry_bytes=50)
+        lru['a'] = 'x' * 10
+        assert lru.get_stats() == {
+            'entries': 1, 'bytes': 10, 'max_bytes': 100,
+            'max_entry_bytes': 50, 'evictions': 0, 'rejections': 0}
+
+
+def test_approximate_size():
+    small = approximate_size({'a': 'x'})
+    big = approximate_size({'a': 'x' * 10000, 'b': ['y' * 1000] * 10})
+    assert big - small > 20000
+
+
+class TestLRUMemoryBackend(object):
+
+    def test_byte_budget(self):
+        region = rc_cache.make_region().configure(
+            'dogpile.cache.rc.memory_lru',
+            arguments={'max_bytes': 100000, 'max_entry_bytes': 20000})
+        region.set('small', 'x' * 1000)
+        region.set('big', 'x' * 30000)
+
+        assert region.get('small') == 'x' * 1000
+        assert region.get('big') is NO_VALUE
+        usage = region.actual_backend.get_usage()
+        assert usage['entries'] == 1
+        assert 1000 < usage['bytes'] < 2000
+
+    def test_count_limit(self):
+        region = rc_cache.make_region().configure(
+            'dogpile.cache.rc.memory_lru', arguments={'max_size': 10})
+        region.set('key', 'value')
+        assert region.actual_backend.get_usage() == {
+            'entries': 1, 'max_size': 10}
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+"""
+Compares the size and the dump/load time of the cache serializers.
+
+Usage:
+
+- Benchmark generated payloads shaped like the results of
+  `compute_perm_tree` and `compute_file_tree`:
+
+    python cache_serializers.py --repositories=2000 --files=500
+
+- Benchmark the values stored in file_namespace cache files of a running
+  instance, e.g. the permission trees and the file trees:
+
+    python cache_serializers.py data/cache_user_auth.2.cache.dbm \
+        data/cache_repo.1.cache.dbm
+"""
+
+import anydbm
+import argparse
+import cPickle as pickle
+import timeit
+
+from dogpile.cache.api import CachedValue
+
+from rhodecode.lib.auth import PermOriginDict
+from rhodecode.lib.rc_cache.serializers import CacheSerializer, _compressors
+from rhodecode.lib.utils2 import AttributeDict
+
+
+def make_perm_tree(repositories):
+    perms = AttributeDict({
+        'global': set(['hg.admin', 'hg.create.repository', 'hg.fork.none',
+                       'hg.register.manual_activate', 'hg.password_reset.enabled']),
+        'repositories': PermOriginDict(),
+        'repositories_groups': PermOriginDict(),
+        'user_groups': PermOriginDict(),
+        'repository_branches': {},
+    })
+    for idx in xrange(repositories):
+        perms['repositories'][u'group-%s/repo-%s' % (idx % 50, idx)] = \
+            'repository.read', 'repo.default'
+    for idx in xrange(50):
+        perms['repositories_groups'][u'group-%s' % idx] = \
+            'group.read', 'group.default'
+    for idx in xrange(repositories // 20):
+        perms['user_groups'][u'users-%s' % idx] = \
+            'usergroup.read', 'usergroup.default'
+    return CachedValue(perms, {'ct': 1.0, 'v': 1})
+
+
+def make_file_tree(files):
+    row = (
+        u'<tr class="parity{parity}">'
+        u'<td class="td-componentname"><a href="/repo/files/{commit}/dir/'
+        u'file-{idx}.py" class="pjax-link"><i class="icon-file-text"></i>'
+        u'file-{idx}.py</a></td><td class="td-size">{size} B</td>'
+        u'<td class="td-hash"><div class="tooltip" title="commit message">'
+        u'<pre>r{idx}:{commit}</pre></div></td>'
+        u'<td class="td-user">Marcin Kuzminski &lt;marcin@rhodecode.com&gt;'
+        u'</td><td class="td-time"><time class="timeago" '
+        u'datetime="2019-01-01T10:00:00+0200">2019-01-01</time></td></tr>\n')
+    html = u''.join(
+        row.format(parity=idx % 2, idx=idx, size=idx * 37,
+                   commit='%040x' % (idx * 7919))
+        for idx in xrange(files))
+    return CachedValue(html, {'ct': 1.0, 'v': 1})
+
+
+def load_dbm_payloads(path):
+    db = anydbm.open(path, 'r')
+    try:
+        for key in db.keys():
+            try:
+                yield key, pickle.loads(db[key])
+            except Exception:
+                # stored in the new format already
+                yield key, CacheSerializer().loads(db[key])
+    finally:
+        db.close()
+
+
+def get_serializers():
+    compressions = [None] + sorted(_compressors)
+    for format_name in ('pickle', 'msgpack'):
+        for compression in compressions:
+            name = '{}+{}'.format(format_name, compression or 'none')
+            yield name, CacheSerializer(format_name, compression=compression)
+
+
+def benchmark(name, value, repeat):
+    legacy_size = len(pickle.dumps(value))
+    print('{} (legacy pickle: {} bytes)'.format(name, legacy_size))
+    for serializer_name, serializer in get_serializers():
+        data = serializer.dumps(value)
+        dumps_time = min(timeit.repeat(
+            lambda: serializer.dumps(value), repeat=repeat, number=1))
+        loads_time = min(timeit.repeat(
+            lambda: serializer.loads(data), repeat=repeat, number=1))
+        print('\t{:<16} {:>10} bytes {:>6.1f}% dumps {:>8.3f}ms '
+              'loads {:>8.3f}ms'.format(
+                  serializer_name, len(data),
+                  100.0 * len(data) / legacy_size,
+                  dumps_time * 1000, loads_time * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'dbm_files', nargs='*',
+        help='file_namespace cache files to take the payloads from')
+    parser.add_argument('--repositories', type=int, default=2000)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    options = parser.parse_args()
+
+    if options.dbm_files:
+        for path in options.dbm_files:
+            for key, value in load_dbm_payloads(path):
+                benchmark('{}: {}'.format(path, key), value, options.repeat)
+        return
+
+    benchmark('compute_perm_tree, {} repositories'.format(
+        options.repositories), make_perm_tree(options.repositories),
+        options.repeat)
+    benchmark('compute_file_tree, {} files'.format(options.files),
+              make_file_tree(options.files), options.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+
+import pytest
+
+from rhodecode.lib.vcs import call_stats
+
+
+@pytest.fixture
+def registry(request, monkeypatch):
+    registry = call_stats.CallStatsRegistry()
+    monkeypatch.setattr(call_stats, 'call_stats_registry', registry)
+
+    @request.addfinalizer
+    def cleanup():
+        call_stats.end_request()
+    return registry
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('http://localhost:9900/git', 'git'),
+    ('http://localhost:9900/_service', '_service'),
+    ('http://localhost:9900', 'unknown'),
+])
+def test_get_backend(url, expected):
+    assert call_stats.get_backend(url) == expected
+
+
+def test_histogram_puts_calls_into_buckets():
+    histogram = call_stats.CallHistogram()
+    histogram.add(0.001, 10, 100)
+    histogram.add(0.3, 10, 100)
+    histogram.add(100, 10, 100)
+
+    data = histogram.get_data()
+    assert data['count'] == 3
+    assert data['max_time'] == 100
+    assert data['request_bytes'] == 30
+    assert data['response_bytes'] == 300
+    assert data['histogram']['<=0.005s'] == 1
+    assert data['histogram']['<=0.5s'] == 1
+    assert data['histogram']['>10s'] == 1
+    assert sum(data['histogram'].values()) == 3
+
+
+def test_record_updates_registry_and_current_request(registry):
+    call_stats.record('git', 'bulk_request', 0.1, 10, 20)
+
+    request_stats = call_stats.start_request()
+    call_stats.record('git', 'bulk_request', 0.1, 10, 20)
+    call_stats.record('git', 'bulk_request', 0.2, 10, 20)
+    call_stats.record('hg', 'branches', 0.05, 10, 20)
+    assert call_stats.end_request() is request_stats
+
+    call_stats.record('git', 'bulk_request', 0.1, 10, 20)
+
+    assert request_stats.count == 3
+    assert request_stats.total_time == pytest.approx(0.35)
+    assert request_stats.slowest_methods(limit=1) == [
+        ('git', 'bulk_request', 2, pytest.approx(0.3))]
+
+    stats = registry.get_stats()
+    assert [(s['backend'], s['method'], s['count']) for s in stats] == [
+        ('git', 'bulk_request', 4), ('hg', 'branches', 1)]
+
+
+def test_call_timer_records_once(registry):
+    with call_stats.CallTimer('http://localhost/svn', 'get_file_content', 5) \
+            as timer:
+        timer.response_size = 15
+    timer.finish()
+
+    stats = registry.get_stats()
+    assert len(stats) == 1
+    assert stats[0]['backend'] == 'svn'
+    assert stats[0]['method'] == 'get_file_content'
+    assert stats[0]['count'] == 1
+    assert stats[0]['request_bytes'] == 5
+    assert stats[0]['response_bytes'] == 15
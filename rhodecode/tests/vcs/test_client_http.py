@@ -19,13 +19,15 @@
 # and proprietary license terms, please see https://rhodecode.com/licenses/
 
 import logging
+import zlib
 
 import mock
 import msgpack
 import pytest
 
 from rhodecode.lib import vcs
-from rhodecode.lib.vcs import client_http, exceptions
+from rhodecode.lib.vcs import (
+    call_stats, client_http, compression, exceptions, server_pool)
 
 
 def is_new_connection(logger, level, message):
@@ -131,3 +133,348 @@ def test_repo_maker_uses_session_that_throws_error(
 
     with pytest.raises(exceptions.HttpVCSCommunicationError):
         repo.example_call()
+
+
+def test_repo_batch_executes_calls_sequentially_by_default(
+        stub_session_factory, config):
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    with repo.batch() as batch:
+        first = batch.example_call()
+        second = batch.other_call(1, key='value')
+        assert not first.done()
+
+    assert first.done() and second.done()
+    assert stub_session_factory().post.call_count == 2
+
+
+def test_repo_batch_sends_one_multi_call(stub_session_factory, config):
+    stub_session_factory().post().content = msgpack.packb({
+        'result': [{'result': 'first'}, {'result': 'second'}]})
+    stub_session_factory().post.reset_mock()
+
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    with mock.patch.object(client_http.settings, 'VCSSERVER_BATCH_CALLS', True):
+        with repo.batch() as batch:
+            first = batch.example_call()
+            second = batch.other_call(1, key='value')
+
+    assert stub_session_factory().post.call_count == 1
+    payload = msgpack.unpackb(
+        stub_session_factory().post.call_args[1]['data'])
+    assert payload['method'] == client_http.RemoteBatch.MULTI_CALL_METHOD
+    assert [c['method'] for c in payload['params']['calls']] == [
+        'example_call', 'other_call']
+    assert first.result() == 'first'
+    assert second.result() == 'second'
+
+
+def test_repo_batch_raises_error_of_single_call(stub_session_factory, config):
+    stub_session_factory().post().content = msgpack.packb({
+        'result': [
+            {'result': 'first'},
+            {'error': {'message': 'no such commit', '_vcs_kind': 'lookup'}}]})
+
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    with mock.patch.object(client_http.settings, 'VCSSERVER_BATCH_CALLS', True):
+        with repo.batch() as batch:
+            first = batch.example_call()
+            second = batch.other_call()
+
+    assert first.result() == 'first'
+    with pytest.raises(exceptions.CommitDoesNotExistError):
+        second.result()
+
+
+def test_repo_batch_future_result_executes_pending_calls(
+        stub_session_factory, config):
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    batch = repo.batch()
+    future = batch.example_call()
+    assert len(batch) == 1
+    assert future.result() is None
+    assert len(batch) == 0
+    assert stub_session_factory().post.call_count == 1
+
+
+def test_repo_call_payload_contains_serialized_wire(
+        stub_session_factory, config):
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+    repo.example_call(1, key='value')
+
+    payload = msgpack.unpackb(
+        stub_session_factory().post.call_args[1]['data'])
+    assert payload['method'] == 'example_call'
+    assert payload['params']['args'] == [1]
+    assert payload['params']['kwargs'] == {'key': 'value'}
+    assert payload['params']['wire']['path'] == 'stub_path'
+    assert ['section-a', 'a-1', 'value-a-1'] in \
+        payload['params']['wire']['config']
+
+
+def test_repo_wire_is_serialized_only_on_changes(
+        stub_session_factory, config):
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    with mock.patch.object(
+            config, 'serialize', wraps=config.serialize) as serialize:
+        repo.example_call()
+        repo.example_call()
+        assert serialize.call_count == 1
+
+        config.set('section-b', 'b-1', 'value-b-1')
+        repo.example_call()
+        assert serialize.call_count == 2
+
+        repo.invalidate_vcs_cache()
+        repo.example_call()
+        assert serialize.call_count == 3
+
+    payload = msgpack.unpackb(
+        stub_session_factory().post.call_args[1]['data'])
+    assert payload['params']['wire']['context'] == repo._wire['context']
+    assert ['section-b', 'b-1', 'value-b-1'] in \
+        payload['params']['wire']['config']
+
+
+@pytest.fixture
+def stub_stream_session():
+    """
+    Stub of `requests.Session()` used for streamed calls.
+    """
+    session = mock.Mock()
+    post = session.post()
+    post.status_code = 200
+
+    session.reset_mock()
+    return session
+
+
+def _set_stream_response(session, *objects):
+    data = ''.join(msgpack.packb(obj) for obj in objects)
+    # split the data in small parts, objects span over multiple parts
+    parts = [data[i:i + 3] for i in range(0, len(data), 3)]
+    session.post().iter_content.return_value = iter(parts)
+    session.post.reset_mock()
+
+
+def test_repo_stream_call_returns_chunks(
+        stub_session_factory, stub_stream_session, config):
+    _set_stream_response(
+        stub_stream_session, {'chunked': True}, 'first chunk', 'second chunk')
+
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+    with mock.patch.object(client_http, 'stream_session_factory',
+                           return_value=stub_stream_session):
+        chunks = repo.stream_call('example_call', 'a1')
+        assert list(chunks) == ['first chunk', 'second chunk']
+
+    assert stub_stream_session.post.call_args[1]['stream'] is True
+    payload = msgpack.unpackb(stub_stream_session.post.call_args[1]['data'])
+    assert payload['method'] == 'example_call'
+    assert payload['params']['args'] == ['a1']
+    assert payload['params']['chunked'] is True
+
+
+def test_repo_stream_call_falls_back_to_single_chunk(
+        stub_session_factory, stub_stream_session, config):
+    _set_stream_response(stub_stream_session, {'result': 'whole result'})
+
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+    with mock.patch.object(client_http, 'stream_session_factory',
+                           return_value=stub_stream_session):
+        chunks = repo.stream_call('example_call')
+        assert list(chunks) == ['whole result']
+
+
+def test_repo_stream_call_maps_errors(
+        stub_session_factory, stub_stream_session, config):
+    _set_stream_response(stub_stream_session, {
+        'error': {'message': 'no such commit', '_vcs_kind': 'lookup'}})
+
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+    with mock.patch.object(client_http, 'stream_session_factory',
+                           return_value=stub_stream_session):
+        with pytest.raises(exceptions.CommitDoesNotExistError):
+            repo.stream_call('example_call')
+
+
+def test_repo_call_is_recorded_in_call_stats(
+        stub_session_factory, config, monkeypatch):
+    registry = call_stats.CallStatsRegistry()
+    monkeypatch.setattr(call_stats, 'call_stats_registry', registry)
+
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', '/git', 'git', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    request_stats = call_stats.start_request()
+    try:
+        repo.example_call()
+    finally:
+        call_stats.end_request()
+
+    assert request_stats.slowest_methods() == [
+        ('git', 'example_call', 1, request_stats.total_time)]
+    assert registry.get_stats()[0]['response_bytes'] == len(msgpack.packb({}))
+
+
+def test_repo_calls_fail_over_to_next_server(stub_session, config):
+    pool = server_pool.VcsServerPool(['vcs1:9900', 'vcs2:9900'])
+    primary, secondary = pool.get_nodes('stub_path')
+
+    failing_session = mock.Mock()
+    failing_session.post.side_effect = exceptions.HttpVCSConnectionError()
+    sessions = {primary: failing_session, secondary: stub_session}
+
+    repo_maker = client_http.RepoMaker(
+        pool, '/git', 'git', lambda server: sessions[server])
+    repo = repo_maker('stub_path', config)
+    repo.example_call()
+
+    stub_session.post.assert_called_with(
+        'http://{}/git'.format(secondary), data=mock.ANY)
+    assert not pool.is_available(primary)
+
+
+@pytest.fixture
+def call_cache_region(monkeypatch):
+    from rhodecode.lib.rc_cache import region_meta, make_region
+    region = make_region().configure('dogpile.cache.memory')
+    monkeypatch.setitem(
+        region_meta.dogpile_cache_regions, 'cache_vcs_calls', region)
+    return region
+
+
+def test_repo_immutable_calls_are_cached(
+        stub_session_factory, config, call_cache_region):
+    stub_session_factory().post().content = msgpack.packb(
+        {'result': ['tree-item']})
+    stub_session_factory().post.reset_mock()
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', '/git', 'git', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+    other_repo = repo_maker('other_path', config)
+
+    sha = 'a' * 40
+    assert repo.tree_items(sha) == ['tree-item']
+    assert repo.tree_items(sha) == ['tree-item']
+    assert stub_session_factory().post.call_count == 1
+
+    # the cache is per repository, and only used for full object ids
+    other_repo.tree_items(sha)
+    repo.tree_items('master')
+    repo.branches()
+    assert stub_session_factory().post.call_count == 4
+
+
+def test_repo_big_results_are_not_cached(
+        stub_session_factory, config, call_cache_region):
+    stub_session_factory().post().content = msgpack.packb(
+        {'result': 'x' * (client_http.RemoteCallCache.max_item_size + 1)})
+    stub_session_factory().post.reset_mock()
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', '/git', 'git', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    repo.blob_as_pretty_string('a' * 40)
+    repo.blob_as_pretty_string('a' * 40)
+    assert stub_session_factory().post.call_count == 2
+
+
+def test_repo_batch_uses_call_cache(
+        stub_session_factory, config, call_cache_region):
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', '/git', 'git', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    stub_session_factory().post().content = msgpack.packb({'result': 10})
+    repo.blob_raw_length('a' * 40)
+
+    stub_session_factory().post().content = msgpack.packb({
+        'result': [{'result': 20}, {'result': 30}]})
+    with mock.patch.object(client_http.settings, 'VCSSERVER_BATCH_CALLS', True):
+        with repo.batch() as batch:
+            cached = batch.blob_raw_length('a' * 40)
+            first = batch.blob_raw_length('b' * 40)
+            second = batch.blob_raw_length('c' * 40)
+
+    assert [cached.result(), first.result(), second.result()] == [10, 20, 30]
+    payload = msgpack.unpackb(
+        stub_session_factory().post.call_args[1]['data'])
+    assert len(payload['params']['calls']) == 2
+    assert repo.blob_raw_length('c' * 40) == 30
+
+
+@pytest.fixture
+def zlib_compression(monkeypatch):
+    monkeypatch.setattr(client_http.settings, 'VCSSERVER_COMPRESSION', 'zlib')
+    monkeypatch.setattr(
+        client_http.settings, 'VCSSERVER_COMPRESSION_MIN_SIZE', 1000)
+    monkeypatch.setattr(
+        compression, 'compression_stats', compression.CompressionStats())
+
+
+def test_repo_call_compresses_big_requests(
+        stub_session_factory, config, zlib_compression):
+    stub_session_factory().post().headers = {}
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    repo.example_call('small')
+    headers = stub_session_factory().post.call_args[1]['headers']
+    assert headers == {'Accept-Encoding': 'deflate'}
+
+    repo.example_call('x' * 5000)
+    kwargs = stub_session_factory().post.call_args[1]
+    assert kwargs['headers'] == {
+        'Accept-Encoding': 'deflate', 'Content-Encoding': 'deflate'}
+    payload = msgpack.unpackb(zlib.decompress(kwargs['data']))
+    assert payload['params']['args'] == ['x' * 5000]
+
+    stats = compression.compression_stats.get_data()
+    assert stats['sent_raw_bytes'] > 5000
+    assert stats['saved_bytes'] > 4000
+
+
+def test_repo_call_decompresses_responses(
+        stub_session_factory, config, zlib_compression):
+    response = stub_session_factory().post()
+    response.content = zlib.compress(msgpack.packb({'result': 'y' * 1000}))
+    response.headers = {'content-encoding': 'deflate'}
+    repo_maker = client_http.RepoMaker(
+        'server_and_port', 'endpoint', 'test_dummy_scm', stub_session_factory)
+    repo = repo_maker('stub_path', config)
+
+    assert repo.example_call() == 'y' * 1000
+    stats = compression.compression_stats.get_data()
+    assert stats['received_compressed_bytes'] == len(response.content)
+    assert stats['received_raw_bytes'] > 1000
+
+
+def test_unknown_compression_codec():
+    assert compression.get_codec('') is None
+    with pytest.raises(ValueError):
+        compression.get_codec('no-such-codec')
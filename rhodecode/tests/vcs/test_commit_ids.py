@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+import hashlib
+
+import mock
+import pytest
+
+from rhodecode.lib.vcs.backends.commit_ids import (
+    CommitIdList, LazyCommitIds, compact_commit_ids)
+
+
+def make_ids(start, stop):
+    return [hashlib.sha1(str(idx)).hexdigest() for idx in range(start, stop)]
+
+
+def test_commit_id_list_behaves_like_a_list():
+    commit_ids = make_ids(0, 50)
+    commit_id_list = CommitIdList.from_commit_ids(commit_ids)
+
+    assert len(commit_id_list) == 50
+    assert commit_id_list == commit_ids
+    assert list(commit_id_list) == commit_ids
+    assert commit_id_list[0] == commit_ids[0]
+    assert commit_id_list[-1] == commit_ids[-1]
+    assert commit_id_list[10:20] == commit_ids[10:20]
+    assert commit_id_list[40:] == commit_ids[40:]
+    assert commit_id_list[::7] == commit_ids[::7]
+    assert commit_ids[5] in commit_id_list
+    with pytest.raises(IndexError):
+        commit_id_list[50]
+
+
+def test_commit_id_positions_behave_like_a_dict():
+    commit_ids = make_ids(0, 50)
+    positions = CommitIdList.from_commit_ids(commit_ids).positions
+
+    for idx, commit_id in enumerate(commit_ids):
+        assert positions[commit_id] == idx
+    assert make_ids(50, 51)[0] not in positions
+    assert positions.get('tip', 'default') == 'default'
+    with pytest.raises(KeyError):
+        positions[make_ids(50, 51)[0]]
+
+
+def test_commit_id_list_append():
+    commit_id_list = CommitIdList.from_commit_ids(make_ids(0, 3))
+    new_id = make_ids(3, 4)[0]
+
+    commit_id_list.append(new_id)
+
+    assert len(commit_id_list) == 4
+    assert commit_id_list[-1] == new_id
+    assert commit_id_list[2:] == make_ids(2, 4)
+    assert commit_id_list.positions[new_id] == 3
+
+
+def test_commit_id_list_of_unicode_ids():
+    commit_ids = make_ids(0, 3)
+    commit_id_list = CommitIdList.from_commit_ids(map(unicode, commit_ids))
+
+    assert commit_id_list == commit_ids
+    assert commit_id_list.positions[unicode(commit_ids[1])] == 1
+
+
+def test_compact_commit_ids_keeps_other_ids():
+    commit_ids = ['1', '2', '3']
+    assert compact_commit_ids(commit_ids) is commit_ids
+    assert compact_commit_ids([]) == []
+
+
+class TestLazyCommitIds(object):
+
+    def _make(self, commit_ids, fetch_all=True):
+        get_count = mock.Mock(return_value=len(commit_ids))
+        get_range = mock.Mock(
+            side_effect=lambda start, stop, count: commit_ids[start:stop])
+        return LazyCommitIds(get_count, get_range, fetch_all), get_range
+
+    def test_fetches_only_requested_range(self):
+        commit_ids = make_ids(0, 100)
+        lazy_ids, get_range = self._make(commit_ids)
+
+        assert len(lazy_ids) == 100
+        assert lazy_ids[80:100] == commit_ids[80:100]
+        get_range.assert_called_once_with(80, 100, 100)
+
+    def test_fetches_everything_for_second_range(self):
+        commit_ids = make_ids(0, 100)
+        lazy_ids, get_range = self._make(commit_ids)
+
+        assert lazy_ids[0:50] == commit_ids[0:50]
+        assert lazy_ids[50:100] == commit_ids[50:100]
+        assert lazy_ids[-1] == commit_ids[-1]
+        assert list(lazy_ids) == commit_ids
+        assert get_range.call_args_list == [
+            mock.call(0, 50, 100), mock.call(0, 100, 100)]
+
+    def test_items(self):
+        commit_ids = make_ids(0, 10)
+        lazy_ids, __ = self._make(commit_ids)
+
+        assert lazy_ids[3] == commit_ids[3]
+        assert lazy_ids[-2] == commit_ids[-2]
+        assert lazy_ids[5:2] == []
+        assert commit_ids[7] in lazy_ids
+        with pytest.raises(IndexError):
+            lazy_ids[10]
+
+    @pytest.mark.parametrize('start, stop', [
+        (None, None), (10, None), (None, 20), (10, 20), (30, 10), (0, 500),
+    ])
+    def test_window(self, start, stop):
+        commit_ids = make_ids(0, 50)
+        window = LazyCommitIds.window(commit_ids, start, stop)
+
+        assert len(window) == len(commit_ids[start:stop])
+        assert window[:] == commit_ids[start:stop]
+        assert window[2:5] == commit_ids[start:stop][2:5]
+
+    def test_window_of_lazy_ids(self):
+        commit_ids = make_ids(0, 100)
+        lazy_ids, get_range = self._make(commit_ids)
+        window = LazyCommitIds.window(lazy_ids, 10, 90)
+
+        assert window[:5] == commit_ids[10:15]
+        get_range.assert_called_once_with(10, 15, 100)
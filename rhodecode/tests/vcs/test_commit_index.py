@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2016-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+import fcntl
+import hashlib
+import os
+import threading
+
+import mock
+import pytest
+
+from rhodecode.lib.vcs.backends.commit_ids import CommitIdList
+from rhodecode.lib.vcs.backends.git import commit_index
+from rhodecode.lib.vcs.backends.git.commit_index import CommitIndexStore
+
+
+def make_ids(start, stop):
+    return [hashlib.sha1(str(idx)).hexdigest() for idx in range(start, stop)]
+
+
+@pytest.fixture
+def store(tmpdir):
+    return CommitIndexStore(str(tmpdir.join('index')))
+
+
+def test_load_maps_stored_index(store):
+    index = store.load(store.write(make_ids(0, 10), ['tip']))
+
+    assert isinstance(index, CommitIdList)
+    assert index == make_ids(0, 10)
+    assert index.positions[make_ids(3, 4)[0]] == 3
+
+
+def test_update_builds_missing_index(store):
+    commit_ids = make_ids(0, 10)
+    get_new = mock.Mock()
+
+    index = store.update(['tip'], lambda: commit_ids, get_new)
+
+    assert index == commit_ids
+    assert not get_new.called
+
+
+def test_update_keeps_index_of_unchanged_tips(store):
+    store.write(make_ids(0, 10), ['tip'])
+    get_all = mock.Mock()
+    get_new = mock.Mock()
+
+    index = store.update(['tip'], get_all, get_new)
+
+    assert index == make_ids(0, 10)
+    assert not get_all.called
+    assert not get_new.called
+
+
+def test_update_appends_new_commits(store):
+    store.write(make_ids(0, 10), ['tip'])
+    get_all = mock.Mock()
+    get_new = mock.Mock(return_value=make_ids(10, 15))
+
+    index = store.update(['new-tip'], get_all, get_new)
+
+    get_new.assert_called_once_with(['tip'], ['new-tip'])
+    assert not get_all.called
+    assert index == make_ids(0, 15)
+    assert index.positions[make_ids(12, 13)[0]] == 12
+    assert store.read_meta()['tips'] == ['new-tip']
+
+
+def test_update_rebuilds_index_when_commits_are_removed(store):
+    store.write(make_ids(0, 10), ['tip'])
+    get_new = mock.Mock(return_value=None)
+
+    index = store.update(['other-tip'], lambda: make_ids(0, 5), get_new)
+
+    assert index == make_ids(0, 5)
+
+
+def test_update_sorts_long_tails(store):
+    store.write(make_ids(0, 10), ['tip'])
+
+    with mock.patch.object(commit_index, 'MAX_UNSORTED', 3):
+        store.update(['tip-2'], None, lambda old, new: make_ids(10, 12))
+        assert store.read_meta()['sorted_count'] == 10
+        index = store.update(['tip-3'], None, lambda old, new: make_ids(12, 20))
+
+    meta = store.read_meta()
+    assert meta['sorted_count'] == 20
+    assert index == make_ids(0, 20)
+    assert index.positions[make_ids(11, 12)[0]] == 11
+    data_files = [name for name in os.listdir(store.path)
+                  if name.startswith(('ids-', 'sorted-'))]
+    assert sorted(data_files) == sorted(
+        [meta['ids_file'], meta['sorted_file']])
+
+
+def test_update_drops_leftovers_of_interrupted_append(store):
+    meta = store.write(make_ids(0, 10), ['tip'])
+    with open(os.path.join(store.path, meta['ids_file']), 'ab') as f:
+        f.write('garbage')
+
+    index = store.update(['tip-2'], None, lambda old, new: make_ids(10, 11))
+
+    assert index == make_ids(0, 11)
+
+
+def hold_lock(store):
+    os.makedirs(store.path)
+    lock_file = open(os.path.join(store.path, 'lock'), 'a')
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def test_update_waits_for_lock_of_other_update(store):
+    lock_file = hold_lock(store)
+    threading.Timer(0.1, lock_file.close).start()
+
+    index = store.update(['tip'], lambda: make_ids(0, 10), None)
+
+    assert index == make_ids(0, 10)
+
+
+def test_update_fails_after_lock_timeout(store):
+    lock_file = hold_lock(store)
+    try:
+        with mock.patch.object(commit_index, 'LOCK_TIMEOUT', 0.1):
+            with pytest.raises(IOError):
+                store.update(['tip'], lambda: make_ids(0, 10), None)
+    finally:
+        lock_file.close()
+    assert store.read_meta() is None
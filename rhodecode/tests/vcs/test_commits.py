@@ -21,10 +21,17 @@
 import datetime
 import time
 
+import mock
 import pytest
 
 from rhodecode.lib.vcs.backends.base import (
     CollectionGenerator, FILEMODE_DEFAULT, EmptyCommit)
+from rhodecode.lib.vcs.backends.hg.commit import MercurialCommit
+from rhodecode.lib.vcs.backends.hg.repository import (
+    MercurialCollectionGenerator)
+from rhodecode.lib.vcs.backends.svn.commit import SubversionCommit
+from rhodecode.lib.vcs.backends.svn.repository import (
+    SubversionCollectionGenerator)
 from rhodecode.lib.vcs.exceptions import (
     BranchDoesNotExistError, CommitDoesNotExistError,
     RepositoryError, EmptyRepositoryError)
@@ -587,6 +594,63 @@ class TestCommitsChanges(BackendTestMixin):
         assert len(history) == 1
 
 
+class TestCollectionGeneratorBulkPreLoad(object):
+
+    def _make_repo(self, get_commit):
+        repo = mock.Mock()
+        repo._remote.batch.return_value = mock.MagicMock()
+        repo.get_commit.side_effect = get_commit
+        repo.commit_ids = ['1', '2', '3']
+        return repo
+
+    def test_hg_loads_properties_of_batch(self):
+        repo = self._make_repo(lambda commit_id=None, **kwargs: MercurialCommit(
+            repo, commit_id, int(commit_id, 16)))
+        batch = repo._remote.batch.return_value.__enter__.return_value
+        batch.bulk_request.return_value.result.return_value = {
+            'author': 'Joe Doe <joe.doe@example.com>', 'message': 'fix'}
+
+        collection = MercurialCollectionGenerator(
+            repo, ['a' * 40, 'b' * 40], pre_load=['author', 'message'])
+        commits = list(collection)
+
+        assert [c.author for c in commits] == [
+            u'Joe Doe <joe.doe@example.com>'] * 2
+        assert [c.message for c in commits] == [u'fix'] * 2
+        assert repo._remote.batch.call_count == 1
+        assert batch.bulk_request.call_args_list == [
+            mock.call(commits[0].idx, ['author', 'message']),
+            mock.call(commits[1].idx, ['author', 'message'])]
+        assert not repo._remote.bulk_request.called
+
+    def test_svn_loads_properties_of_batch(self):
+        repo = self._make_repo(lambda commit_id=None, **kwargs: SubversionCommit(
+            repo, commit_id))
+        repo._get_commit_idx.side_effect = lambda commit_id: int(commit_id) - 1
+        batch = repo._remote.batch.return_value.__enter__.return_value
+        batch.revision_properties.return_value.result.return_value = {
+            'svn:author': 'joe', 'svn:log': 'fix'}
+
+        collection = SubversionCollectionGenerator(
+            repo, ['1', '2', '3'], pre_load=['author', 'message'])
+        commits = list(collection)
+
+        assert [c.author for c in commits] == [u'joe'] * 3
+        assert [c.message for c in commits] == [u'fix'] * 3
+        assert batch.revision_properties.call_args_list == [
+            mock.call(1), mock.call(2), mock.call(3)]
+        assert not repo._remote.revision_properties.called
+
+    def test_svn_skips_properties_if_not_pre_loaded(self):
+        repo = self._make_repo(lambda commit_id=None, **kwargs: SubversionCommit(
+            repo, commit_id))
+        repo._get_commit_idx.side_effect = lambda commit_id: int(commit_id) - 1
+
+        list(SubversionCollectionGenerator(repo, ['1'], pre_load=['parents']))
+
+        assert not repo._remote.batch.called
+
+
 def assert_text_equal(expected, given):
     assert expected == given
     assert isinstance(expected, unicode)
@@ -50,3 +50,11 @@ def test_changes_in_the_original_dont_affect_the_copy(config):
     clone = config.copy()
     config.set('section-a', 'a-2', 'value-a-2')
     assert set(clone.serialize()) == {('section-a', 'a-1', 'value-a-1')}
+
+
+def test_changes_bump_the_version(config):
+    version = config.version
+    config.set('section-a', 'a-2', 'value-a-2')
+    assert config.version == version + 1
+    config.clear_section('section-a')
+    assert config.version == version + 2
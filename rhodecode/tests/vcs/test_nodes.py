@@ -247,6 +247,12 @@ class TestNodeBasics:
         assert (1, 1) == py_node.lines()
         assert (1, 1) == py_node.lines(count_empty=True)
 
+    def test_content_id(self):
+        node = FileNode('test.py', 'oneline')
+
+        assert node.content_id == FileNode('other.py', 'oneline').content_id
+        assert node.content_id != FileNode('test.py', 'changed').content_id
+
 
 class TestNodeContent(object):
 
@@ -273,3 +279,12 @@ class TestNodesCommits(BackendTestMixin):
         for x in xrange(3):
             node = last_commit.get_node('file_%s.txt' % x)
             assert node.last_commit == repo[x]
+
+    def test_node_content_id(self, generate_repo_with_commits):
+        repo = generate_repo_with_commits(3)
+        first_node = repo[0].get_node('file_0.txt')
+        last_node = repo.get_commit().get_node('file_0.txt')
+        other_node = repo.get_commit().get_node('file_1.txt')
+
+        assert first_node.content_id == last_node.content_id
+        assert first_node.content_id != other_node.content_id
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2010-2019 RhodeCode GmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License, version 3
+# (only), as published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# This program is dual-licensed. If you wish to learn more about the
+# RhodeCode Enterprise Edition, including its added features, Support services,
+# and proprietary license terms, please see https://rhodecode.com/licenses/
+
+
+import mock
+import pytest
+
+from rhodecode.lib.vcs import exceptions
+from rhodecode.lib.vcs.server_pool import VcsServerPool, parse_servers
+
+
+SERVERS = ['vcs1:9900', 'vcs2:9900', 'vcs3:9900']
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('localhost:9900', ['localhost:9900']),
+    ('vcs1:9900, vcs2:9900', ['vcs1:9900', 'vcs2:9900']),
+    ('vcs1:9900 vcs2:9900,vcs1:9900', ['vcs1:9900', 'vcs2:9900']),
+])
+def test_parse_servers(value, expected):
+    assert parse_servers(value) == expected
+
+
+def test_pool_requires_a_server():
+    with pytest.raises(ValueError):
+        VcsServerPool('')
+
+
+def test_pool_routes_repositories_consistently():
+    pool = VcsServerPool(SERVERS)
+    other_pool = VcsServerPool(list(reversed(SERVERS)))
+
+    for idx in range(50):
+        key = '/repos/repo-{}'.format(idx)
+        nodes = pool.get_nodes(key)
+        assert sorted(nodes) == sorted(SERVERS)
+        assert nodes == other_pool.get_nodes(key)
+
+
+def test_pool_spreads_repositories_over_servers():
+    pool = VcsServerPool(SERVERS)
+    used = set(pool.get_node('/repos/repo-{}'.format(idx))
+               for idx in range(100))
+    assert used == set(SERVERS)
+
+
+def test_pool_keeps_repositories_of_remaining_servers_in_place():
+    pool = VcsServerPool(SERVERS)
+    smaller_pool = VcsServerPool(SERVERS[:2])
+
+    for idx in range(100):
+        key = '/repos/repo-{}'.format(idx)
+        if pool.get_node(key) != SERVERS[2]:
+            assert smaller_pool.get_node(key) == pool.get_node(key)
+
+
+def test_pool_moves_failed_servers_to_the_end():
+    pool = VcsServerPool(SERVERS)
+    key = '/repos/repo'
+    primary = pool.get_node(key)
+
+    pool.mark_failed(primary)
+    assert pool.get_nodes(key)[-1] == primary
+
+    pool.mark_available(primary)
+    assert pool.get_node(key) == primary
+
+
+def test_pool_retries_failed_servers_after_interval():
+    pool = VcsServerPool(SERVERS, retry_interval=30)
+    key = '/repos/repo'
+    primary = pool.get_node(key)
+
+    with mock.patch('time.time', return_value=1000):
+        pool.mark_failed(primary)
+    with mock.patch('time.time', return_value=1010):
+        assert pool.get_node(key) != primary
+    with mock.patch('time.time', return_value=1030):
+        assert pool.get_node(key) == primary
+
+
+def test_pool_call_fails_over():
+    pool = VcsServerPool(SERVERS)
+    key = '/repos/repo'
+    primary, secondary = pool.get_nodes(key)[:2]
+
+    def call(server):
+        if server == primary:
+            raise exceptions.HttpVCSConnectionError('down')
+        return server
+
+    assert pool.call(key, call) == secondary
+    assert not pool.is_available(primary)
+
+
+def test_pool_call_raises_if_no_server_is_reachable():
+    pool = VcsServerPool(SERVERS)
+
+    def call(server):
+        raise exceptions.HttpVCSConnectionError(server)
+
+    with pytest.raises(exceptions.HttpVCSConnectionError):
+        pool.call('/repos/repo', call)
+
+
+def test_pool_call_does_not_retry_other_errors():
+    pool = VcsServerPool(SERVERS)
+    call = mock.Mock(side_effect=exceptions.HttpVCSCommunicationError())
+
+    with pytest.raises(exceptions.HttpVCSCommunicationError):
+        pool.call('/repos/repo', call)
+    assert call.call_count == 1